@@ -1,5 +1,6 @@
 
-import data_utils
+import os
+from RepresentationExperiments import data_utils
 import numpy as np
 from sklearn import svm
 from sklearn.cluster import KMeans
@@ -8,7 +9,11 @@ from sklearn.model_selection import LeaveOneOut
 
 # Importing data
 
-xs,ys = data_utils.load_data("../activations-small.pkl")
+# a ragged store converted with `python -m data.ragged_store` opens instantly
+if os.path.isdir("../activations-small.store"):
+    xs,ys = data_utils.load_data("../activations-small.store")
+else:
+    xs,ys = data_utils.load_data("../activations-small.pkl")
 
 # Creating a single array of time-steps descriptions by concatenating
 # the descriptions of each example
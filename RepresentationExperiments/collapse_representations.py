@@ -1,6 +1,6 @@
 import numpy as np
 import pickle
-import data_utils
+from RepresentationExperiments import data_utils
 
 def collapse_activations(xs, ys, thresh=30):
     new_activations = []
@@ -2,6 +2,7 @@ from models.som.SOM import SOM
 from models.som.HebbianModel import HebbianModel
 from utils.constants import Constants
 from utils.utils import from_csv_with_filenames, from_csv_visual, from_csv, to_csv
+from utils.utils import collapse_duplicates
 from sklearn.utils import shuffle
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.model_selection import train_test_split
@@ -30,6 +31,13 @@ parser.add_argument('--algo', metavar='algo', type=str, default='sorted',
 parser.add_argument('--source', metavar='source', type=str, default='v',
                     help='Source SOM')
 parser.add_argument('--train', action='store_true', default=False)
+parser.add_argument('--lr-sweep', metavar='lr', type=float, nargs='+', default=None,
+                    help='Train and evaluate one model per learning rate in a single run')
+parser.add_argument('--collapse-duplicates', action='store_true', default=False,
+                    help='Train the SOMs once on each distinct input, weighted by its count; '
+                         'this takes fewer update steps per iteration')
+parser.add_argument('--presentations', metavar='presentations', type=int, default=14,
+                    help='Number of presentations of each class')
 args = parser.parse_args()
 exp_description = 'lr' + str(args.lr) + '_algo_' + args.algo + '_source_' + args.source
 
@@ -96,37 +104,65 @@ if __name__ == '__main__':
     a_xs_train, a_xs_test, a_ys_train, a_ys_test = train_test_split(a_xs, a_ys, test_size=0.2)
     v_xs_train, v_xs_test, v_ys_train, v_ys_test = train_test_split(v_xs, v_ys, test_size=0.2)
 
-    if args.train:
+    if args.train and args.collapse_duplicates:
+        # duplicate inputs are trained on once, weighted by their count: with
+        # fewer rows, each iteration runs fewer batches, so the maps train differently
+        a_xs_unique, a_weights, _ = collapse_duplicates(a_xs)
+        v_xs_unique, v_weights, _ = collapse_duplicates(v_xs)
+        som_a.train(a_xs_unique, sample_weights=a_weights)
+        som_v.train(v_xs_unique, sample_weights=v_weights)
+    elif args.train:
         som_a.train(a_xs)
         som_v.train(v_xs)
     else:
         som_a.restore_trained()
         som_v.restore_trained()
 
-    acc_a_list = []
-    acc_v_list = []
-    for n in range(1, 15):
+    # prepare the soms for alternative matching strategies - this is not necessary
+    # if prediction_alg='regular' in hebbian_model.evaluate(...) below
+    som_a.memorize_examples_by_class(a_xs_train, a_ys_train)
+    som_v.memorize_examples_by_class(v_xs_train, v_ys_train)
+    # the folds for n presentations are the first n*n_classes examples of these
+    a_xs_fold, v_xs_fold, a_ys_fold, v_ys_fold = create_folds(a_xs_train, v_xs_train, a_ys_train, v_ys_train, n_folds=args.presentations)
+
+    if args.lr_sweep is not None:
         hebbian_model = HebbianModel(som_a, som_v, a_dim=a_dim,
-                                     v_dim=v_dim, n_presentations=n,
-                                     checkpoint_dir=hebbian_path,
-                                     learning_rate=args.lr)
-        a_xs_fold, v_xs_fold, a_ys_fold, v_ys_fold = create_folds(a_xs_train, v_xs_train, a_ys_train, v_ys_train, n_folds=n)
-        # prepare the soms for alternative matching strategies - this is not necessary
-        # if prediction_alg='regular' in hebbian_model.evaluate(...) below
-        som_a.memorize_examples_by_class(a_xs_train, a_ys_train)
-        som_v.memorize_examples_by_class(v_xs_train, v_ys_train)
+                                     v_dim=v_dim, n_presentations=args.presentations)
         print('Training...')
-        hebbian_model.train(a_xs_fold, v_xs_fold)
+        weights = hebbian_model.train_sweep(a_xs_fold, v_xs_fold, args.lr_sweep)
         print('Evaluating...')
-        accuracy_a = hebbian_model.evaluate(a_xs_test, v_xs_test, a_ys_test, v_ys_test, source='a',
-                                          prediction_alg=args.algo)
-        accuracy_v = hebbian_model.evaluate(a_xs_test, v_xs_test, a_ys_test, v_ys_test, source='v',
-                                          prediction_alg=args.algo)
-        print('n={}, accuracy_a={}, accuracy_v={}'.format(n, accuracy_a, accuracy_v))
-        acc_a_list.append(accuracy_a)
-        acc_v_list.append(accuracy_v)
-        # make a plot - placeholder
-        hebbian_model.make_plot(a_xs_test[0], v_xs_test[0], v_ys_test[0], v_xs_fold[0], source='a')
-    plt.plot(acc_a_list, color='teal')
-    plt.plot(acc_v_list, color='orange')
-    plt.savefig('./plots/'+exp_description+'.pdf', transparent=True)
+        accuracies_a = hebbian_model.evaluate_sweep(weights, a_xs_test, v_xs_test, a_ys_test, v_ys_test,
+                                                    source='a', prediction_alg=args.algo)
+        accuracies_v = hebbian_model.evaluate_sweep(weights, a_xs_test, v_xs_test, a_ys_test, v_ys_test,
+                                                    source='v', prediction_alg=args.algo)
+        table = np.column_stack((args.lr_sweep, accuracies_a, accuracies_v))
+        print('lr, accuracy_a, accuracy_v')
+        for lr, accuracy_a, accuracy_v in table:
+            print('{}, {}, {}'.format(lr, accuracy_a, accuracy_v))
+        sweep_description = 'lr_sweep_n' + str(args.presentations) + '_algo_' + args.algo
+        np.savetxt('./plots/'+sweep_description+'.csv', table, delimiter=',',
+                   header='lr,accuracy_a,accuracy_v', comments='')
+    else:
+        hebbian_model = HebbianModel(som_a, som_v, a_dim=a_dim,
+                                     v_dim=v_dim, n_presentations=1,
+                                     checkpoint_dir=hebbian_path,
+                                     learning_rate=args.lr)
+
+        def evaluate(model, n):
+            accuracy_a = model.evaluate(a_xs_test, v_xs_test, a_ys_test, v_ys_test, source='a',
+                                        prediction_alg=args.algo)
+            accuracy_v = model.evaluate(a_xs_test, v_xs_test, a_ys_test, v_ys_test, source='v',
+                                        prediction_alg=args.algo)
+            print('n={}, accuracy_a={}, accuracy_v={}'.format(n, accuracy_a, accuracy_v))
+            # make a plot - placeholder
+            model.make_plot(a_xs_test[0], v_xs_test[0], v_ys_test[0], v_xs_fold[0], source='a')
+            return accuracy_a, accuracy_v
+
+        print('Training and evaluating...')
+        # adds one presentation at a time to the same model
+        accuracies = hebbian_model.presentation_curve(a_xs_fold, v_xs_fold, evaluate)
+        acc_a_list = [accuracy_a for accuracy_a, _ in accuracies]
+        acc_v_list = [accuracy_v for _, accuracy_v in accuracies]
+        plt.plot(acc_a_list, color='teal')
+        plt.plot(acc_v_list, color='orange')
+        plt.savefig('./plots/'+exp_description+'.pdf', transparent=True)
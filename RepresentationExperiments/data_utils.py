@@ -1,10 +1,15 @@
 #
 # DATA LOADING
 #
+# The scripts of this folder import this module from the repository root,
+# so run them from there, e.g.
+#     python -m RepresentationExperiments.clustering_signatures
 #
 
+import os
 import pickle
 import re
+from data.ragged_store import open_ragged
 
 
 def extract_key(keyname):
@@ -20,7 +25,11 @@ def load_data(filename):
     Loads the data from filename and parses the keys inside
     it to retrieve the labels. Returns a pair xs,ys representing
     the data and the labels respectively
+    filename can also be a folder holding a ragged store
     """
+    if os.path.isdir(filename):
+        return load_store(filename)
+
     data = None
     with (open(filename, "rb")) as file:
         data = pickle.load(file)
@@ -33,3 +42,13 @@ def load_data(filename):
         ys.append(extract_key(key))
 
     return (xs,ys)
+
+def load_store(folder):
+    """
+    Same as load_data for a store written by data.ragged_store.pickle_to_store.
+    The examples are memory-mapped and read lazily.
+    """
+    fields = open_ragged(folder)
+    xs = fields['xs']
+    ys = [extract_key(str(key)) for key in fields['keys']]
+    return (xs,ys)
@@ -84,20 +84,20 @@ if __name__ == '__main__':
     som_v = SOM(20, 30, v_dim, checkpoint_dir=somv_path, n_iterations=200)
     som_a.restore_trained()
     som_v.restore_trained()
-    for n in range(1, 15):
-        hebbian_model = HebbianModel(som_a, som_v, a_dim=a_dim,
-                                     v_dim=v_dim, n_presentations=n,
-                                     checkpoint_dir=hebbian_path,
-                                     tau=0.1, learning_rate=100)
-        # create em folds
-        v_ys = np.array(v_ys)
-        v_xs = np.array(v_xs)
-        a_xs_fold, v_xs_fold, a_ys_fold, v_ys_fold = create_folds(a_xs, v_xs, a_ys, v_ys, n_folds=n)
-        # each fold n contains four lists, each one containing one example
-        # for each class. since we are using n for both n_presentations and
-        # referencing 'folds', which is 0-indexed, we need to put n-1 here
-        print('Training...')
-        hebbian_model.train(a_xs_fold, v_xs_fold)
-        print('Evaluating...')
-        accuracy = hebbian_model.evaluate(a_xs_fold, v_xs, a_ys_fold, v_ys, source='v', img_path = './')
+    v_ys = np.array(v_ys)
+    v_xs = np.array(v_xs)
+    # the folds for n presentations are the first n*10 examples of these
+    a_xs_fold, v_xs_fold, a_ys_fold, v_ys_fold = create_folds(a_xs, v_xs, a_ys, v_ys, n_folds=14)
+    hebbian_model = HebbianModel(som_a, som_v, a_dim=a_dim,
+                                 v_dim=v_dim, n_presentations=1,
+                                 checkpoint_dir=hebbian_path,
+                                 learning_rate=100)
+
+    def evaluate(model, n):
+        accuracy = model.evaluate(a_xs_fold[:n*10], v_xs, a_ys_fold[:n*10], v_ys, source='v', img_path = './')
         print('n={}, accuracy={}'.format(n, accuracy))
+        return accuracy
+
+    print('Training and evaluating...')
+    # adds one presentation at a time to the same model
+    hebbian_model.presentation_curve(a_xs_fold, v_xs_fold, evaluate)
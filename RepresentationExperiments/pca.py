@@ -1,5 +1,5 @@
 from sklearn.decomposition import PCA
-from data_utils import load_data
+from RepresentationExperiments.data_utils import load_data
 from sklearn.externals import joblib
 
 # Builds a PCA model to reduce the dimensionality of
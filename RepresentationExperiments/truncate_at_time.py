@@ -9,7 +9,7 @@ import numpy as np
 from sklearn import svm
 from sklearn.model_selection import LeaveOneOut
 
-import data_utils
+from RepresentationExperiments import data_utils
 
 # Importing data
 
@@ -0,0 +1,128 @@
+import time
+import queue
+import threading
+import numpy as np
+
+class BucketSampler():
+    '''
+    Draws batches of utterances of similar length, so that padding each batch
+    to its longest utterance wastes little work.
+
+    Each epoch the utterances are sorted by length (ties in random order) and
+    split into n_buckets buckets of consecutive lengths; utterances are
+    shuffled within each bucket, cut into batches of exactly batch_size
+    utterances, and the batches of all buckets are shuffled together. With
+    n_buckets=1 this is plain random batching. Utterances that do not fill a
+    whole batch are left out of the epoch, as different ones each time.
+    '''
+
+    def __init__(self, lengths, batch_size, n_buckets=10, seed=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.n_batches = len(self.lengths) // batch_size
+        self.n_buckets = max(1, min(n_buckets, self.n_batches))
+        self.random_state = np.random.RandomState(seed)
+
+    def epoch(self):
+        '''
+        Returns the batches of one epoch, as a list of arrays of indexes.
+        '''
+        random_state = self.random_state
+        shuffled = random_state.permutation(len(self.lengths))
+        by_length = shuffled[np.argsort(self.lengths[shuffled], kind='stable')]
+        # leave out random utterances so that the rest fills whole batches
+        kept = np.sort(random_state.choice(len(by_length), self.n_batches * self.batch_size,
+                                           replace=False))
+        by_length = by_length[kept]
+        batches = []
+        for bucket in np.array_split(np.arange(self.n_batches), self.n_buckets):
+            if len(bucket) == 0:
+                continue
+            members = by_length[bucket[0] * self.batch_size:(bucket[-1] + 1) * self.batch_size]
+            members = random_state.permutation(members)
+            batches.extend(np.split(members, len(bucket)))
+        random_state.shuffle(batches)
+        return batches
+
+    def padding_ratio(self, batches):
+        '''
+        Fraction of the padded frames of the given batches that are padding,
+        0 if there are none (e.g. fewer utterances than batch_size).
+        '''
+        padded = sum(self.batch_size * np.max(self.lengths[batch]) for batch in batches)
+        real = sum(np.sum(self.lengths[batch]) for batch in batches)
+        if padded == 0:
+            return 0.0
+        return 1 - real / float(padded)
+
+
+class BatchPrefetcher():
+    '''
+    Assembles batches on a background thread while the caller trains on the
+    previous ones. Iterating yields make_batch(batch) for each batch, in
+    order; at most queue_size assembled batches wait in the queue.
+
+    stall_time is the total time the caller waited for a batch and
+    mean_queue_depth the average number of ready batches found when asking
+    for one: a low depth and a high stall time mean that assembling batches
+    is the bottleneck.
+    '''
+
+    _END = object()
+
+    def __init__(self, make_batch, batches, queue_size=4):
+        self.make_batch = make_batch
+        self.batches = batches
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stall_time = 0.0
+        self.queue_depths = []
+        self._error = None
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            for batch in self.batches:
+                self.queue.put(self.make_batch(batch))
+        except Exception as e:
+            self._error = e
+        self.queue.put(BatchPrefetcher._END)
+
+    def __iter__(self):
+        while True:
+            self.queue_depths.append(self.queue.qsize())
+            start = time.time()
+            item = self.queue.get()
+            self.stall_time += time.time() - start
+            if item is BatchPrefetcher._END:
+                break
+            yield item
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def mean_queue_depth(self):
+        return np.mean(self.queue_depths) if self.queue_depths else 0.0
+
+
+def split_by_frame_budget(lengths, frame_budget):
+    '''
+    Splits the positions of lengths into groups of similar lengths whose
+    padded size (number of utterances times the longest length) is at most
+    frame_budget, so that running them one at a time bounds the activation
+    memory. Utterances longer than frame_budget are alone in their group.
+    '''
+    lengths = np.asarray(lengths)
+    groups = []
+    current = []
+    for i in np.argsort(lengths, kind='stable'):
+        # lengths are increasing, so the new one is the longest of the group
+        if current and (len(current) + 1) * lengths[i] > frame_budget:
+            groups.append(np.array(current))
+            current = []
+        current.append(i)
+    if current:
+        groups.append(np.array(current))
+    return groups
@@ -2,11 +2,19 @@ import os, sys, logging, glob, librosa
 import numpy as np
 import pickle
 import datetime
+import time
 import tensorflow as tf
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from utils.constants import Constants
+from data.feature_cache import FeatureCache
+from data.ragged_store import RaggedArray, save_ragged, open_ragged
+from data.normalization import FeatureStatistics
 logging.basicConfig(level=Constants.LOGGING_LEVEL)
 
 class Dataset():
+    # fields split by shard, and fields only the unsharded dataset keeps
+    TRAIN_FIELDS = ('X_train', 'y_train', 'train_timesteps')
+    EVALUATION_FIELDS = ('X_val', 'y_val', 'val_timesteps', 'X_test', 'y_test', 'test_timesteps')
 
     def __init__(self, root_folder):
         self.root_folder = root_folder
@@ -29,6 +37,28 @@ class Dataset():
         raise NotImplementedError('This is an abstract class. \n Dump the \
                                    Dataset to file using a subclass.')
 
+    def shard(self, i, n):
+        '''
+        Returns a dataset with the i-th of n disjoint shards of the training
+        utterances: every n-th one, starting from the i-th, so that shards have
+        similar sizes and length distributions. Evaluation fields are left
+        out and RaggedArrays are copied to contiguous ones, so that a shard is
+        cheap to send to another process.
+        '''
+        shard = self.__class__.__new__(self.__class__)
+        shard.__dict__.update({k: v for k, v in self.__dict__.items() if k not in self.EVALUATION_FIELDS})
+        for name in self.TRAIN_FIELDS:
+            field = getattr(self, name)
+            indexes = np.arange(i, len(field), n)
+            if isinstance(field, RaggedArray):
+                field = RaggedArray.from_list(field[indexes])
+            elif isinstance(field, list):
+                field = [field[j] for j in indexes]
+            else:
+                field = field[indexes]
+            setattr(shard, name, field)
+        return shard
+
     def get_placeholders(self, batch_size, sparse=False):
         x_placeholder = tf.placeholder(tf.float32, shape=(batch_size, None, self.X_train.shape[1]))
         if sparse:
@@ -38,6 +68,10 @@ class Dataset():
         return x_placeholder, y_placeholder
 
 class OSXSpeakerDataset(Dataset):
+    TRAIN_FIELDS = ('X', 'y')
+    EVALUATION_FIELDS = ()
+    # librosa's default sampling rate
+    signal_rate = 22050
 
     def __init__(self, speaker_name):
         if speaker_name in Constants.AVAILABLE_SPEAKERS:
@@ -47,10 +81,15 @@ class OSXSpeakerDataset(Dataset):
             print('Unsupported speaker name')
             sys.exit(1)
 
-    def load(self):
+    def load(self, cache_folder=Constants.FEATURE_CACHE_FOLDER):
+        '''
+        Loads the first file of each word folder. Decoded audio is cached in
+        cache_folder (None disables the cache).
+        '''
         if self.loaded == True:
             logging.error('This Dataset instance has been loaded already!')
             return
+        cache = FeatureCache(cache_folder) if cache_folder is not None else None
         folder_list = glob.glob(os.path.join(self.root_folder, '*'))
         logging.debug('Found ' + str(len(folder_list)) + ' subfolders.')
         X = []
@@ -58,11 +97,17 @@ class OSXSpeakerDataset(Dataset):
         for folder in folder_list:
             temp_y = folder.split(os.path.sep)[-1]
             first_file = glob.glob(os.path.join(folder, '*'))[0]
-            temp_X, _ = librosa.core.load(first_file) # drop sampling rate info
+            load_audio = lambda: librosa.core.load(first_file, sr=OSXSpeakerDataset.signal_rate)[0] # drop sampling rate info
+            if cache is not None:
+                temp_X = cache.get(first_file, load_audio, kind='audio', sr=OSXSpeakerDataset.signal_rate)
+            else:
+                temp_X = load_audio()
             X.append(temp_X)
             y.append(temp_y)
         logging.debug('Dataset X loaded with shape ' + str(np.shape(X)))
         logging.debug('Dataset y loaded with shape ' + str(np.shape(y)))
+        if cache is not None:
+            cache.log_statistics()
 
         self.X = X
         self.y = y
@@ -84,7 +129,7 @@ class OSXSpeakerDataset(Dataset):
         self.X = X_padded
         logging.debug('X[0] shape after padding: ' + str(np.shape(X[0])))
 
-    def to_file(self):
+    def filename_base(self):
         filename = ""
         names = self.root_folder.split(':')
         i = 0
@@ -94,72 +139,145 @@ class OSXSpeakerDataset(Dataset):
             if i+1 != len(names):
                 filename += '-'
             i += 1
-        filename += ".pickle"
+        return filename
+
+    def to_file(self):
+        filename = self.filename_base() + ".pickle"
         with open(filename, 'wb') as pickle_file:
             pickle.dump(self, pickle_file)
 
+    def to_store(self, folder=None):
+        '''
+        Saves the dataset as a ragged store (see data.ragged_store), which
+        from_store opens without reading it in memory.
+        '''
+        if folder is None:
+            folder = self.filename_base() + ".store"
+        save_ragged(folder, X=self.X, y=np.array(self.y), root_folder=np.array(self.root_folder))
+        return folder
+
+    @staticmethod
+    def from_store(folder, mmap_mode='r'):
+        fields = open_ragged(folder, mmap_mode=mmap_mode)
+        # skip the speaker name check of __init__
+        dataset = OSXSpeakerDataset.__new__(OSXSpeakerDataset)
+        dataset.root_folder = str(fields['root_folder'])
+        dataset.X = fields['X']
+        dataset.y = fields['y']
+        dataset.loaded = True
+        return dataset
+
 class TIMITDataset(Dataset):
     # phoneme dictionary
     phoneme_dict = Constants.TIMIT_PHONEME_DICT
     signal_rate = 16000
+    # bump when get_mfcc_from_audio changes, to invalidate cached features
+    FEATURES_VERSION = 1
 
     def __init__(self):
         self.root_folder = os.path.join(Constants.TIMIT_DATA_FOLDER)
         self.loaded = False
 
-    def load(self, get_mfcc=True, n_mfcc=13):
+    def load(self, get_mfcc=True, n_mfcc=13, n_workers=None, cache_folder=Constants.FEATURE_CACHE_FOLDER):
+        '''
+        Loads the TRAIN and TEST folders. Speakers are loaded in parallel by
+        n_workers processes (by default, one per core; 1 loads them in this
+        process). Features are cached per audio file in cache_folder (None
+        disables the cache), see data.feature_cache.
+        '''
         if self.loaded == True:
             logging.error('This Dataset instance has been loaded already!')
             return
         train_folder = os.path.join(self.root_folder, 'TRAIN')
         test_folder = os.path.join(self.root_folder, 'TEST')
-        self.X_train, self.y_train, self.train_timesteps = TIMITDataset.load_explore_timit(train_folder, get_mfcc, n_mfcc)
-        self.X_test, self.y_test, self.test_timesteps = TIMITDataset.load_explore_timit(test_folder, get_mfcc, n_mfcc)
+        self.X_train, self.y_train, self.train_timesteps = TIMITDataset.load_explore_timit(train_folder, get_mfcc, n_mfcc,
+                                                                                          n_workers=n_workers,
+                                                                                          cache_folder=cache_folder)
+        self.X_test, self.y_test, self.test_timesteps = TIMITDataset.load_explore_timit(test_folder, get_mfcc, n_mfcc,
+                                                                                       n_workers=n_workers,
+                                                                                       cache_folder=cache_folder)
         self.loaded = True
         self.has_mfcc = get_mfcc
 
-    def to_file(self):
+    def filename_base(self):
         filename = "timit_"
         date_object = datetime.date.today()
         filename = filename + str(date_object.year) + str(date_object.month) + str(date_object.day)
         if self.has_mfcc:
             filename += "_mfcc"
-        filename += ".pickle"
+        return filename
+
+    def to_file(self):
+        filename = self.filename_base() + ".pickle"
         with open(filename, 'wb') as pickle_file:
             pickle.dump(self, pickle_file)
 
-    @staticmethod
-    def load_explore_timit(folder, get_mfcc, n_mfcc, frame_length_seconds=0.010, frame_step_seconds=0.005):
-        X = []
-        y = []
-        for dialect_subfolder in glob.glob(os.path.join(folder, '*')):
-            for speaker_subsubfolder in glob.glob(os.path.join(dialect_subfolder, '*')):
-                logging.info('Loading ' + str(speaker_subsubfolder) + '...')
-
-                audio_file_list = []
-                for audio_file in glob.glob(os.path.join(speaker_subsubfolder, '*.WAV')):
-                    audio_file_list.append(audio_file)
-                audio_file_list.sort()
-
-                phonem_file_list = []
-                for phonem_file in glob.glob(os.path.join(speaker_subsubfolder, '*.PHN')):
-                    phonem_file_list.append(phonem_file)
-                phonem_file_list.sort()
+    def to_store(self, folder=None):
+        '''
+        Saves the dataset as a ragged store (see data.ragged_store): the frames
+        of all the utterances in one array, plus offsets, which from_store
+        memory-maps instead of unpickling.
+        '''
+        if folder is None:
+            folder = self.filename_base() + ".store"
+        save_ragged(folder, X_train=self.X_train, y_train=self.y_train, train_timesteps=self.train_timesteps,
+                    X_test=self.X_test, y_test=self.y_test, test_timesteps=self.test_timesteps,
+                    has_mfcc=np.array(self.has_mfcc))
+        return folder
 
-                dataset_tuple_list = [(af, pf) for af, pf in zip(audio_file_list, phonem_file_list)]
-
-                for audio_file, phonem_file in dataset_tuple_list:
-                    temp_X, sr = librosa.core.load(audio_file, sr=16000)
-                    if get_mfcc == True:
-                        temp_X = TIMITDataset.get_mfcc_from_audio(temp_X, sr, n_mfcc, frame_length_seconds, frame_step_seconds)
-                    X.append(temp_X)
-
-                    y_temp = []
-                    with open(phonem_file, 'r') as phonetic_transcription_file:
-                        temp_y = phonetic_transcription_file.read()
-                        temp_y = TIMITDataset.parse_phoneme_string(temp_y, frame_step_seconds*TIMITDataset.signal_rate)
+    @staticmethod
+    def from_store(folder, mmap_mode='c'):
+        '''
+        Opens a dataset saved by to_store. Utterances are read lazily from the
+        memory-mapped files; with the default copy-on-write mode they can be
+        modified in memory (e.g. normalized) without changing the files.
+        '''
+        fields = open_ragged(folder, mmap_mode=mmap_mode)
+        dataset = TIMITDataset()
+        dataset.X_train = fields['X_train']
+        dataset.y_train = fields['y_train']
+        dataset.train_timesteps = fields['train_timesteps'].tolist()
+        dataset.X_test = fields['X_test']
+        dataset.y_test = fields['y_test']
+        dataset.test_timesteps = fields['test_timesteps'].tolist()
+        dataset.has_mfcc = bool(fields['has_mfcc'])
+        dataset.loaded = True
+        return dataset
 
-                    y.append(temp_y)
+    @staticmethod
+    def load_explore_timit(folder, get_mfcc, n_mfcc, frame_length_seconds=0.010, frame_step_seconds=0.005,
+                           n_workers=None, cache_folder=None):
+        '''
+        Loads all the utterances in folder, speaker by speaker. Speakers are
+        sorted by path and their utterances are returned in that order,
+        whatever the number of worker processes.
+        '''
+        speaker_folders = sorted(glob.glob(os.path.join(folder, '*', '*')))
+        args = (get_mfcc, n_mfcc, frame_length_seconds, frame_step_seconds, cache_folder)
+        results = [None] * len(speaker_folders)
+        n_utterances = 0
+        start = time.time()
+        cache = FeatureCache(cache_folder) if cache_folder is not None else None
+        if n_workers == 1:
+            for i, speaker_folder in enumerate(speaker_folders):
+                results[i] = TIMITDataset.load_speaker(speaker_folder, *args)
+                n_utterances += len(results[i][0])
+                TIMITDataset.log_progress(i + 1, len(speaker_folders), n_utterances, start)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(TIMITDataset.load_speaker, speaker_folder, *args): i
+                           for i, speaker_folder in enumerate(speaker_folders)}
+                for n_done, future in enumerate(as_completed(futures)):
+                    results[futures[future]] = future.result()
+                    n_utterances += len(results[futures[future]][0])
+                    TIMITDataset.log_progress(n_done + 1, len(speaker_folders), n_utterances, start)
+        X = [xi for speaker_X, _, _ in results for xi in speaker_X]
+        y = [yi for _, speaker_y, _ in results for yi in speaker_y]
+        if cache is not None:
+            # the speakers were loaded with caches of their own
+            cache.hits = sum(hits for _, _, (hits, _) in results)
+            cache.misses = sum(misses for _, _, (_, misses) in results)
+            cache.log_statistics()
 
         # save the actual number of timesteps in the dataset
         num_timesteps = [xi.shape[0] for xi in X]
@@ -172,20 +290,82 @@ class TIMITDataset(Dataset):
         #X = np.reshape(X, newshape=(len(X), X[0].shape[0], X[0].shape[1]))
         return np.array(X), y, num_timesteps
 
-    def normalize(self):
-        mean_acc = np.zeros(len(self.X_train[0][0]))
-        var_acc = np.zeros(len(self.X_train[0][0]))
-        for x in self.X_train:
-            mean_acc += np.mean(x, axis=0)
-            var_acc += np.std(x, axis=0)
-        mean_acc /= len(self.X_train)
-        var_acc /= len(self.X_train)
-        for x in self.X_train:
-            new_t = []
-            for t in x:
-                t -= mean_acc
-                t /= var_acc
-        return
+    @staticmethod
+    def load_speaker(speaker_subsubfolder, get_mfcc, n_mfcc, frame_length_seconds, frame_step_seconds,
+                     cache_folder=None):
+        '''
+        Loads the utterances of a single speaker folder, sorted by file name.
+        The features of each file are read from the cache in cache_folder, if
+        given, and computed and stored there otherwise. Returns the features,
+        the transcriptions and the (hits, misses) of the cache.
+        '''
+        logging.debug('Loading ' + str(speaker_subsubfolder) + '...')
+        cache = FeatureCache(cache_folder) if cache_folder is not None else None
+        X = []
+        y = []
+
+        audio_file_list = []
+        for audio_file in glob.glob(os.path.join(speaker_subsubfolder, '*.WAV')):
+            audio_file_list.append(audio_file)
+        audio_file_list.sort()
+
+        phonem_file_list = []
+        for phonem_file in glob.glob(os.path.join(speaker_subsubfolder, '*.PHN')):
+            phonem_file_list.append(phonem_file)
+        phonem_file_list.sort()
+
+        dataset_tuple_list = [(af, pf) for af, pf in zip(audio_file_list, phonem_file_list)]
+
+        for audio_file, phonem_file in dataset_tuple_list:
+            def extract_features():
+                temp_X, sr = librosa.core.load(audio_file, sr=TIMITDataset.signal_rate)
+                if get_mfcc == True:
+                    temp_X = TIMITDataset.get_mfcc_from_audio(temp_X, sr, n_mfcc, frame_length_seconds, frame_step_seconds)
+                return temp_X
+            if cache is None:
+                temp_X = extract_features()
+            elif get_mfcc == True:
+                temp_X = cache.get(audio_file, extract_features, kind='mfcc', sr=TIMITDataset.signal_rate,
+                                   n_mfcc=n_mfcc, frame_length_seconds=frame_length_seconds,
+                                   frame_step_seconds=frame_step_seconds, deltas=2,
+                                   version=TIMITDataset.FEATURES_VERSION)
+            else:
+                temp_X = cache.get(audio_file, extract_features, kind='audio', sr=TIMITDataset.signal_rate)
+            X.append(temp_X)
+
+            with open(phonem_file, 'r') as phonetic_transcription_file:
+                temp_y = phonetic_transcription_file.read()
+                temp_y = TIMITDataset.parse_phoneme_string(temp_y, frame_step_seconds*TIMITDataset.signal_rate)
+
+            y.append(temp_y)
+        cache_statistics = (cache.hits, cache.misses) if cache is not None else (0, 0)
+        return X, y, cache_statistics
+
+    @staticmethod
+    def log_progress(n_speakers_done, n_speakers, n_utterances, start):
+        elapsed = time.time() - start
+        logging.info('Loaded {}/{} speakers, {} utterances in {:.1f}s ({:.1f} utterances/s)'
+                     .format(n_speakers_done, n_speakers, n_utterances, elapsed,
+                             n_utterances / max(elapsed, 1e-9)))
+
+    def normalize(self, statistics_path=None):
+        '''
+        Normalizes the train and test utterances in place to zero mean and unit
+        variance per feature, with the statistics of all the training frames.
+        If statistics_path is given, the statistics are read from it when it
+        exists, and saved to it otherwise, so that other runs and datasets
+        can be normalized the same way.
+        '''
+        if statistics_path is not None and os.path.exists(statistics_path):
+            statistics = FeatureStatistics.load(statistics_path)
+        else:
+            statistics = FeatureStatistics().fit(self.X_train)
+            if statistics_path is not None:
+                statistics.save(statistics_path)
+        statistics.apply(self.X_train)
+        statistics.apply(self.X_test)
+        self.statistics = statistics
+        return statistics
 
     @staticmethod
     def get_mfcc_from_audio(audio, signal_rate, n_mfcc, frame_length_seconds, frame_step_seconds):
@@ -0,0 +1,86 @@
+import os, json, hashlib, logging
+import numpy as np
+from utils.constants import Constants
+logging.basicConfig(level=Constants.LOGGING_LEVEL)
+
+class FeatureCache():
+    '''
+    On-disk cache of the features extracted from audio files. Each entry is a
+    .npy shard named after the hash of the audio file contents and of the
+    feature parameters, so it is shared by every dataset and run using the
+    same file and parameters, and invalidated when either changes.
+
+    The contents of a file are only hashed the first time it is seen with a
+    given path, size and modification time: the hash is stored under those
+    and read back on the following loads.
+    '''
+
+    def __init__(self, cache_folder=Constants.FEATURE_CACHE_FOLDER):
+        self.cache_folder = cache_folder
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def content_hash(path, block_size=1 << 20):
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def file_hash(self, path):
+        '''
+        Hash of the contents of path, computed only if the file changed since
+        it was last hashed.
+        '''
+        stat = os.stat(path)
+        stat_string = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+        stat_key = hashlib.sha1(stat_string.encode()).hexdigest()
+        stat_path = os.path.join(self.cache_folder, 'stat', stat_key[:2], stat_key + '.txt')
+        if os.path.exists(stat_path):
+            with open(stat_path, 'r') as f:
+                return f.read().strip()
+        content_hash = FeatureCache.content_hash(path)
+
+        def write_hash(temp_path):
+            with open(temp_path, 'w') as f:
+                f.write(content_hash)
+        FeatureCache.write_atomic(stat_path, write_hash, '.txt')
+        return content_hash
+
+    def key(self, audio_file, **params):
+        params_string = json.dumps(params, sort_keys=True)
+        h = hashlib.sha1((self.file_hash(audio_file) + params_string).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        # two-level layout to keep folders small
+        return os.path.join(self.cache_folder, key[:2], key + '.npy')
+
+    @staticmethod
+    def write_atomic(path, write, extension):
+        '''
+        Calls write on a temporary file and renames it to path, so that
+        concurrent workers never read partial files.
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path[:-len(extension)] + '.' + str(os.getpid()) + '.tmp' + extension
+        write(temp_path)
+        os.replace(temp_path, path)
+
+    def get(self, audio_file, compute, **params):
+        '''
+        Returns the features of audio_file for the given parameters, calling
+        compute() and storing its result if they are not cached yet.
+        '''
+        shard_path = self.path(self.key(audio_file, **params))
+        if os.path.exists(shard_path):
+            self.hits += 1
+            return np.load(shard_path)
+        self.misses += 1
+        features = compute()
+        FeatureCache.write_atomic(shard_path, lambda temp_path: np.save(temp_path, features), '.npy')
+        return features
+
+    def log_statistics(self):
+        logging.info('Feature cache: {} hits, {} misses'.format(self.hits, self.misses))
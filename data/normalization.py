@@ -0,0 +1,98 @@
+import numpy as np
+from data.ragged_store import RaggedArray
+
+class FeatureStatistics():
+    '''
+    Per-feature mean and variance over all the frames of a dataset,
+    accumulated chunk by chunk with Chan's parallel update of Welford's
+    algorithm, so that memory-mapped datasets never need to fit in memory
+    and the result does not lose precision on long streams.
+    '''
+
+    def __init__(self, n_features=None):
+        self.count = 0
+        self.mean = None if n_features is None else np.zeros(n_features)
+        self.m2 = None if n_features is None else np.zeros(n_features)
+
+    def update(self, frames):
+        '''
+        Adds a [n_frames, n_features] chunk of frames to the statistics.
+        '''
+        frames = np.asarray(frames, dtype=np.float64)
+        if len(frames) == 0:
+            return self
+        chunk_count = len(frames)
+        chunk_mean = np.mean(frames, axis=0)
+        chunk_m2 = np.sum((frames - chunk_mean) ** 2, axis=0)
+        if self.count == 0:
+            self.count, self.mean, self.m2 = chunk_count, chunk_mean, chunk_m2
+            return self
+        total = self.count + chunk_count
+        delta = chunk_mean - self.mean
+        self.mean = self.mean + delta * chunk_count / total
+        self.m2 = self.m2 + chunk_m2 + delta ** 2 * self.count * chunk_count / total
+        self.count = total
+        return self
+
+    def fit(self, xs, chunk_frames=1 << 16):
+        '''
+        Accumulates the frames of all the utterances in xs, about chunk_frames
+        frames at a time.
+        '''
+        if isinstance(xs, RaggedArray) and xs.index is None:
+            # the frames are already contiguous
+            for start in range(0, len(xs.values), chunk_frames):
+                self.update(xs.values[start:start+chunk_frames])
+            return self
+        chunk = []
+        n_frames = 0
+        for x in xs:
+            chunk.append(x)
+            n_frames += len(x)
+            if n_frames >= chunk_frames:
+                self.update(np.concatenate(chunk))
+                chunk = []
+                n_frames = 0
+        if chunk:
+            self.update(np.concatenate(chunk))
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        std = np.sqrt(self.var)
+        # constant features are only centered
+        std[std == 0] = 1
+        return std
+
+    def apply(self, xs):
+        '''
+        Normalizes every utterance in xs in place, with one broadcast
+        operation each.
+        '''
+        mean = self.mean
+        std = self.std
+        for x in xs:
+            x -= mean.astype(x.dtype)
+            x /= std.astype(x.dtype)
+        return xs
+
+    def save(self, path):
+        '''
+        Saves the statistics at exactly path (np.savez would append .npz to
+        other extensions), so that they are found there again.
+        '''
+        with open(path, 'wb') as f:
+            np.savez(f, count=self.count, mean=self.mean, m2=self.m2)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as f:
+            statistics = FeatureStatistics()
+            statistics.count = int(f['count'])
+            statistics.mean = f['mean']
+            statistics.m2 = f['m2']
+        return statistics
@@ -0,0 +1,125 @@
+import os, sys, json, pickle, logging
+import numpy as np
+from utils.constants import Constants
+logging.basicConfig(level=Constants.LOGGING_LEVEL)
+
+class RaggedArray():
+    '''
+    A sequence of arrays of different lengths (e.g. the frames of each
+    utterance) stored as one concatenated 'values' array and an 'offsets'
+    array: item i is values[offsets[i]:offsets[i+1]], a view, so items are
+    only read from disk when used if values is memory-mapped.
+
+    Indexing with a slice or an array of indexes returns another RaggedArray
+    over the same values, so shuffling and batching stay lazy.
+    '''
+
+    def __init__(self, values, offsets, index=None):
+        self.values = values
+        self.offsets = offsets
+        self.index = index
+
+    @staticmethod
+    def from_list(xs):
+        xs = [np.asarray(x) for x in xs]
+        lengths = [len(x) for x in xs]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        values = np.concatenate(xs) if xs else np.zeros(0)
+        return RaggedArray(values, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.index is None else len(self.index)
+
+    @property
+    def lengths(self):
+        lengths = np.diff(self.offsets)
+        return lengths if self.index is None else lengths[self.index]
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            if i < 0:
+                i += len(self)
+            if self.index is not None:
+                i = self.index[i]
+            return self.values[self.offsets[i]:self.offsets[i+1]]
+        index = np.arange(len(self))[i]
+        if self.index is not None:
+            index = self.index[index]
+        return RaggedArray(self.values, self.offsets, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def tolist(self):
+        return [np.array(x) for x in self]
+
+
+def is_ragged(field):
+    if isinstance(field, RaggedArray):
+        return True
+    if isinstance(field, np.ndarray) and field.dtype != object:
+        return False
+    return len(field) > 0 and isinstance(field[0], np.ndarray) and field[0].ndim > 0
+
+
+def save_ragged(folder, **fields):
+    '''
+    Saves each field in folder: lists of arrays (or RaggedArrays) as
+    <name>.values.npy and <name>.offsets.npy, anything else as <name>.npy,
+    with a metadata.json describing them.
+    '''
+    os.makedirs(folder, exist_ok=True)
+    metadata = {}
+    for name, field in fields.items():
+        if is_ragged(field):
+            ragged = field if isinstance(field, RaggedArray) and field.index is None \
+                else RaggedArray.from_list(field)
+            np.save(os.path.join(folder, name + '.values.npy'), ragged.values)
+            np.save(os.path.join(folder, name + '.offsets.npy'), ragged.offsets)
+            metadata[name] = {'kind': 'ragged', 'length': len(ragged),
+                              'dtype': str(ragged.values.dtype), 'shape': list(ragged.values.shape)}
+        else:
+            field = np.asarray(field)
+            np.save(os.path.join(folder, name + '.npy'), field)
+            metadata[name] = {'kind': 'array',
+                              'dtype': str(field.dtype), 'shape': list(field.shape)}
+    with open(os.path.join(folder, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def open_ragged(folder, mmap_mode='r'):
+    '''
+    Opens the fields saved by save_ragged, as a dict of RaggedArrays and
+    arrays. The values are memory-mapped with the given mmap_mode ('c' makes
+    them writable in memory without touching the files; None reads
+    everything in memory).
+    '''
+    with open(os.path.join(folder, 'metadata.json'), 'r') as f:
+        metadata = json.load(f)
+    fields = {}
+    for name, description in metadata.items():
+        if description['kind'] == 'ragged':
+            values = np.load(os.path.join(folder, name + '.values.npy'), mmap_mode=mmap_mode)
+            offsets = np.load(os.path.join(folder, name + '.offsets.npy'))
+            fields[name] = RaggedArray(values, offsets)
+        else:
+            fields[name] = np.load(os.path.join(folder, name + '.npy'), mmap_mode=mmap_mode)
+    return fields
+
+
+def pickle_to_store(pickle_filename, folder):
+    '''
+    Converts a pickled dict of arrays, like the activations.pkl files read by
+    utils.utils.load_data, to a store with the fields 'xs' and 'keys'.
+    '''
+    with open(pickle_filename, 'rb') as f:
+        data = pickle.load(f)
+    keys = list(data.keys())
+    save_ragged(folder, xs=[np.asarray(data[key]) for key in keys], keys=np.array(keys))
+    logging.info('Saved ' + str(len(keys)) + ' examples to ' + folder)
+
+
+if __name__ == '__main__':
+    # python -m data.ragged_store activations.pkl activations.store
+    pickle_to_store(sys.argv[1], sys.argv[2])
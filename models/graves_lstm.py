@@ -7,17 +7,34 @@ import numpy as np
 import logging
 import random
 import os
-from utils.utils import array_to_sparse_tuple_1d, array_to_sparse_tuple, get_next_batch_index
-from utils.utils import pad_np_arrays
+import multiprocessing
+from utils.utils import ragged_to_sparse_tuple
 from utils.constants import Constants
 from data.dataset import TIMITDataset
+from data.batching import BucketSampler, BatchPrefetcher, split_by_frame_budget
 from keras.layers import Input, Bidirectional, LSTM
 from keras.models import Sequential, Model
 from keras.utils import to_categorical
 from tensorflow.contrib.rnn import stack_bidirectional_dynamic_rnn, LSTMCell
+from tensorflow.contrib.rnn import LSTMBlockFusedCell, TimeReversedFusedRNN
 
 
 LOAD_PICKLE = True
+# batches are drawn from buckets of utterances of similar length; 1 disables bucketing
+NUM_BUCKETS = 10
+# the train label error rate is computed every TRAIN_LER_EVERY batches (0 disables it),
+# with the 'greedy' or 'beam' search decoder; validation always uses beam search
+TRAIN_LER_EVERY = 10
+TRAIN_LER_DECODER = 'greedy'
+# number of data-parallel training processes, see create_model
+NUM_WORKERS = 1
+# maximum number of padded frames run at once: larger training batches are split and their
+# gradients accumulated, the validation set is run in sub-batches; None disables the splitting.
+# A single utterance longer than the budget still runs whole, unless SKIP_OVER_BUDGET drops it
+# from training (validation always keeps it)
+TRAIN_FRAME_BUDGET = None
+VALIDATION_FRAME_BUDGET = 1 << 15
+SKIP_OVER_BUDGET = False
 # setting those parameters to graves' choices
 NUM_LAYERS = Constants.NUM_LAYERS
 NUM_HIDDEN = Constants.NUM_HIDDEN
@@ -26,13 +43,94 @@ NUM_EPOCHS = Constants.NUM_EPOCHS
 VALIDATION_SIZE = Constants.VALIDATION_SIZE
 ID_STRING = Constants.ID_STRING
 OPTIMIZER_DESCR = Constants.OPTIMIZER_DESCR
-
-def create_model(dataset):
+RNN_BACKEND = Constants.RNN_BACKEND
+RNN_BACKENDS = ('lstm_cell', 'block_fused', 'keras')
+
+def assemble_batch(X, y, timesteps, batch_indexes):
+    '''
+    Pads the inputs of the given utterances to the longest one and returns the
+    padded inputs, the sparse (indices, values, dense_shape) targets and the
+    sequence lengths, ready to be fed.
+    '''
+    batch_seq_length = [timesteps[i] for i in batch_indexes]
+    batch_inputs = X[batch_indexes]
+    batch_targets = y[batch_indexes]
+
+    # pad the inputs to max time length in the batch
+    batch_inputs = TIMITDataset.pad_train_data(batch_inputs)
+
+    # get a sparse representation of the targets (tf.nn.ctc_loss needs it for some reason);
+    # targets are not padded, so padding is not mistaken for labels
+    return np.array(batch_inputs), ragged_to_sparse_tuple(batch_targets), batch_seq_length
+
+def assemble_sub_batches(X, y, timesteps, batch_indexes, frame_budget=None, skip_over_budget=False):
+    '''
+    Splits the given utterances into sub-batches of at most frame_budget
+    padded frames (see data.batching.split_by_frame_budget) and assembles
+    each of them. Returns a list with a single batch if frame_budget is None.
+    Utterances longer than frame_budget form sub-batches of their own, or are
+    left out if skip_over_budget is True (possibly leaving no sub-batch).
+    '''
+    batch_indexes = np.asarray(batch_indexes)
+    if frame_budget is None:
+        return [assemble_batch(X, y, timesteps, batch_indexes)]
+    lengths = np.array([timesteps[i] for i in batch_indexes])
+    if skip_over_budget:
+        batch_indexes = batch_indexes[lengths <= frame_budget]
+        lengths = lengths[lengths <= frame_budget]
+    return [assemble_batch(X, y, timesteps, batch_indexes[group])
+            for group in split_by_frame_budget(lengths, frame_budget)]
+
+def log_over_budget(lengths, frame_budget, what, skipped=False):
+    '''
+    Logs how many of the utterances with the given lengths exceed
+    frame_budget, since each of them sets the peak memory on its own unless
+    it is skipped.
+    '''
+    if frame_budget is None:
+        return 0
+    lengths = np.asarray(lengths)
+    n_over = int(np.sum(lengths > frame_budget))
+    if n_over > 0:
+        log = "{}: {} of {} utterances are longer than the frame budget of {} ({} frames at most), {}"
+        logging.warning(log.format(what, n_over, len(lengths), frame_budget, np.max(lengths),
+                                   'skipped' if skipped else 'run whole'))
+    return n_over
+
+def run_sub_batches(session, model, sub_batches, fetches):
+    '''
+    Runs fetches on each sub-batch and returns their means over all the
+    utterances. Each fetch must be a mean over the utterances of a batch,
+    like the cost, the label error rate or a list of gradients of the cost,
+    so that the result is the same as running the whole batch at once.
+    '''
+    total = float(sum(len(seq_length) for _, _, seq_length in sub_batches))
+    means = None
+    for sub_inputs, sub_sparse_targets, sub_seq_length in sub_batches:
+        feed = {model['inputs']: sub_inputs,
+                model['targets']: sub_sparse_targets,
+                model['seq_length']: sub_seq_length}
+        results = session.run(fetches, feed)
+        weight = len(sub_seq_length) / total
+        weighted = [[weight * r for r in result] if isinstance(result, list) else weight * result
+                    for result in results]
+        if means is None:
+            means = weighted
+        else:
+            means = [[m + w for m, w in zip(mean, value)] if isinstance(value, list) else mean + value
+                     for mean, value in zip(means, weighted)]
+    return means
+
+def prepare_dataset(dataset):
+    '''
+    Normalizes the dataset and moves VALIDATION_SIZE random training
+    utterances to a validation set. Returns the number of features and of
+    classes.
+    '''
     # normalize the dataset
     dataset.normalize()
 
     # get information about the training set
-    max_time_length = max([t for (t, f) in [x.shape for x in dataset.X_train]])
     num_features = dataset.X_train[0].shape[1]
     num_classes = max(TIMITDataset.phoneme_dict.values()) + 2
 
@@ -40,6 +138,7 @@ def create_model(dataset):
     randomizer = np.arange(len(dataset.X_train))
     np.random.shuffle(randomizer)
     dataset.X_train = dataset.X_train[randomizer]
+    dataset.y_train = dataset.y_train[randomizer]
     dataset.train_timesteps = np.array(dataset.train_timesteps)[randomizer].tolist()
     dataset.X_val = dataset.X_train[:VALIDATION_SIZE]
     dataset.y_val = dataset.y_train[:VALIDATION_SIZE]
@@ -47,15 +146,21 @@ def create_model(dataset):
     dataset.y_train = dataset.y_train[VALIDATION_SIZE:]
     dataset.val_timesteps = dataset.train_timesteps[:VALIDATION_SIZE]
     dataset.train_timesteps = dataset.train_timesteps[VALIDATION_SIZE:]
-    num_examples = len(dataset.X_train)
-
-    graph = tf.Graph()
-    with graph.as_default():
-        inputs = tf.placeholder(tf.float32, shape=(None, None, num_features), name='input')
-        targets = tf.sparse_placeholder(tf.int32, name='target')
-        seq_length = tf.placeholder(tf.int32, shape=[None], name='seq_length')
-
-
+    return num_features, num_classes
+
+def bidirectional_rnn(inputs, seq_length, backend=RNN_BACKEND):
+    '''
+    Stack of NUM_LAYERS bidirectional LSTM layers of NUM_HIDDEN units over the
+    batch-major inputs, with the given backend:
+        'lstm_cell': stack_bidirectional_dynamic_rnn over LSTMCell, one op
+            chain per time step;
+        'block_fused': LSTMBlockFusedCell, one fused op per layer and
+            direction over the whole sequence;
+        'keras': the Keras LSTM layer.
+    Returns the batch-major outputs, forward and backward ones concatenated.
+    The variables, hence the checkpoints, differ between backends.
+    '''
+    if backend == 'lstm_cell':
         lstm_cell_forward_list = []
         lstm_cell_backward_list = []
         for i in range(0, NUM_LAYERS):
@@ -64,6 +169,42 @@ def create_model(dataset):
 
         outputs, f_state, b_state = stack_bidirectional_dynamic_rnn(lstm_cell_forward_list, lstm_cell_backward_list,
                                         inputs, dtype=tf.float32, sequence_length=seq_length)
+        return outputs
+    elif backend == 'block_fused':
+        # the fused cells are time major
+        outputs = tf.transpose(inputs, (1, 0, 2))
+        for i in range(0, NUM_LAYERS):
+            with tf.variable_scope('fused_layer_' + str(i)):
+                forward = LSTMBlockFusedCell(NUM_HIDDEN, name='forward')
+                backward = TimeReversedFusedRNN(LSTMBlockFusedCell(NUM_HIDDEN, name='backward'))
+                forward_outputs, _ = forward(outputs, dtype=tf.float32, sequence_length=seq_length)
+                backward_outputs, _ = backward(outputs, dtype=tf.float32, sequence_length=seq_length)
+                outputs = tf.concat([forward_outputs, backward_outputs], axis=2)
+        return tf.transpose(outputs, (1, 0, 2))
+    elif backend == 'keras':
+        mask = tf.sequence_mask(seq_length, tf.shape(inputs)[1])
+        outputs = inputs
+        for i in range(0, NUM_LAYERS):
+            layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(NUM_HIDDEN, return_sequences=True,
+                                                                       implementation=2),
+                                                  merge_mode='concat')
+            outputs = layer(outputs, mask=mask)
+        return outputs
+    raise ValueError('Unknown RNN backend ' + str(backend) + ', expected one of ' + str(RNN_BACKENDS))
+
+def build_graph(num_features, num_classes, backend=RNN_BACKEND):
+    '''
+    Builds the network, its CTC loss, the optimizer and the decoders. Returns
+    the graph and a dict of the tensors and operations used to train and
+    evaluate it.
+    '''
+    graph = tf.Graph()
+    with graph.as_default():
+        inputs = tf.placeholder(tf.float32, shape=(None, None, num_features), name='input')
+        targets = tf.sparse_placeholder(tf.int32, name='target')
+        seq_length = tf.placeholder(tf.int32, shape=[None], name='seq_length')
+
+        outputs = bidirectional_rnn(inputs, seq_length, backend)
         
         # prepare the last fully-connected layer, which weights are shared throughout the time steps
         outputs = tf.reshape(outputs, [-1, NUM_HIDDEN])
@@ -73,7 +214,8 @@ def create_model(dataset):
         b = tf.Variable(tf.constant(0., shape=[num_classes]))
 
         fc_out = tf.matmul(outputs, W) + b
-        fc_out = tf.reshape(fc_out, [BATCH_SIZE, -1, num_classes]) # Reshaping back to the original shape
+        # Reshaping back to the original shape, whatever the size of the batch
+        fc_out = tf.reshape(fc_out, [tf.shape(inputs)[0], -1, num_classes])
         
         # time major
         fc_out = tf.transpose(fc_out, (1, 0, 2))
@@ -82,10 +224,17 @@ def create_model(dataset):
         cost = tf.reduce_mean(loss)
         
         if OPTIMIZER_DESCR == 'adam':
-            optimizer = tf.train.AdamOptimizer(0.001).minimize(cost)
+            optimizer = tf.train.AdamOptimizer(0.001)
         else:
             optimizer = tf.train.MomentumOptimizer(0.0001,
-                                                   0.9).minimize(cost)
+                                                   0.9)
+        # gradients are computed and applied separately in data-parallel training
+        grads_and_vars = optimizer.compute_gradients(cost)
+        variables = [v for _, v in grads_and_vars]
+        gradients = [tf.convert_to_tensor(g) for g, _ in grads_and_vars]
+        gradient_placeholders = [tf.placeholder(tf.float32, shape=v.get_shape()) for v in variables]
+        train_step = optimizer.apply_gradients(grads_and_vars)
+        apply_gradients = optimizer.apply_gradients(zip(gradient_placeholders, variables))
 
         #decoded, log_prob = tf.nn.ctc_greedy_decoder(fc_out, seq_length)
         decoded, log_prob = tf.nn.ctc_beam_search_decoder(fc_out, seq_length)
@@ -93,124 +242,293 @@ def create_model(dataset):
         # Inaccuracy: label error rate
         ler = tf.reduce_mean(tf.edit_distance(tf.cast(decoded[0], tf.int32),
                                               targets))
-        
-    with tf.Session(graph=graph) as session:
+
+        # cheaper estimate of the label error rate, to monitor training
+        if TRAIN_LER_DECODER == 'greedy':
+            train_decoded, _ = tf.nn.ctc_greedy_decoder(fc_out, seq_length)
+            train_ler_op = tf.reduce_mean(tf.edit_distance(tf.cast(train_decoded[0], tf.int32),
+                                                           targets))
+        else:
+            train_ler_op = ler
+
+        init = tf.global_variables_initializer()
+
+    model = {'inputs': inputs, 'targets': targets, 'seq_length': seq_length, 'cost': cost,
+             'train_step': train_step, 'variables': variables, 'gradients': gradients,
+             'gradient_placeholders': gradient_placeholders, 'apply_gradients': apply_gradients,
+             'decoded': decoded, 'ler': ler, 'train_ler': train_ler_op, 'init': init}
+    return graph, model
+
+def session_config(n_workers):
+    if n_workers == 1:
+        return None
+    # share the cores among the worker processes
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    return tf.ConfigProto(intra_op_parallelism_threads=n_threads,
+                          inter_op_parallelism_threads=n_threads)
+
+class GradientExchange():
+    '''
+    Synchronous averaging of the gradients of n_workers processes through
+    shared memory: at each step every process writes its flattened gradients
+    and batch cost to its own row, waits for the others, and reads the means.
+    Since every process then applies the same mean gradients to the same
+    parameters, the replicas stay identical without a parameter server.
+    '''
+
+    def __init__(self, n_workers, n_parameters, context):
+        self.n_workers = n_workers
+        self.gradients = context.RawArray('f', n_workers * n_parameters)
+        self.costs = context.RawArray('d', n_workers)
+        self.parameters = context.RawArray('f', n_parameters)
+        self.barrier = context.Barrier(n_workers)
+
+    def average(self, rank, gradients, cost):
+        all_gradients = np.frombuffer(self.gradients, dtype=np.float32).reshape(self.n_workers, -1)
+        costs = np.frombuffer(self.costs, dtype=np.float64)
+        all_gradients[rank] = gradients
+        costs[rank] = cost
+        self.barrier.wait()
+        mean_gradients = all_gradients.mean(axis=0)
+        mean_cost = costs.mean()
+        # nobody overwrites its row before everybody has read
+        self.barrier.wait()
+        return mean_gradients, mean_cost
+
+    def broadcast(self, rank, parameters=None):
+        '''
+        Returns the parameters given by process 0 to every process.
+        '''
+        shared = np.frombuffer(self.parameters, dtype=np.float32)
+        if rank == 0:
+            shared[:] = parameters
+        self.barrier.wait()
+        return shared.copy()
+
+def flatten(arrays):
+    return np.concatenate([np.ravel(a) for a in arrays]).astype(np.float32)
+
+def unflatten(flat, shapes):
+    arrays = []
+    start = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        arrays.append(flat[start:start+size].reshape(shape))
+        start += size
+    return arrays
+
+def train_epoch(session, model, dataset, batches, rank=0, exchange=None, frame_budget=TRAIN_FRAME_BUDGET,
+                skip_over_budget=SKIP_OVER_BUDGET):
+    '''
+    Trains on the given batches of dataset, either with the optimizer step
+    alone or, given a GradientExchange, with the gradients averaged over all
+    the processes. With a frame_budget, batches with more padded frames are
+    run in sub-batches and their gradients accumulated before the update,
+    which is the same as for the whole batch; utterances longer than the
+    budget are run whole, or skipped if skip_over_budget is True. Returns
+    the mean batch cost and the train label error rate (nan if it was not
+    computed).
+    '''
+    train_cost = train_ler = 0
+    ler_batches = 0
+    n_run = 0
+    start = time.time()
+    shapes = [v.get_shape().as_list() for v in model['variables']]
+    if rank == 0 and len(batches) > 0:
+        train_timesteps = np.asarray(dataset.train_timesteps)
+        log_over_budget(train_timesteps[np.concatenate(batches)], frame_budget, 'Training', skip_over_budget)
+    # batches are padded and converted on a background thread
+    prefetcher = BatchPrefetcher(lambda batch_indexes: assemble_sub_batches(dataset.X_train, dataset.y_train,
+                                                                            dataset.train_timesteps,
+                                                                            batch_indexes, frame_budget,
+                                                                            skip_over_budget),
+                                 batches)
+    for batch, sub_batches in enumerate(prefetcher):
+        compute_ler = rank == 0 and TRAIN_LER_EVERY > 0 and batch % TRAIN_LER_EVERY == 0
+        if len(sub_batches) == 0 and exchange is None:
+            # all the utterances of the batch were over budget
+            continue
+        elif len(sub_batches) == 0:
+            # still take part in the synchronous step, with no gradient
+            zero_gradients = flatten([np.zeros(shape) for shape in shapes])
+            mean_gradients, batch_cost = exchange.average(rank, zero_gradients, 0.0)
+            session.run(model['apply_gradients'],
+                        dict(zip(model['gradient_placeholders'], unflatten(mean_gradients, shapes))))
+        elif exchange is None and len(sub_batches) == 1:
+            # run the session on the training data
+            batch_inputs, batch_sparse_targets, batch_seq_length = sub_batches[0]
+            feed = {model['inputs']: batch_inputs,
+                    model['targets']: batch_sparse_targets,
+                    model['seq_length']: batch_seq_length}
+            fetches = [model['cost'], model['train_step']]
+            if compute_ler:
+                # same forward pass as the optimizer step, before the update
+                fetches.append(model['train_ler'])
+            results = session.run(fetches, feed)
+            batch_cost = results[0]
+            if compute_ler:
+                train_ler += results[2]
+                ler_batches += 1
+        else:
+            fetches = [model['cost'], model['gradients']]
+            if compute_ler:
+                fetches.append(model['train_ler'])
+            results = run_sub_batches(session, model, sub_batches, fetches)
+            batch_cost, gradients = results[0], results[1]
+            if compute_ler:
+                train_ler += results[2]
+                ler_batches += 1
+            if exchange is not None:
+                mean_gradients, batch_cost = exchange.average(rank, flatten(gradients), batch_cost)
+                gradients = unflatten(mean_gradients, shapes)
+            session.run(model['apply_gradients'], dict(zip(model['gradient_placeholders'], gradients)))
+        train_cost += batch_cost
+        n_run += 1
+
+        if rank == 0 and batch % 1000 == 0:
+            log = "Time: {:.3f}: Batch {:.0f}"
+            logging.info(log.format(time.time() - start, batch))
+
+    train_cost /= max(n_run, 1)
+    train_ler = train_ler / ler_batches if ler_batches > 0 else float('nan')
+    if rank == 0:
+        log = "Input pipeline: stall time = {:.3f}s, mean queue depth = {:.2f}"
+        logging.info(log.format(prefetcher.stall_time, prefetcher.mean_queue_depth))
+    return train_cost, train_ler
+
+def evaluate_epoch(session, model, dataset, curr_epoch, train_cost, train_ler, start):
+    '''
+    Logs the validation cost and label error rate and decodes a few training
+    examples.
+    '''
+    inputs, targets, seq_length = model['inputs'], model['targets'], model['seq_length']
+
+    # get information on the validation set accuracy, VALIDATION_FRAME_BUDGET frames at a time
+    log_over_budget(dataset.val_timesteps, VALIDATION_FRAME_BUDGET, 'Validation')
+    val_sub_batches = assemble_sub_batches(dataset.X_val, dataset.y_val, dataset.val_timesteps,
+                                           np.arange(len(dataset.X_val)), VALIDATION_FRAME_BUDGET)
+    val_cost, val_ler = run_sub_batches(session, model, val_sub_batches, [model['cost'], model['ler']])
+    val_ler *= VALIDATION_SIZE
+
+
+    log = "Epoch {:.0f}, train_cost = {:.3f}, train_ler = {:.3f}, val_cost = {:.3f}, val_ler = {:.3f}, time = {:.3f}"
+    logging.info(log.format(curr_epoch+1, train_cost, train_ler, val_cost, val_ler,
+                     time.time() - start))
+
+
+    # decode a few examples each epoch to monitor progress
+    # prepare data and targets
+    batch_indexes = np.arange(BATCH_SIZE)
+    batch_targets = dataset.y_train[batch_indexes]
+    batch_inputs, batch_sparse_targets, batch_seq_length = assemble_batch(dataset.X_train, dataset.y_train,
+                                                                          dataset.train_timesteps,
+                                                                          batch_indexes)
+
+    feed = {inputs: batch_inputs,
+            targets: batch_sparse_targets,
+            seq_length: batch_seq_length}
+
+    d = session.run(model['decoded'][0], feed_dict=feed)
+    dense_decoded = tf.sparse_tensor_to_dense(d, default_value=-1).eval(session=session)
+
+    for i, seq in list(enumerate(dense_decoded))[:2]:
+        seq = [s for s in seq if s != -1]
+        inverse_dict = {Constants.TIMIT_PHONEME_DICT[k] : k for k in Constants.TIMIT_PHONEME_DICT}
+        original_phoneme_transcription = ' '.join([inverse_dict[k] for k in batch_targets[i]])
+        estimated_phoneme_transcription = ' '.join([inverse_dict[k] for k in seq])
+        logging.info('Sequence %d' %i)
+        logging.info('Original \n%s' %original_phoneme_transcription)
+        logging.info('Estimated \n%s' %estimated_phoneme_transcription)
+
+def train_worker(rank, n_workers, shard, num_features, num_classes, steps_per_epoch, exchange):
+    '''
+    Training loop of the data-parallel processes other than process 0, on
+    their shard of the training set.
+    '''
+    graph, model = build_graph(num_features, num_classes)
+    with tf.Session(graph=graph, config=session_config(n_workers)) as session:
+        try:
+            session.run(model['init'])
+            shapes = [v.get_shape().as_list() for v in model['variables']]
+            # start from the parameters of process 0
+            parameters = unflatten(exchange.broadcast(rank), shapes)
+            for variable, value in zip(model['variables'], parameters):
+                variable.load(value, session)
+            sampler = BucketSampler(shard.train_timesteps, BATCH_SIZE, n_buckets=NUM_BUCKETS)
+            for curr_epoch in range(NUM_EPOCHS):
+                train_epoch(session, model, shard, sampler.epoch()[:steps_per_epoch], rank, exchange)
+        except Exception:
+            # do not leave the other processes waiting for this one
+            exchange.barrier.abort()
+            raise
+
+def create_model(dataset, n_workers=NUM_WORKERS):
+    '''
+    Trains the network on dataset and saves checkpoints in
+    TRAINED_MODELS_FOLDER. With n_workers > 1 the training set is sharded
+    across n_workers processes (this one included), which train in lockstep
+    on the average of their gradients; this process validates and saves the
+    checkpoints, which are the same as when training in a single process.
+    '''
+    num_features, num_classes = prepare_dataset(dataset)
+    num_examples = len(dataset.X_train)
+
+    graph, model = build_graph(num_features, num_classes)
+    with tf.Session(graph=graph, config=session_config(n_workers)) as session:
         # Initializate the weights and biases
-        tf.global_variables_initializer().run()
+        session.run(model['init'])
 
         # init saver (has to be after variable initialization)
         saver = tf.train.Saver()
         saver.save(session, os.path.join(Constants.TRAINED_MODELS_FOLDER, ID_STRING + "_initial.ckpt"))
 
-        for curr_epoch in range(NUM_EPOCHS):
-            train_cost = train_ler = 0
-            start = time.time()
-
-            num_batches_per_epoch = int(num_examples/BATCH_SIZE)
-            available_batch_indexes = list(range(0, num_batches_per_epoch))
-            for batch in range(num_batches_per_epoch):
-                random_batch_index = get_next_batch_index(available_batch_indexes)
-                available_batch_indexes.remove(random_batch_index)
-
-                start_index = random_batch_index * BATCH_SIZE
-                end_index = (random_batch_index + 1) * BATCH_SIZE 
-
-                # get the data needed for the feed_dict this batch
-                batch_seq_length = [time_length for time_length in dataset.train_timesteps[start_index:end_index]]
-                batch_inputs = dataset.X_train[start_index:end_index]
-                batch_targets = dataset.y_train[start_index:end_index]
-
-                # pad both inputs and targets to max time length in the batch
-                batch_inputs = TIMITDataset.pad_train_data(batch_inputs)
-                batch_targets = pad_np_arrays(batch_targets)
-                batch_dense_shape = np.array([x for x in np.array(batch_targets).shape])
-
-                # get a sparse representation of the targets (tf.nn.ctc_loss needs it for some reason)
-                batch_indices, batch_values = array_to_sparse_tuple(np.array(batch_targets))
-                
-                # run the session on the training data
-                feed = {inputs: np.array(batch_inputs),
-                        targets: (np.array(batch_indices), np.array(batch_values), batch_dense_shape),
-                        seq_length: batch_seq_length}
-
-                batch_cost, _ = session.run([cost, optimizer], feed)
-                train_cost += batch_cost*BATCH_SIZE
-                train_ler += session.run(ler, feed_dict=feed)*BATCH_SIZE
-
-                
-                if batch % 1000 == 0:
-                    log = "Time: {:.3f}: Batch {:.0f}"
-                    logging.info(log.format(time.time() - start, batch))
-
-            train_cost /= num_examples
-            train_ler /= num_examples
-
-            # get information on the validation set accuracy
-            val_seq_length = dataset.val_timesteps
-            val_inputs = dataset.X_val
-            val_targets = dataset.y_val
-
-            # pad both inputs and targets to max time length in the batch
-            val_inputs = TIMITDataset.pad_train_data(val_inputs)
-            val_targets = pad_np_arrays(val_targets)
-            val_dense_shape = np.array([x for x in np.array(val_targets).shape])
-
-            # get a sparse representation of the targets (tf.nn.ctc_loss needs it for some reason)
-            val_indices, val_values = array_to_sparse_tuple(np.array(val_targets))
-            
-            # run the session on the training data
-            feed = {inputs: np.array(val_inputs),
-                    targets: (np.array(val_indices), np.array(val_values), val_dense_shape),
-                    seq_length: val_seq_length}
-
-            val_cost = session.run(cost, feed_dict=feed)
-            val_ler = session.run(ler, feed_dict=feed)*(VALIDATION_SIZE)
-
-
-            log = "Epoch {:.0f}, train_cost = {:.3f}, train_ler = {:.3f}, val_cost = {:.3f}, val_ler = {:.3f}, time = {:.3f}"
-            logging.info(log.format(curr_epoch+1, train_cost, train_ler, val_cost, val_ler,
-                             time.time() - start))
-
-        
-            # decode a few examples each epoch to monitor progress
-            # prepare data and targets
-            start_index = 0
-            end_index = BATCH_SIZE
-
-            # get the data needed for the feed_dict this batch
-            batch_seq_length = [time_length for time_length in dataset.train_timesteps[start_index:end_index]]
-            batch_inputs = dataset.X_train[start_index:end_index]
-            batch_targets = dataset.y_train[start_index:end_index]
-            batch_dense_shape = np.array([x for x in np.array(batch_targets).shape])
-
-            # pad both inputs and targets to max time length in the batch
-            batch_inputs = TIMITDataset.pad_train_data(batch_inputs)
-            batch_targets = pad_np_arrays(batch_targets)
-            
-            # get a sparse representation of the targets (tf.nn.ctc_loss needs it for some reason)
-            batch_indices, batch_values = array_to_sparse_tuple(np.array(batch_targets))
-            
-            feed = {inputs: np.array(batch_inputs),
-                    targets: (np.array(batch_indices), np.array(batch_values), batch_dense_shape),
-                    seq_length: batch_seq_length}
-
-            d = session.run(decoded[0], feed_dict=feed)
-            dense_decoded = tf.sparse_tensor_to_dense(d, default_value=-1).eval(session=session)
-
-            for i, seq in list(enumerate(dense_decoded))[:2]:
-                seq = [s for s in seq if s != -1]
-                inverse_dict = {Constants.TIMIT_PHONEME_DICT[k] : k for k in Constants.TIMIT_PHONEME_DICT}
-                original_phoneme_transcription = ' '.join([inverse_dict[k] for k in batch_targets[i]])
-                estimated_phoneme_transcription = ' '.join([inverse_dict[k] for k in seq])
-                logging.info('Sequence %d' %i)
-                logging.info('Original \n%s' %original_phoneme_transcription)
-                logging.info('Estimated \n%s' %estimated_phoneme_transcription)
-
-            if curr_epoch % 5 == 0:
-                saver.save(session, os.path.join(Constants.TRAINED_MODELS_FOLDER, ID_STRING + "_" + str(curr_epoch) + "e.ckpt"))
-
-        saver.save(session, os.path.join(Constants.TRAINED_MODELS_FOLDER, ID_STRING + "_final.ckpt"))
-    return 
+        exchange = None
+        workers = []
+        train_data = dataset
+        # every process runs the same number of steps per epoch
+        steps_per_epoch = None
+        try:
+            if n_workers > 1:
+                # TensorFlow is not fork-safe
+                context = multiprocessing.get_context('spawn')
+                variables = session.run(model['variables'])
+                exchange = GradientExchange(n_workers, sum(v.size for v in variables), context)
+                steps_per_epoch = (num_examples // n_workers) // BATCH_SIZE
+                for rank in range(1, n_workers):
+                    worker = context.Process(target=train_worker,
+                                             args=(rank, n_workers, dataset.shard(rank, n_workers), num_features,
+                                                   num_classes, steps_per_epoch, exchange))
+                    worker.start()
+                    workers.append(worker)
+                exchange.broadcast(0, flatten(variables))
+                train_data = dataset.shard(0, n_workers)
+
+            sampler = BucketSampler(train_data.train_timesteps, BATCH_SIZE, n_buckets=NUM_BUCKETS)
+            for curr_epoch in range(NUM_EPOCHS):
+                start = time.time()
+
+                batches = sampler.epoch()[:steps_per_epoch]
+                logging.info('Padding ratio: {:.3f}'.format(sampler.padding_ratio(batches)))
+                train_cost, train_ler = train_epoch(session, model, train_data, batches, 0, exchange)
+
+                evaluate_epoch(session, model, dataset, curr_epoch, train_cost, train_ler, start)
+
+                if curr_epoch % 5 == 0:
+                    saver.save(session, os.path.join(Constants.TRAINED_MODELS_FOLDER, ID_STRING + "_" + str(curr_epoch) + "e.ckpt"))
+
+            saver.save(session, os.path.join(Constants.TRAINED_MODELS_FOLDER, ID_STRING + "_final.ckpt"))
+            for worker in workers:
+                worker.join()
+        except BaseException:
+            # do not leave the workers waiting for this process
+            if exchange is not None:
+                exchange.barrier.abort()
+            raise
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
 
 def create_model_keras():
     x = Input(shape=(NUM_FEATURES, None, None))
@@ -228,7 +546,10 @@ if __name__ == "__main__":
         # create the dataset
         MyTimitDataset = TIMITDataset()
         MyTimitDataset.load()
-        MyTimitDataset.to_file()
+        MyTimitDataset.to_store()
+    elif len(glob.glob("timit*.store")) > 0:
+        # memory-map it from a ragged store
+        MyTimitDataset = TIMITDataset.from_store(glob.glob("timit*.store")[0])
     else:
         # just load it from pickle
         filename = glob.glob("timit*.pickle")[0]
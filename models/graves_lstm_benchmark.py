@@ -0,0 +1,85 @@
+'''
+Throughput benchmark of the RNN backends of models.graves_lstm, training on
+synthetic batches shaped like the TIMIT ones. Each backend runs in its own
+process, so that the reported peak memory is its own. Run with
+
+    python -m models.graves_lstm_benchmark --steps 20 --backends lstm_cell block_fused
+'''
+import argparse
+import resource
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils.utils import ragged_to_sparse_tuple
+from data.dataset import TIMITDataset
+from models.graves_lstm import build_graph, RNN_BACKENDS, BATCH_SIZE
+
+
+def synthetic_batches(n_batches, num_features, num_classes, min_frames, max_frames, random_state):
+    # about one phoneme every 10 frames, as in TIMIT with 5 ms steps
+    batches = []
+    for _ in range(n_batches):
+        seq_length = random_state.randint(min_frames, max_frames + 1, BATCH_SIZE)
+        inputs = random_state.randn(BATCH_SIZE, np.max(seq_length), num_features).astype(np.float32)
+        targets = [random_state.randint(0, num_classes - 1, length // 10) for length in seq_length]
+        batches.append((inputs, ragged_to_sparse_tuple(targets), seq_length))
+    return batches
+
+
+def benchmark_backend(backend, steps, warmup, num_features, min_frames, max_frames, seed):
+    '''
+    Runs warmup and then steps training steps with the given backend.
+    Returns the frames per second of the timed steps and the peak resident
+    memory of the process in MB.
+    '''
+    import tensorflow as tf
+    num_classes = max(TIMITDataset.phoneme_dict.values()) + 2
+    random_state = np.random.RandomState(seed)
+    batches = synthetic_batches(warmup + steps, num_features, num_classes, min_frames, max_frames,
+                                random_state)
+    graph, model = build_graph(num_features, num_classes, backend)
+    with tf.Session(graph=graph) as session:
+        session.run(model['init'])
+        frames = 0
+        for step, (inputs, targets, seq_length) in enumerate(batches):
+            if step == warmup:
+                start = time.perf_counter()
+            feed = {model['inputs']: inputs,
+                    model['targets']: targets,
+                    model['seq_length']: seq_length}
+            session.run([model['cost'], model['train_step']], feed)
+            if step >= warmup:
+                frames += np.sum(seq_length)
+        elapsed = time.perf_counter() - start
+    # kilobytes on Linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return frames / elapsed, peak_memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the RNN backends of the Graves LSTM.')
+    parser.add_argument('--backends', metavar='backends', type=str, nargs='+', default=list(RNN_BACKENDS),
+                        help='Backends to benchmark, among ' + ', '.join(RNN_BACKENDS))
+    parser.add_argument('--steps', metavar='steps', type=int, default=20,
+                        help='Number of timed training steps')
+    parser.add_argument('--warmup', metavar='warmup', type=int, default=2,
+                        help='Number of training steps run before timing')
+    parser.add_argument('--features', metavar='features', type=int, default=13,
+                        help='Number of features per frame')
+    parser.add_argument('--min-frames', metavar='min_frames', type=int, default=300,
+                        help='Minimum number of frames per utterance')
+    parser.add_argument('--max-frames', metavar='max_frames', type=int, default=800,
+                        help='Maximum number of frames per utterance')
+    parser.add_argument('--seed', metavar='seed', type=int, default=42,
+                        help='Random generator seed')
+    args = parser.parse_args()
+
+    # TensorFlow is not fork-safe
+    context = multiprocessing.get_context('spawn')
+    for backend in args.backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            frames_per_second, peak_memory = executor.submit(benchmark_backend, backend, args.steps, args.warmup,
+                                                             args.features, args.min_frames, args.max_frames,
+                                                             args.seed).result()
+        print('{}: {:.0f} frames/s, peak memory {:.0f} MB'.format(backend, frames_per_second, peak_memory))
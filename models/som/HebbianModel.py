@@ -1,24 +1,40 @@
-import tensorflow as tf
 import numpy as np
 import os
 import sys
+import json
 import matplotlib
 matplotlib.use('Agg')
 matplotlib.rcParams.update({'font.size': 8})
 import matplotlib.pyplot as plt
 from RepresentationExperiments.distance_experiments import get_prototypes
 from sklearn.preprocessing import MinMaxScaler
+from sklearn.metrics import confusion_matrix
 from utils.constants import Constants
 from utils.utils import softmax, get_plot_filename
+from models.som.synapses import hebbian_delta, hebbian_delta_sweep, normalize_synapses, SparseSynapses
+from models.som.retrieval import InnerProductIndex, LabelledNeuronIndex, target_set_key
 
 class HebbianModel(object):
 
+    # files making up a checkpoint in checkpoint_dir
+    WEIGHTS_FILENAME = 'hebbian_weights.npy'
+    SPARSE_WEIGHTS_FILENAME = 'hebbian_weights_sparse.npz'
+    METADATA_FILENAME = 'hebbian_metadata.json'
+    # neighbours per neuron kept by the labelled neuron indexes
+    DEFAULT_NEIGHBOURS = 16
+
     def __init__(self, som_a, som_v, a_dim, v_dim, learning_rate=10,
                  n_presentations=1, n_classes=10, threshold=.6,
-                 checkpoint_dir=None):
+                 checkpoint_dir=None, storage='dense'):
+        '''
+        storage: 'dense' keeps the weights in a num_neurons x num_neurons
+        array; 'sparse' keeps a constant baseline plus the learned increments
+        in a sparse matrix (see models.som.synapses.SparseSynapses), which is
+        what large maps need. The sparse baseline is the mean of the random
+        initialization of the dense weights.
+        '''
         assert som_a._m == som_v._m and som_a._n == som_v._n
         self.num_neurons = som_a._m * som_a._n
-        self._graph = tf.Graph()
         self.som_a = som_a
         self.som_v = som_v
         self.a_dim = a_dim
@@ -29,27 +45,27 @@ class HebbianModel(object):
         self.learning_rate = learning_rate
         self.threshold = threshold
         self._trained = False
-
-        with self._graph.as_default():
-            self.weights = tf.Variable(
-                             tf.random_normal([self.num_neurons, self.num_neurons],
-                             mean=1/self.num_neurons,
-                             stddev=1/np.sqrt(1000*self.num_neurons))
-                           )
-
-            self.activation_a = tf.placeholder(dtype=tf.float32, shape=[self.num_neurons])
-            self.activation_v = tf.placeholder(dtype=tf.float32, shape=[self.num_neurons])
-            self.assigned_weights = tf.placeholder(dtype=tf.float32, shape=[self.num_neurons, self.num_neurons])
-
-            self.delta = 1 - tf.exp(-self.learning_rate * tf.matmul(tf.reshape(self.activation_a, (-1, 1)),                            tf.reshape(self.activation_v, (1, -1))))
-            new_weights = tf.add(self.weights, self.delta)
-            self.training = tf.assign(self.weights, new_weights)
-
-            self.assign_op = tf.assign(self.weights, self.assigned_weights)
-
-            self._sess  = tf.Session()
-            init_op = tf.global_variables_initializer()
-            self._sess.run(init_op)
+        # retrieval index of the last target set used for predictions
+        self._target_index = None
+        self._target_index_key = None
+        self._target_set = None
+        # LabelledNeuronIndex of each SOM, by id
+        self._labelled_indexes = {}
+        # the weights are kept normalized; multiplied by this factor they give
+        # the sum of the initial weights and all the updates so far
+        self._weights_scale = 1.0
+
+        self.storage = storage
+        if storage == 'dense':
+            self.weights = np.random.normal(loc=1/self.num_neurons,
+                                            scale=1/np.sqrt(1000*self.num_neurons),
+                                            size=(self.num_neurons, self.num_neurons)
+                                           ).astype(np.float32)
+        elif storage == 'sparse':
+            self.weights = SparseSynapses((self.num_neurons, self.num_neurons),
+                                          baseline=1/self.num_neurons)
+        else:
+            raise ValueError('Unknown storage ' + str(storage))
 
     def train(self, input_a, input_v):
         '''
@@ -69,61 +85,192 @@ class HebbianModel(object):
                 is incoherent. len(input_a) = {}; len(input_v) = {}; \
                 n_presentations = {}, n_classes = {}'.format(len(input_a), len(input_v),
                                                       self.n_presentations, self.n_classes)
-        with self._sess:
-            # present images to model
-            for i in range(len(input_a)):
-                # get activations from som
-                activation_a, _ = self.som_a.get_activations(input_a[i])
-                activation_v, _ = self.som_v.get_activations(input_v[i])
-
-                # run training op
-                _, d = self._sess.run([self.training, self.delta],
-                                      feed_dict={self.activation_a: activation_a,
-                                                 self.activation_v: activation_v})
-
-            # normalize sum of weights to 1
-            w = self._sess.run(self.weights)
-            w = w.flatten()
-            w_sum = np.sum(w)
-            w_norm = [wi / w_sum for wi in w]
-            w = np.reshape(w_norm, (self.num_neurons, self.num_neurons))
-
-            self._sess.run(self.assign_op, feed_dict={self.assigned_weights: w})
-            self._trained = True
-
-            # save to checkpoint_dir
-            if self.checkpoint_dir != None:
-                saver = tf.train.Saver()
-                if not os.path.exists(self.checkpoint_dir):
-                    os.makedirs(self.checkpoint_dir)
-                saver.save(self._sess,
-                           os.path.join(self.checkpoint_dir,
-                                       'model.ckpt'),
-                           1)
-
-            # convert weights to numpy arrays from tf tensors
-            self.weights = self._sess.run(self.weights)
-
-    def restore_trained(self):
-        ckpt = tf.train.get_checkpoint_state(self.checkpoint_dir)
-        if ckpt and ckpt.model_checkpoint_path:
-            with self._sess:
-              saver = tf.train.Saver()
-              saver.restore(self._sess, ckpt.model_checkpoint_path)
-              self.weights = self._sess.run(self.weights)
-              print('RESTORED HEBBIAN MODEL')
-              return True
+        # get the activations of all the presentations at once
+        activations_a = self.som_a.get_activations_batch(input_a)
+        activations_v = self.som_v.get_activations_batch(input_v)
+        self._accumulate(activations_a, activations_v)
+
+        # save to checkpoint_dir
+        if self.checkpoint_dir != None:
+            self.save()
+
+    def _accumulate(self, activations_a, activations_v):
+        '''
+        Adds the updates of the given pairs of activations to the weights and
+        normalizes their sum to 1 again.
+        '''
+        if self.storage == 'sparse':
+            self.weights.scale(self._weights_scale)
+            self.weights.update(activations_a, activations_v, self.learning_rate)
+            self._weights_scale = self.weights.sum()
+            self.weights.normalize()
         else:
+            # restored weights may be memory-mapped read-only
+            if not self.weights.flags.writeable:
+                self.weights = np.array(self.weights)
+            self.weights *= self._weights_scale
+            hebbian_delta(activations_a, activations_v, self.learning_rate, out=self.weights)
+            self._weights_scale = float(np.sum(self.weights, dtype=np.float64))
+            normalize_synapses(self.weights)
+        self._trained = True
+
+    def presentation_curve(self, input_a, input_v, evaluate):
+        '''
+        Trains the model one presentation at a time and evaluates it after each
+        one, which costs about as much as training on all the presentations once.
+
+        input_a, input_v: folds as returned by create_folds in the experiment
+        scripts, i.e. n_classes examples per presentation, one presentation
+        after the other. Since the folds for n presentations are the first n of
+        them, the model after n steps is trained on exactly those folds.
+        evaluate: function called as evaluate(model, n) after n presentations;
+        the list of its results is returned.
+        '''
+        assert len(input_a) == len(input_v) and len(input_a) % self.n_classes == 0, \
+               'Expected the same number of examples, a multiple of n_classes = {}; got \
+                len(input_a) = {}; len(input_v) = {}'.format(self.n_classes, len(input_a),
+                                                             len(input_v))
+        activations_a = self.som_a.get_activations_batch(input_a)
+        activations_v = self.som_v.get_activations_batch(input_v)
+        results = []
+        for n in range(1, len(input_a) // self.n_classes + 1):
+            presentation = slice((n - 1) * self.n_classes, n * self.n_classes)
+            self._accumulate(activations_a[presentation], activations_v[presentation])
+            self.n_presentations = n
+            results.append(evaluate(self, n))
+        if self.checkpoint_dir != None:
+            self.save()
+        return results
+
+    def train_sweep(self, input_a, input_v, learning_rates):
+        '''
+        Trains one weight matrix per learning rate, from the current weights of
+        the model and one shared computation of the SOM activations, and
+        returns them as a [len(learning_rates), num_neurons, num_neurons]
+        array; the model itself is left untouched. weights[l] is what train
+        would give with learning_rate=learning_rates[l].
+        '''
+        assert self.storage == 'dense', 'Learning rate sweeps need dense weights'
+        assert len(input_a) == len(input_v) == self.n_presentations * self.n_classes, \
+               'Number of training examples and number of desired presentations \
+                is incoherent. len(input_a) = {}; len(input_v) = {}; \
+                n_presentations = {}, n_classes = {}'.format(len(input_a), len(input_v),
+                                                             self.n_presentations, self.n_classes)
+        activations_a = self.som_a.get_activations_batch(input_a)
+        activations_v = self.som_v.get_activations_batch(input_v)
+        weights = np.repeat(self.weights[np.newaxis] * self._weights_scale,
+                            len(learning_rates), axis=0)
+        hebbian_delta_sweep(activations_a, activations_v, learning_rates, out=weights)
+        return normalize_synapses(weights)
+
+    def evaluate_sweep(self, weights, X_a, X_v, y_a, y_v, source='v',
+                       prediction_alg='regular', k=4):
+        '''
+        Evaluates a stack of weight matrices, as returned by train_sweep, on the
+        same examples: the source activations are computed once and propagated
+        through all the matrices with a single batched product. Returns the
+        array of accuracies, one per matrix.
+        '''
+        if source == 'v':
+            X_source, X_target, y_source, y_target = X_v, X_a, y_v, y_a
+            source_som, target_som = self.som_v, self.som_a
+            # propagate_activation_batch multiplies by weights.T for 'v'
+            weights = np.swapaxes(weights, -1, -2)
+        elif source == 'a':
+            X_source, X_target, y_source, y_target = X_a, X_v, y_a, y_v
+            source_som, target_som = self.som_a, self.som_v
+        else:
+            raise ValueError('Wrong string for source parameter')
+        y_source = np.asarray(y_source)
+        source_activations = source_som.get_activations_batch(X_source)
+        # [n_matrices, n_examples, num_neurons]
+        target_activations = np.matmul(source_activations, weights)
+        y_pred = self.resolve_predictions(target_activations.reshape(-1, self.num_neurons),
+                                          target_som, prediction_alg, X_target=X_target,
+                                          y_target=y_target, k=k)
+        y_pred = y_pred.reshape(len(weights), len(y_source))
+        return np.mean(y_pred == y_source, axis=1)
+
+    def save(self, checkpoint_dir=None):
+        '''
+        Saves the weights as a single .npy file (.npz for sparse storage) in
+        checkpoint_dir (by default self.checkpoint_dir), next to a small json
+        file describing the model.
+        '''
+        if checkpoint_dir is None:
+            checkpoint_dir = self.checkpoint_dir
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        if self.storage == 'sparse':
+            self.weights.save(os.path.join(checkpoint_dir, self.SPARSE_WEIGHTS_FILENAME))
+            dtype = str(self.weights.matrix.dtype)
+        else:
+            np.save(os.path.join(checkpoint_dir, self.WEIGHTS_FILENAME), self.weights)
+            dtype = str(self.weights.dtype)
+        metadata = {'num_neurons': self.num_neurons,
+                    'shape': list(self.weights.shape),
+                    'dtype': dtype,
+                    'storage': self.storage,
+                    'a_dim': self.a_dim,
+                    'v_dim': self.v_dim,
+                    'learning_rate': self.learning_rate,
+                    'n_presentations': self.n_presentations,
+                    'n_classes': self.n_classes,
+                    'threshold': self.threshold,
+                    'weights_scale': self._weights_scale}
+        with open(os.path.join(checkpoint_dir, self.METADATA_FILENAME), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+    def restore_trained(self, mmap=False):
+        '''
+        Restores the weights saved in self.checkpoint_dir. If mmap is True, the
+        weights are memory-mapped read-only instead of being read in memory
+        (dense storage only). Checkpoints written by the former TensorFlow
+        implementation are still readable (this requires TensorFlow).
+        '''
+        weights_path = os.path.join(self.checkpoint_dir, self.WEIGHTS_FILENAME)
+        sparse_weights_path = os.path.join(self.checkpoint_dir, self.SPARSE_WEIGHTS_FILENAME)
+        if self.storage == 'sparse' and os.path.exists(sparse_weights_path):
+            weights = SparseSynapses.load(sparse_weights_path)
+        elif self.storage == 'sparse':
             print('NO CHECKPOINT FOUND')
             return False
+        elif os.path.exists(weights_path):
+            weights = np.load(weights_path, mmap_mode='r' if mmap else None)
+        else:
+            weights = self._load_tf_checkpoint()
+            if weights is None:
+                print('NO CHECKPOINT FOUND')
+                return False
+        assert weights.shape == (self.num_neurons, self.num_neurons), \
+               'Checkpoint weights have shape {}, expected {}'.format(
+                   weights.shape, (self.num_neurons, self.num_neurons))
+        self.weights = weights
+        metadata_path = os.path.join(self.checkpoint_dir, self.METADATA_FILENAME)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r') as f:
+                self._weights_scale = json.load(f).get('weights_scale', 1.0)
+        self._trained = True
+        print('RESTORED HEBBIAN MODEL')
+        return True
+
+    def _load_tf_checkpoint(self):
+        try:
+            import tensorflow as tf
+        except ImportError:
+            return None
+        ckpt = tf.train.get_checkpoint_state(self.checkpoint_dir)
+        if ckpt and ckpt.model_checkpoint_path:
+            return tf.train.load_variable(ckpt.model_checkpoint_path, 'Variable')
+        return None
 
     def propagate_activation(self, source_activation, source_som='v'):
         source_activation = np.array(source_activation).reshape((-1, 1))
         if source_som == 'a':
-            target_activation = np.matmul(self.weights.T, np.array(source_activation).reshape((-1, 1)))
+            target_activation = self.weights.T @ np.array(source_activation).reshape((-1, 1))
             to_som = self.som_v
         else:
-            target_activation = np.matmul(self.weights, np.array(source_activation).reshape((-1, 1)))
+            target_activation = self.weights @ np.array(source_activation).reshape((-1, 1))
             to_som = self.som_a
         try:
             assert target_activation.shape[0] == (to_som._n * to_som._m)
@@ -160,77 +307,150 @@ class HebbianModel(object):
         target_bmu_index = np.argmax(target_activation)
         return source_bmu_index, target_bmu_index
 
+    def propagate_activation_batch(self, source_activations, source_som='v'):
+        '''
+        Same as propagate_activation for a whole matrix of source activations,
+        one example per row. Returns the [n_examples, num_neurons] matrix of
+        target activations.
+        '''
+        source_activations = np.atleast_2d(source_activations)
+        if source_som == 'a':
+            return source_activations @ self.weights
+        elif source_som == 'v':
+            return source_activations @ self.weights.T
+        else:
+            raise ValueError('Wrong string for source_som parameter')
+
     def evaluate(self, X_a, X_v, y_a, y_v, source='v', img_path=None, prediction_alg='regular'):
+        accuracy, y_pred, _ = self.evaluate_batch(X_a, X_v, y_a, y_v, source=source,
+                                                  prediction_alg=prediction_alg)
+        print('correct: {}' .format(int(round(accuracy * len(y_pred)))))
+        return accuracy
+
+    def evaluate_batch(self, X_a, X_v, y_a, y_v, source='v', prediction_alg='regular', k=4):
+        '''
+        Evaluates the model on all the examples of the source modality at once.
+        Returns the accuracy, the array of predicted labels and the confusion
+        matrix (true labels on the rows, predicted labels on the columns).
+        '''
         if source == 'v':
             X_source = X_v
             X_target = X_a
             y_source = y_v
             y_target = y_a
-            source_som = self.som_v
-            target_som = self.som_a
         elif source == 'a':
             X_source = X_a
             X_target = X_v
             y_source = y_a
             y_target = y_v
+        else:
+            raise ValueError('Wrong string for source parameter')
+        y_source = np.asarray(y_source)
+        y_pred = self.predict(X_source, source=source, prediction_alg=prediction_alg,
+                              X_target=X_target, y_target=y_target, k=k)
+        correct = np.sum(y_pred == y_source)
+        labels = np.union1d(y_source, y_pred)
+        confusion = confusion_matrix(y_source, y_pred, labels=labels)
+        return correct/len(y_pred), y_pred, confusion
+
+    def predict(self, X_source, source='v', prediction_alg='regular', X_target=None,
+                y_target=None, k=4):
+        '''
+        Predicts the labels of all the examples in X_source by propagating their
+        activations to the other SOM with a single matrix product. Targets
+        (X_target, y_target) are only needed by the 'regular' algorithm; the
+        other ones rely on the bmu_class_dict of the target SOM.
+        '''
+        if source == 'v':
+            source_som = self.som_v
+            target_som = self.som_a
+        elif source == 'a':
             source_som = self.som_a
             target_som = self.som_v
         else:
             raise ValueError('Wrong string for source parameter')
+        source_activations = source_som.get_activations_batch(X_source)
+        target_activations = self.propagate_activation_batch(source_activations, source_som=source)
+        return self.resolve_predictions(target_activations, target_som, prediction_alg,
+                                        X_target=X_target, y_target=y_target, k=k)
 
-        y_pred = []
-        img_n = 0
-
-        for x, y in zip(X_source, y_source):
-            if prediction_alg == 'regular':
-                yi_pred = self.make_prediction(x, y, source_som, target_som, X_target, y_target, source)
-            elif prediction_alg == 'knn':
-                yi_pred = self.make_prediction_knn(x, y, 4, source_som, target_som, source)
-            elif prediction_alg == 'knn2':
-                yi_pred = self.make_prediction_knn_weighted(x, y, 4, source_som, target_som, source)
-            elif prediction_alg == 'sorted':
-                yi_pred = self.make_prediction_sort(x, source_som, target_som, source)
-            else:
-                raise ValueError('Unknown evaluation algorithm ' + str(prediction_alg))
-            y_pred.append(yi_pred)
-        correct = 0
-        for yi, yj in zip(y_pred, y_source):
-            if yi == yj:
-                correct += 1
-        print('correct: {}' .format(correct))
-        print(y_source)
-        print(y_pred)
-        return correct/len(y_pred)
+    def resolve_predictions(self, target_activations, target_som, prediction_alg='regular',
+                            X_target=None, y_target=None, k=4):
+        '''
+        Turns a matrix of propagated activations (one example per row) into
+        predicted labels, with the same rules as make_prediction ('regular'),
+        make_prediction_knn ('knn'), make_prediction_knn_weighted ('knn2') and
+        make_prediction_sort ('sorted').
+        '''
+        target_bmus = np.argmax(target_activations, axis=1)
+        if prediction_alg == 'regular':
+            # the label of the target example most similar to the target bmu
+            bmu_weights = np.asarray(target_som._weightages)[target_bmus]
+            # hashing the target set once per batch catches in-place changes
+            return self.get_target_index(X_target, y_target, check_contents=True).predict(bmu_weights)
+        elif prediction_alg not in ['knn', 'knn2', 'sorted']:
+            raise ValueError('Unknown evaluation algorithm ' + str(prediction_alg))
+
+        labelled_index = self.get_labelled_index(target_som, k)
+        if prediction_alg == 'sorted':
+            return labelled_index.sorted_predict(target_activations)
+        return labelled_index.knn_predict(target_activations, k,
+                                          weighted=prediction_alg == 'knn2')
 
     def make_prediction(self, x, y, source_som, target_som, X_target, y_target, source):
         source_bmu, target_bmu = self.get_bmus_propagate(x, source_som=source)
-        target_activations = []
         target_bmu_weights = np.reshape(target_som._weightages[target_bmu],
                                        (1, -1))
-        for yi_target, xi_target in zip(y_target, X_target):
-            xi_target = np.reshape(xi_target, (-1, 1))
-            activation = np.dot(target_bmu_weights, xi_target)
-            # alternative way to compute the activation. should be the same performance wise. (untested)
-            #activation = np.absolute(xi_target - target_bmu_weights)
-            #activation = np.exp(-(np.sum(activation)/len(activation))/self.tau)
-            # save a correct example for later visualization, if necessary
-            if yi_target == y:
-                xi_true = xi_target
-            # the float cast is so that 'activation' is not seen as an array but as an element
-            target_activations.append(float(activation))
-        yi_pred_idx = np.argmax(target_activations)
-        yi_pred = y_target[yi_pred_idx]
-        return yi_pred
+        return self.get_target_index(X_target, y_target).predict(target_bmu_weights)[0]
+
+    def build_target_index(self, X_target, y_target, **index_options):
+        '''
+        Builds the retrieval index used by the 'regular' prediction algorithm
+        for the target set (X_target, y_target) and keeps it for the following
+        predictions on the same set. index_options are passed to
+        InnerProductIndex, e.g. approximate=True for large target sets.
+        '''
+        self._target_index = InnerProductIndex(X_target, y_target, **index_options)
+        self._target_index_key = target_set_key(X_target, y_target)
+        # the given objects, not copies, so that get_target_index can compare identities
+        self._target_set = (X_target, y_target)
+        return self._target_index
+
+    def get_target_index(self, X_target, y_target, check_contents=False):
+        '''
+        Returns the retrieval index of the target set, building it only if it
+        was built for different objects or, with check_contents, if their
+        contents changed since. Checking the contents hashes the whole set, so
+        per-example callers do not; call build_target_index after changing a
+        target set in place.
+        '''
+        if self._target_set is None or self._target_set[0] is not X_target \
+           or self._target_set[1] is not y_target \
+           or (check_contents and self._target_index_key != target_set_key(X_target, y_target)):
+            return self.build_target_index(X_target, y_target)
+        return self._target_index
+
+    def get_labelled_index(self, som, k=0):
+        '''
+        Returns the LabelledNeuronIndex of som, holding at least k+1 neighbours
+        per neuron. It is rebuilt only when som.bmu_class_dict changes.
+        '''
+        index = self._labelled_indexes.get(id(som))
+        if index is None or index.bmu_class_dict is not som.bmu_class_dict \
+           or index.max_neighbours < min(k + 1, np.sum(index.labelled)):
+            index = LabelledNeuronIndex(som, max_neighbours=max(k + 1, self.DEFAULT_NEIGHBOURS))
+            self._labelled_indexes[id(som)] = index
+        return index
 
     def make_plot(self, x_source, x_target, y_target, X_target_all, source):
         source_bmu, target_bmu = self.get_bmus_propagate(x_source, source_som=source)
 
         if source == 'a':
-            hebbian_weights = self.weights[:][source_bmu]
+            hebbian_weights = self.weights[source_bmu]
             source_som = self.som_a
             target_som = self.som_v
         else:
-            hebbian_weights = self.weights[source_bmu][:]
+            hebbian_weights = self.weights[source_bmu]
             source_som = self.som_v
             target_som = self.som_a
 
@@ -269,19 +489,13 @@ class HebbianModel(object):
         Returns two lists containing respectively the level of activation
         and positions for the BMU and its closest k units. The length of these
         lists is therefore k+1, with the BMU information in the first position.
+        Only units with examples mapped to them are considered; their order is
+        looked up in the LabelledNeuronIndex of som, so pos_activations is not
+        used anymore.
         '''
-        bmu_index = np.argmax(activations)
-        bmu_position = pos_activations[bmu_index]
-        distances_from_bmu = [np.linalg.norm(bmu_position - unit_position) for unit_position in pos_activations]
-        sorted_indexes = list(range(len(distances_from_bmu)))
-        sorted_indexes.sort(key=distances_from_bmu.__getitem__)
-        sorted_activations = list(map(activations.__getitem__, sorted_indexes))
-        sorted_positions = list(map(pos_activations.__getitem__, sorted_indexes))
-        sorted_tuple = [(act, index) for act, index in zip(sorted_activations, sorted_indexes)
-                          if som.bmu_class_dict[index] != []]
-        sorted_activations = list(zip(*sorted_tuple))[0]
-        sorted_indexes = list(zip(*sorted_tuple))[1]
-        return sorted_activations[:k+1], sorted_indexes[:k+1]
+        activations = np.asarray(activations)
+        closest = self.get_labelled_index(som, k).closest(np.argmax(activations), k)
+        return tuple(activations[closest]), tuple(closest)
 
 
     def make_prediction_knn(self, x, y, k, source_som, target_som, source):
@@ -337,19 +551,8 @@ class HebbianModel(object):
         source_activation, _ = source_som.get_activations(x)
         source_activation = np.array(source_activation).reshape((-1, 1))
         target_activation = self.propagate_activation(source_activation, source_som=source)
-        for i in range(len(target_activation)):
-            hebbian_bmu_index = np.argmax(target_activation)
-            bmu_class_list = target_som.bmu_class_dict[hebbian_bmu_index]
-            if bmu_class_list != []:
-                # TODO: note that this ignores superpositions, which might give
-                # trouble in the future.
-                return bmu_class_list[0]
-            if target_activation[hebbian_bmu_index] == -1:
-                print('Error: make_prediction_sort failed.')
-                return
-            # discard this activation so that argmax does not find it again next
-            # iteration
-            target_activation[hebbian_bmu_index] = -1
+        # most activated neuron among the ones with examples mapped to them
+        return self.get_labelled_index(target_som).sorted_predict(target_activation.reshape((1, -1)))[0]
 
     def threshold_activation(self, x):
         idx = x < self.threshold
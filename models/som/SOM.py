@@ -25,6 +25,7 @@ matplotlib.rcParams.update({'font.size': 8})
 import matplotlib.pyplot as plt
 from utils.constants import Constants
 from matplotlib import colors
+from scipy.spatial.distance import cdist
 
 
 class SOM(object):
@@ -103,6 +104,10 @@ class SOM(object):
 
             #The training vectors
             self._vect_input = tf.placeholder("float", [None, dim])
+            #Per-sample weights of the training vectors. When they are not
+            #fed, every vector in the batch counts once
+            self._weight_input = tf.placeholder_with_default(
+                tf.ones_like(self._vect_input[:, 0]), [None])
             #Iteration number
             self._iter_input = tf.placeholder("float")
 
@@ -161,10 +166,16 @@ class SOM(object):
 
     def _get_weight_delta(self, learning_rate_matrix):
         """
+        Weighted average over the batch of the updates pulling each neuron
+        towards the inputs. With unit weights this is a plain mean, so
+        within a batch a vector with weight w moves the map as much as w
+        copies of it would. Across batches this does not hold: fewer
+        distinct vectors make fewer batches, hence fewer updates.
         """
         diff_matrix = tf.cast(tf.expand_dims(self._vect_input, 1) - self._weightage_vects, "float32")
         mul = tf.expand_dims(learning_rate_matrix, 2) * diff_matrix
-        delta = tf.reduce_mean(mul, 0)
+        sample_weights = tf.reshape(self._weight_input, [-1, 1, 1])
+        delta = tf.reduce_sum(mul * sample_weights, 0) / tf.reduce_sum(self._weight_input)
         return delta
 
     def _get_bmu_distances(self, bmu_loc):
@@ -194,14 +205,21 @@ class SOM(object):
             for j in range(n):
                 yield np.array([i, j])
 
-    def train(self, input_vects):
+    def train(self, input_vects, sample_weights=None):
         """
         Trains the SOM.
         'input_vects' should be an iterable of 1-D NumPy arrays with
         dimensionality as provided during initialization of this SOM.
+        'sample_weights' optionally gives the number of times each vector
+        should count in the update of its batch, e.g. the counts returned by
+        utils.utils.collapse_duplicates. Each iteration still runs one
+        update per batch of input_vects, so collapsed inputs get fewer
+        updates than the replicated ones they stand for.
         Current weightage vectors for all neurons(initially random) are
         taken as starting conditions for training.
         """
+        if sample_weights is not None:
+            assert len(sample_weights) == len(input_vects)
         with self._sess:
           #Training iterations
           for iter_no in range(self._n_iterations):
@@ -217,9 +235,12 @@ class SOM(object):
                   count = count + 1
                   start = self.batch_size * i
                   end = self.batch_size * (i+1)
+                  feed_dict = {self._vect_input: input_vects[start:end],
+                               self._iter_input: iter_no}
+                  if sample_weights is not None:
+                      feed_dict[self._weight_input] = sample_weights[start:end]
                   _, a = self._sess.run([self._training_op, self.weightage_delta],
-                                 feed_dict={self._vect_input: input_vects[start:end],
-                                            self._iter_input: iter_no})
+                                 feed_dict=feed_dict)
 
           #Store a centroid grid for easy retrieval later on
           centroid_grid = [[] for i in range(self._m)]
@@ -289,12 +310,13 @@ class SOM(object):
         if not self._trained:
             raise ValueError("SOM not trained yet")
 
+        input_vects = np.atleast_2d(np.asarray(input_vects, dtype=float))
+        weightages = np.asarray(self._weightages, dtype=float)
         to_return = []
-        for vect in input_vects:
-            min_index = min([i for i in range(len(self._weightages))],
-                            key=lambda x: np.linalg.norm(vect-
-                                                         self._weightages[x]))
-            to_return.append(self._locations[min_index])
+        # chunks of inputs bound the size of the distance matrix
+        for start in range(0, len(input_vects), 1024):
+            distances = cdist(input_vects[start:start+1024], weightages)
+            to_return.extend(self._locations[i] for i in np.argmin(distances, axis=1))
 
         return to_return
 
@@ -348,6 +370,31 @@ class SOM(object):
           activations[idx] = 0
       return [activations,pos_activations]
 
+    def get_activations_batch(self, input_vects, normalize=True, threshold=True, mode='exp'):
+        """
+        Same as get_activations, for a whole set of inputs at once.
+        Returns an array of shape [len(input_vects), m*n] whose rows are
+        the activations get_activations would return for each input.
+        """
+        input_vects = np.atleast_2d(np.asarray(input_vects, dtype=float))
+        weightages = np.asarray(self._weightages, dtype=float)
+        # sum of absolute differences between every input and every neuron
+        d = cdist(input_vects, weightages, metric='cityblock')
+        if mode == 'exp':
+            activations = np.exp(-(d / weightages.shape[1]) / self.tau)
+        elif mode == 'linear':
+            activations = 1 / d
+        else:
+            raise ValueError('Unknown activation mode ' + str(mode))
+        if normalize:
+            min_ = activations.min(axis=1, keepdims=True)
+            max_ = activations.max(axis=1, keepdims=True)
+            activations -= min_
+            activations /= (max_ - min_)
+        if threshold:
+            activations[activations < self.threshold] = 0
+        return activations
+
 
 
     def plot_som(self, X, y, plot_name='som-viz.png'):
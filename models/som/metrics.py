@@ -0,0 +1,80 @@
+'''
+Compactness metrics of the clusters formed on a SOM grid by the BMUs of
+labelled inputs.
+
+Inputs mapped on a SOM only take as many distinct positions as the SOM has
+neurons, so the kernels below work on the histogram of the distinct positions:
+their cost grows with the number of inputs only linearly, and quadratically
+with the number of distinct positions.
+'''
+import numpy as np
+from scipy.spatial.distance import cdist
+
+
+def mean_pairwise_distance(positions, first_occurrence=True, chunk_size=1024):
+    '''
+    Mean Euclidean distance between the pairs of rows of positions.
+
+    With first_occurrence=True pairs are counted as the loops of
+    wordLearningTest.distanceIntraClass did: position k is paired with every
+    position after the first one equal to it (as found by list.index), so
+    repeated positions also count the pairs before and with themselves.
+    With first_occurrence=False every unordered pair counts once.
+
+    Returns nan if there is no pair.
+    '''
+    positions = np.asarray(positions, dtype=float).reshape(len(positions), -1)
+    n = len(positions)
+    if n < 2:
+        return np.nan
+    cells, first, inverse, counts = np.unique(positions, axis=0, return_index=True,
+                                              return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    n_cells = len(cells)
+
+    if not first_occurrence:
+        total = 0.0
+        for start in range(0, n_cells, chunk_size):
+            end = start + chunk_size
+            distances = cdist(cells[start:end], cells)
+            total += counts[start:end] @ distances @ counts
+        return total / (n * (n - 1))
+
+    # cells sorted by first occurrence: the members of cell w after the first
+    # occurrence of cell u are those not in the intervals up to it
+    order = np.argsort(first)
+    sorted_first = first[order]
+    interval = np.searchsorted(sorted_first, np.arange(n), side='left')
+    seen = np.zeros(n_cells)
+    total = 0.0
+    for start in range(0, n_cells, chunk_size):
+        end = min(start + chunk_size, n_cells)
+        members = (interval >= start) & (interval < end)
+        histogram = np.bincount((interval[members] - start) * n_cells + inverse[members],
+                                minlength=(end - start) * n_cells).reshape(end - start, n_cells)
+        counts_up_to = seen + np.cumsum(histogram, axis=0)
+        seen = counts_up_to[-1]
+        chunk_cells = order[start:end]
+        after = counts - counts_up_to
+        distances = cdist(cells[chunk_cells], cells)
+        total += counts[chunk_cells] @ np.sum(distances * after, axis=1)
+    n_pairs = np.sum(counts * (n - 1 - first))
+    return total / n_pairs
+
+
+def class_distances(positions, labels, first_occurrence=True):
+    '''
+    Mean pairwise distance of the positions of each class, as a dict keyed by
+    the sorted labels, and mean pairwise distance of all the positions, taken
+    class by class in that order.
+    '''
+    positions = np.asarray(positions, dtype=float).reshape(len(positions), -1)
+    labels = np.asarray(labels)
+    intra = dict()
+    ordered = []
+    for c in np.unique(labels):
+        class_positions = positions[labels == c]
+        intra[c] = mean_pairwise_distance(class_positions, first_occurrence=first_occurrence)
+        ordered.append(class_positions)
+    inter = mean_pairwise_distance(np.concatenate(ordered), first_occurrence=first_occurrence)
+    return intra, inter
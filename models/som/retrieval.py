@@ -0,0 +1,235 @@
+'''
+Indexes answering the lookups done when predicting labels through the
+Hebbian connections.
+'''
+import hashlib
+import numpy as np
+
+
+class InnerProductIndex(object):
+    '''
+    Maximum inner product search over a fixed set of target examples, e.g. to
+    find the example closest to the weights of a propagated BMU.
+
+    The targets are stored once as a contiguous matrix and queries are answered
+    in batches with one matrix product per chunk of queries. With
+    approximate=True the targets are also partitioned with k-means into
+    n_lists lists, and each query only scans the n_probe lists whose centroids
+    have the largest inner product with it.
+
+    Approximate queries may miss some of the true top k. If n_probe is not
+    given it is calibrated on a sample of the targets used as queries: it is
+    the smallest number of lists that finds target_recall of their true top
+    recall_k, and the recall reached on the sample is kept in
+    estimated_recall. Queries far from the distribution of the targets may
+    get a lower recall.
+    '''
+
+    def __init__(self, X, y=None, approximate=False, n_lists=None, n_probe=None,
+                 n_iterations=10, chunk_size=1024, seed=None, target_recall=0.95,
+                 recall_k=5, n_calibration=256):
+        self.X = np.ascontiguousarray(X, dtype=float)
+        self.y = None if y is None else np.asarray(y)
+        self.chunk_size = chunk_size
+        self.approximate = approximate
+        if approximate:
+            if n_lists is None:
+                n_lists = int(np.sqrt(len(self.X)))
+            self.n_lists = max(1, min(n_lists, len(self.X)))
+            random_state = np.random.RandomState(seed)
+            self._build_lists(n_iterations, random_state)
+            if n_probe is None:
+                n_probe = self._calibrate_n_probe(target_recall, recall_k, n_calibration, random_state)
+            self.n_probe = max(1, min(n_probe, self.n_lists))
+
+    def __len__(self):
+        return len(self.X)
+
+    def _build_lists(self, n_iterations, random_state):
+        '''
+        Runs a few iterations of k-means on the targets and sorts them by list,
+        so that the members of each list are contiguous.
+        '''
+        centroids = self.X[random_state.choice(len(self.X), self.n_lists, replace=False)]
+        squared_norms = np.sum(self.X ** 2, axis=1)
+
+        def assign(centroids):
+            distances = (squared_norms[:, np.newaxis] - 2 * np.matmul(self.X, centroids.T)
+                         + np.sum(centroids ** 2, axis=1))
+            return np.argmin(distances, axis=1)
+
+        for i in range(n_iterations):
+            assignment = assign(centroids)
+            counts = np.bincount(assignment, minlength=self.n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self.X)
+            # empty lists keep their previous centroid
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+        self.centroids = centroids
+        self._assignment = assign(centroids)
+        assignment = self._assignment
+        self._order = np.argsort(assignment, kind='stable')
+        self._sorted_X = self.X[self._order]
+        self._list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment,
+                                                                        minlength=self.n_lists))))
+
+    def _calibrate_n_probe(self, target_recall, recall_k, n_calibration, random_state):
+        '''
+        Smallest n_probe that finds target_recall of the true top recall_k of
+        a sample of the targets, used as queries.
+        '''
+        sample = random_state.choice(len(self.X), min(n_calibration, len(self.X)), replace=False)
+        Q = self.X[sample]
+        k = min(recall_k, len(self.X))
+        true_top = _top_k(np.matmul(Q, self.X.T), k)[0]
+        # rank of the list of each true neighbour among the lists probed by its query
+        list_ranks = np.argsort(np.argsort(-np.matmul(Q, self.centroids.T), axis=1, kind='stable'),
+                                axis=1)
+        needed = np.take_along_axis(list_ranks, self._assignment[true_top], axis=1).ravel()
+        n_probe = int(np.ceil(np.quantile(needed + 1, target_recall)))
+        self.estimated_recall = np.mean(needed < n_probe)
+        return n_probe
+
+    def query(self, Q, k=1):
+        '''
+        Returns the indexes of the k targets with the largest inner product with
+        each row of Q, and those inner products, as two [len(Q), k] arrays
+        sorted by decreasing inner product.
+        '''
+        Q = np.atleast_2d(np.asarray(Q, dtype=float))
+        k = min(k, len(self.X))
+        indexes = np.empty((len(Q), k), dtype=int)
+        scores = np.empty((len(Q), k))
+        for start in range(0, len(Q), self.chunk_size):
+            end = start + self.chunk_size
+            if self.approximate:
+                indexes[start:end], scores[start:end] = self._query_lists(Q[start:end], k)
+            else:
+                indexes[start:end], scores[start:end] = _top_k(np.matmul(Q[start:end], self.X.T), k)
+        return indexes, scores
+
+    def _query_lists(self, Q, k):
+        probed = _top_k(np.matmul(Q, self.centroids.T), self.n_probe)[0]
+        indexes = np.full((len(Q), k), -1)
+        scores = np.full((len(Q), k), -np.inf)
+        for l in range(self.n_lists):
+            queries = np.nonzero(np.any(probed == l, axis=1))[0]
+            start, end = self._list_offsets[l], self._list_offsets[l + 1]
+            if len(queries) == 0 or start == end:
+                continue
+            # merge the members of this list into the running top k
+            list_scores = np.matmul(Q[queries], self._sorted_X[start:end].T)
+            candidates = np.concatenate((indexes[queries],
+                                         np.broadcast_to(self._order[start:end],
+                                                         list_scores.shape)), axis=1)
+            best, scores[queries] = _top_k(np.concatenate((scores[queries], list_scores), axis=1), k)
+            indexes[queries] = np.take_along_axis(candidates, best, axis=1)
+        return indexes, scores
+
+    def predict(self, Q):
+        '''
+        Returns the label of the best matching target for each row of Q.
+        '''
+        return self.y[self.query(Q, k=1)[0][:, 0]]
+
+
+def _top_k(scores, k):
+    '''
+    Column indexes and values of the k largest entries of each row of scores,
+    sorted by decreasing value. Ties are broken by the lowest index, as
+    np.argmax does.
+    '''
+    if k == 1:
+        best = np.argmax(scores, axis=1)[:, np.newaxis]
+    else:
+        if k < scores.shape[1]:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            best = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        # sort the k winners, lowest index first among equal scores
+        best = np.sort(best, axis=1)
+        order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+    return best, np.take_along_axis(scores, best, axis=1)
+
+
+def target_set_key(X, y):
+    '''
+    Fingerprint of the contents of a target set, to tell whether an index
+    built on it is still valid, even if the arrays were modified in place.
+    '''
+    h = hashlib.sha1()
+    for a in (X, y):
+        a = np.ascontiguousarray(a)
+        h.update(str((a.shape, a.dtype.str)).encode())
+        h.update(a.data)
+    return h.hexdigest()
+
+
+class LabelledNeuronIndex(object):
+    '''
+    Lookups on the labelled neurons of a SOM, i.e. the ones that had at least
+    one example mapped to them by SOM.memorize_examples_by_class.
+
+    'labels' holds the label of the first example mapped to each neuron (-1
+    for unlabelled neurons): neurons on which examples of several classes
+    superpose only predict the first class, as the per-example predictions
+    of HebbianModel always did. Row i of 'neighbours' lists the labelled
+    neurons sorted by grid distance from neuron i, lowest index first among
+    equally distant ones. Only the first max_neighbours of them are kept, if
+    given.
+    '''
+
+    def __init__(self, som, max_neighbours=None, chunk_size=256):
+        self.bmu_class_dict = som.bmu_class_dict
+        self.labels = np.array([c[0] if c != [] else -1
+                                for _, c in sorted(som.bmu_class_dict.items())])
+        self.labelled = self.labels != -1
+        labelled_indexes = np.nonzero(self.labelled)[0]
+        if max_neighbours is None:
+            max_neighbours = len(labelled_indexes)
+        self.max_neighbours = min(max_neighbours, len(labelled_indexes))
+
+        locations = np.array(list(som._neuron_locations(som._m, som._n)), dtype=float)
+        labelled_locations = locations[labelled_indexes]
+        self.neighbours = np.empty((len(locations), self.max_neighbours), dtype=int)
+        for start in range(0, len(locations), chunk_size):
+            end = start + chunk_size
+            distances = np.linalg.norm(locations[start:end, np.newaxis, :]
+                                       - labelled_locations[np.newaxis, :, :], axis=2)
+            order = np.argsort(distances, axis=1, kind='stable')[:, :self.max_neighbours]
+            self.neighbours[start:end] = labelled_indexes[order]
+
+    def sorted_predict(self, activations):
+        '''
+        Label of the most activated labelled neuron, for each row of activations.
+        '''
+        masked = np.where(self.labelled, np.atleast_2d(activations), -np.inf)
+        return self.labels[np.argmax(masked, axis=1)]
+
+    def closest(self, bmus, k):
+        '''
+        The k+1 labelled neurons closest to each of the given BMUs, as an array
+        of shape [len(bmus), k+1] (or [k+1] for a single BMU).
+        '''
+        assert k + 1 <= self.max_neighbours or self.max_neighbours == np.sum(self.labelled), \
+               'Index built for {} neighbours, {} requested'.format(self.max_neighbours, k + 1)
+        return self.neighbours[bmus, :k+1]
+
+    def knn_predict(self, activations, k, weighted=False):
+        '''
+        Majority vote among the k+1 labelled neurons closest to the most
+        activated neuron, for each row of activations. If weighted is True,
+        each vote counts as much as the activation of the voting neuron.
+        '''
+        activations = np.atleast_2d(activations)
+        closest = self.closest(np.argmax(activations, axis=1), k)
+        rows = np.repeat(np.arange(len(activations)), closest.shape[1])
+        if weighted:
+            votes = activations[rows, closest.ravel()]
+        else:
+            votes = np.ones(rows.shape)
+        class_count = np.zeros((len(activations), np.max(self.labels) + 1))
+        np.add.at(class_count, (rows, self.labels[closest.ravel()]), votes)
+        return np.argmax(class_count, axis=1)
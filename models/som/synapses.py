@@ -0,0 +1,314 @@
+'''
+Kernels for the Hebbian synapses connecting two SOMs.
+
+The synapse between neuron i of the first SOM and neuron j of the second one
+grows by 1 - exp(-learning_rate * a_i * b_j) every time the pair of
+activations (a, b) is presented. SOM activations are thresholded, so each
+update only touches the active x active block of the outer product a b^T:
+the functions below only visit that block, for many pairs at once.
+'''
+import os
+import numpy as np
+import scipy.sparse
+
+# upper bound on the number of synapses updated by a single chunk of pairs
+MAX_CHUNK_ENTRIES = 2 ** 22
+
+
+def outer_product_entries(activations_a, activations_b, max_entries=MAX_CHUNK_ENTRIES):
+    '''
+    Yields the non-zero entries of the outer products a_p b_p^T, for each pair p
+    of rows of activations_a and activations_b, as four arrays
+    (pair, row, column, product). Pairs are grouped in chunks of at most
+    max_entries entries (a single pair may exceed it).
+    '''
+    activations_a = np.atleast_2d(activations_a)
+    activations_b = np.atleast_2d(activations_b)
+    assert len(activations_a) == len(activations_b), \
+           'Got {} activations for the first SOM and {} for the second' \
+           .format(len(activations_a), len(activations_b))
+    n_pairs = len(activations_a)
+    pair_a, index_a = np.nonzero(activations_a)
+    pair_b, index_b = np.nonzero(activations_b)
+    values_a = activations_a[pair_a, index_a]
+    values_b = activations_b[pair_b, index_b]
+    # np.nonzero is row-major, so the entries of each pair are contiguous
+    count_a = np.bincount(pair_a, minlength=n_pairs)
+    count_b = np.bincount(pair_b, minlength=n_pairs)
+    offset_a = np.concatenate(([0], np.cumsum(count_a)))
+    offset_b = np.concatenate(([0], np.cumsum(count_b)))
+    sizes = count_a * count_b
+    cumulative = np.concatenate(([0], np.cumsum(sizes)))
+
+    start = 0
+    while start < n_pairs:
+        stop = np.searchsorted(cumulative, cumulative[start] + max_entries, side='right') - 1
+        stop = max(stop, start + 1)
+        total = cumulative[stop] - cumulative[start]
+        if total > 0:
+            pair = np.repeat(np.arange(start, stop), sizes[start:stop])
+            local = np.arange(total) - (cumulative[pair] - cumulative[start])
+            i = offset_a[pair] + local // count_b[pair]
+            j = offset_b[pair] + local % count_b[pair]
+            yield pair, index_a[i], index_b[j], values_a[i] * values_b[j]
+        start = stop
+
+
+def accumulate_entries(flat_out, flat_index, values):
+    '''
+    Adds values to flat_out at flat_index, summing repeated indexes. Only the
+    touched entries are visited, so the temporaries are as large as the chunk,
+    not as the matrix.
+    '''
+    touched, position = np.unique(flat_index, return_inverse=True)
+    flat_out[touched] += np.bincount(position.ravel(), weights=values).astype(flat_out.dtype)
+
+
+def hebbian_delta(activations_a, activations_b, learning_rate, out=None, groups=None,
+                  dtype=np.float64):
+    '''
+    Accumulates sum_p 1 - exp(-learning_rate * a_p b_p^T) over the pairs of rows
+    of activations_a and activations_b into out, which is created zero-filled
+    with the given dtype when not given, and returns it. out is kept in its own
+    dtype, so float32 halves the memory of large matrices; the updates of
+    each chunk are summed in float64 before being added to it.
+
+    If groups is given, pair p is accumulated into out[groups[p]] instead, so
+    that out holds one matrix per group, e.g. per Monte Carlo trial.
+    '''
+    n_a = np.shape(activations_a)[-1]
+    n_b = np.shape(activations_b)[-1]
+    if out is None:
+        if groups is None:
+            out = np.zeros((n_a, n_b), dtype=dtype)
+        else:
+            out = np.zeros((np.max(groups) + 1, n_a, n_b), dtype=dtype)
+    if groups is not None:
+        groups = np.asarray(groups)
+    flat_out = out.reshape(-1)
+    assert np.shares_memory(flat_out, out), 'out must be a contiguous array'
+    for pair, rows, cols, products in outer_product_entries(activations_a, activations_b):
+        flat_index = rows * n_b + cols
+        if groups is not None:
+            flat_index += groups[pair] * (n_a * n_b)
+        # 1 - exp(-x), accurate for small x
+        delta = -np.expm1(-learning_rate * products)
+        accumulate_entries(flat_out, flat_index, delta)
+    return out
+
+
+def hebbian_delta_sweep(activations_a, activations_b, learning_rates, out=None):
+    '''
+    Same as hebbian_delta for several learning rates at once: out[l] receives
+    the updates with learning_rates[l]. The update only depends on the learning
+    rate elementwise, so the outer products are computed once for all of them.
+    '''
+    n_a = np.shape(activations_a)[-1]
+    n_b = np.shape(activations_b)[-1]
+    learning_rates = np.atleast_1d(learning_rates)
+    if out is None:
+        out = np.zeros((len(learning_rates), n_a, n_b))
+    assert len(out) == len(learning_rates), \
+           'Got {} matrices for {} learning rates'.format(len(out), len(learning_rates))
+    flat_out = out.reshape(len(out), -1)
+    assert np.shares_memory(flat_out, out), 'out must be a contiguous array'
+    for _, rows, cols, products in outer_product_entries(activations_a, activations_b):
+        flat_index = rows * n_b + cols
+        for l, learning_rate in enumerate(learning_rates):
+            delta = -np.expm1(-learning_rate * products)
+            accumulate_entries(flat_out[l], flat_index, delta)
+    return out
+
+
+def normalize_synapses(weights):
+    '''
+    Scales weights in place so that they sum to one (per matrix, if weights
+    is a stack of matrices) and returns them.
+    '''
+    weights /= np.sum(weights, axis=(-2, -1), keepdims=True)
+    return weights
+
+
+class SparseSynapses(object):
+    '''
+    Synapse matrix stored as a constant baseline plus a sparse matrix of the
+    learned increments, so that memory scales with the learned associations
+    rather than with the square of the number of neurons. The baseline stands
+    for the initial weights, which the dense models draw around the same mean.
+
+    Updates are appended as COO triplets and merged into the CSR matrix every
+    compact_every entries. The products W @ x and x @ W, the transpose W.T,
+    indexing a row with W[i] and toarray() behave as for a dense array. The
+    transposed CSR matrix is cached until the synapses change, so repeated
+    queries through W.T do not convert it again.
+    '''
+
+    # let ndarray @ SparseSynapses fall back on __rmatmul__
+    __array_ufunc__ = None
+
+    def __init__(self, shape, baseline=0.0, compact_every=MAX_CHUNK_ENTRIES, matrix=None):
+        self.shape = tuple(shape)
+        self.baseline = float(baseline)
+        self.compact_every = compact_every
+        if matrix is None:
+            matrix = scipy.sparse.csr_matrix(self.shape)
+        self.matrix = matrix
+        self._transposed = None
+        self._pending = []
+        self._n_pending = 0
+
+    def update(self, activations_a, activations_b, learning_rate):
+        '''
+        Adds 1 - exp(-learning_rate * a_p b_p^T) for every pair of rows of
+        activations_a and activations_b, as hebbian_delta does.
+        '''
+        for _, rows, cols, products in outer_product_entries(activations_a, activations_b):
+            self._pending.append((rows, cols, -np.expm1(-learning_rate * products)))
+            self._n_pending += len(rows)
+            if self._n_pending >= self.compact_every:
+                self.compact()
+        return self
+
+    def compact(self):
+        '''
+        Merges the pending updates into the CSR matrix, summing duplicates.
+        '''
+        if self._pending:
+            rows, cols, values = [np.concatenate(a) for a in zip(*self._pending)]
+            self.matrix = (self.matrix + scipy.sparse.coo_matrix((values, (rows, cols)),
+                                                                 shape=self.shape)).tocsr()
+            self._pending = []
+            self._n_pending = 0
+            self._transposed = None
+        return self
+
+    @property
+    def nnz(self):
+        return self.compact().matrix.nnz
+
+    def sum(self):
+        return self.compact().matrix.sum() + self.baseline * self.shape[0] * self.shape[1]
+
+    def scale(self, factor):
+        '''
+        Multiplies the synapses in place by factor.
+        '''
+        self.compact()
+        # a new matrix, since transposes handed out may share the old one
+        self.matrix = self.matrix * factor
+        self.baseline *= factor
+        self._transposed = None
+        return self
+
+    def normalize(self):
+        '''
+        Scales the synapses in place so that they sum to one.
+        '''
+        return self.scale(1 / self.sum())
+
+    @property
+    def T(self):
+        self.compact()
+        if self._transposed is None:
+            self._transposed = self.matrix.T.tocsr()
+        return SparseSynapses(self.shape[::-1], self.baseline, self.compact_every,
+                              self._transposed)
+
+    def __matmul__(self, other):
+        other = np.asarray(other)
+        self.compact()
+        return np.asarray(self.matrix @ other) + self.baseline * np.sum(other, axis=0, keepdims=True)
+
+    def __rmatmul__(self, other):
+        other = np.asarray(other)
+        self.compact()
+        return np.asarray(self.matrix.T @ other.T).T + self.baseline * np.sum(other, axis=-1, keepdims=True)
+
+    def __getitem__(self, i):
+        self.compact()
+        return self.matrix.getrow(i).toarray().ravel() + self.baseline
+
+    def toarray(self):
+        return self.compact().matrix.toarray() + self.baseline
+
+    def save(self, path):
+        '''
+        Saves the synapses in a single .npz file, at synapses_path(path, True).
+        Returns the path written.
+        '''
+        self.compact()
+        path = synapses_path(path, archive=True)
+        np.savez(path, data=self.matrix.data, indices=self.matrix.indices,
+                 indptr=self.matrix.indptr, shape=np.array(self.shape),
+                 baseline=np.array(self.baseline))
+        return path
+
+    @staticmethod
+    def load(path):
+        with np.load(find_synapses(path)) as f:
+            shape = tuple(f['shape'])
+            matrix = scipy.sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=shape)
+            return SparseSynapses(shape, float(f['baseline']), matrix=matrix)
+
+
+def synapses_path(path, archive=False):
+    '''
+    Path of the file holding synapses saved at path: .npz archives (compressed
+    or sparse synapses) always end in .npz, which replaces a .npy extension
+    (sinapses.npy -> sinapses.npz) and is appended to any other.
+    '''
+    root, extension = os.path.splitext(path)
+    if not archive or extension == '.npz':
+        return path
+    return (root if extension == '.npy' else path) + '.npz'
+
+
+def find_synapses(path):
+    '''
+    Path of the existing file holding synapses saved at path, whether they
+    were saved as an archive or not, or None if there is none.
+    '''
+    for candidate in [path, synapses_path(path, archive=True)]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def save_synapses(path, weights, compressed=False):
+    '''
+    Saves a synapse matrix in binary form: a .npy file, which can be
+    memory-mapped by load_synapses, or a .npz archive (compressed if
+    compressed is True). Shape and dtype are stored in the file headers.
+    SparseSynapses are always saved as .npz archives. Archives are written
+    at synapses_path(path, True), which load_synapses finds from the same
+    path. Returns the path written.
+    '''
+    if isinstance(weights, SparseSynapses):
+        return weights.save(path)
+    archive = compressed or os.path.splitext(path)[1] == '.npz'
+    path = synapses_path(path, archive)
+    if compressed:
+        np.savez_compressed(path, weights=weights)
+    elif archive:
+        np.savez(path, weights=weights)
+    else:
+        np.save(path, weights)
+    return path
+
+
+def load_synapses(path, mmap=False):
+    '''
+    Loads a synapse matrix saved by save_synapses at path, either dense or
+    sparse. If mmap is True, dense .npy matrices are memory-mapped read-only
+    instead of being read in memory.
+    '''
+    found = find_synapses(path)
+    if found is None:
+        raise IOError('No synapses saved at ' + path)
+    path = found
+    if os.path.splitext(path)[1] != '.npz':
+        return np.load(path, mmap_mode='r' if mmap else None)
+    with np.load(path) as f:
+        if 'indptr' not in f:
+            return f['weights']
+    return SparseSynapses.load(path)
@@ -0,0 +1,84 @@
+'''
+Benchmark of the Hebbian synapse kernels in models.som.synapses against the
+row-by-row loops previously used by wordLearningTest.updatesynapses and
+updatesynapsesPreLoad. Run with
+
+    python -m models.som.synapses_benchmark --pairs 10 --repeat 5
+'''
+import argparse
+import time
+import numpy as np
+from models.som.synapses import hebbian_delta, normalize_synapses
+
+lambdaP = 5.0
+
+
+def loop_update(S, activations_u, activations_v):
+    # the update of updatesynapsesPreLoad, one row of S at a time
+    for u, v in zip(activations_u, activations_v):
+        a = np.asarray(v, dtype=np.float32)
+        for i in range(len(u)):
+            S[i] = S[i] + np.ones(len(v)) - np.exp(- lambdaP * u[i] * a)
+    return S
+
+
+def loop_normalize(S):
+    # the normalization of updatesynapses, one entry at a time
+    tot = np.sum(np.sum(S))
+    for i in range(len(S)):
+        for j in range(len(S[i])):
+            S[i][j] = S[i][j] / tot
+    return S
+
+
+def random_activations(n_pairs, n_neurons, random_state):
+    # activations scaled to 0..10 and thresholded at 6, as in wordLearningTest
+    activations = random_state.rand(n_pairs, n_neurons) ** 4
+    activations = 10 * activations / np.amax(activations, axis=1, keepdims=True)
+    activations[activations < 6.0] = 0.0
+    return activations
+
+
+def best_time(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Hebbian synapse kernels.')
+    parser.add_argument('--neurons', metavar='neurons', type=int, default=600,
+                        help='Number of neurons of each SOM')
+    parser.add_argument('--pairs', metavar='pairs', type=int, default=10,
+                        help='Number of pairs of activations per update')
+    parser.add_argument('--repeat', metavar='repeat', type=int, default=5,
+                        help='Number of timed runs; the best one is reported')
+    parser.add_argument('--seed', metavar='seed', type=int, default=42,
+                        help='Random generator seed')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(args.seed)
+    activations_u = random_activations(args.pairs, args.neurons, random_state)
+    activations_v = random_activations(args.pairs, args.neurons, random_state)
+    S0 = random_state.normal(1 / args.neurons, 1 / (1000 * args.neurons),
+                             (args.neurons, args.neurons))
+
+    expected = loop_update(S0.copy(), activations_u, activations_v)
+    for dtype in [np.float64, np.float32]:
+        S = hebbian_delta(activations_u, activations_v, lambdaP, out=S0.astype(dtype))
+        print('{}: max abs difference from the loop: {}'
+              .format(np.dtype(dtype).name, np.amax(np.abs(S - expected))))
+
+    timings = [('update, loop', lambda: loop_update(S0.copy(), activations_u, activations_v)),
+               ('update, kernel float64',
+                lambda: hebbian_delta(activations_u, activations_v, lambdaP, out=S0.copy())),
+               ('update, kernel float32',
+                lambda: hebbian_delta(activations_u, activations_v, lambdaP,
+                                      out=S0.astype(np.float32))),
+               ('normalization, loop', lambda: loop_normalize(S0.copy())),
+               ('normalization, in place', lambda: normalize_synapses(S0.copy()))]
+    for name, f in timings:
+        print('{}: {:.4f}s'.format(name, best_time(f, args.repeat)))
@@ -21,11 +21,18 @@ import matplotlib
 import numpy as np
 from colour import Color
 from .SOM import SOM
+from .synapses import SparseSynapses, hebbian_delta, normalize_synapses
+from .synapses import save_synapses, load_synapses, find_synapses
+from .metrics import class_distances
 import os
 import math
 import random
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 from numpy.linalg import norm
 from utils.constants import Constants
+from utils.utils import infer_label_10classes
 
 
 dimN = 20
@@ -78,26 +85,46 @@ def getRandomInputClass(className,fileInput):
     f.close()
     return inputC
 
-def getAllInputClass(className,fileInput):
+def getLabelsDict():
     """
-        Return all the input of the class className
+        Map the names of the classes to their labels, 1000 to 1009 for the
+        10 classes
     """
+    with open(os.path.join(Constants.DATA_FOLDER, 'imagenet-labels.json')) as f:
+        labelsDict = json.load(f)
+    return {v: k for k, v in labelsDict.items()}
+
+def getAllInputClass(className,fileInput,labelsDict=None):
+    """
+        Return all the input of the class className (0 to 9); the class of
+        a row is given by the folder of the image path in its first column,
+        as in utils.infer_label_10classes
+    """
+    if labelsDict is None:
+        labelsDict = getLabelsDict()
     f = open(fileInput,'r')
     inputC = []
     for l in f:
-        lSplit = l.split(',')
-        if str(className) in lSplit[0]:
-            inputC.append(np.array(lSplit[1:]).astype(float))
+        if len(l) > 2:
+            lSplit = l.split(',')
+            if int(infer_label_10classes(lSplit[0], labelsDict)) - 1000 == className:
+                inputC.append(np.array(lSplit[1:]).astype(float))
     f.close()
     return inputC
 
 def getAllInputClassAudio(className, file_path):
+    """
+        Return the (last) input of the class className (0 to 9), whose
+        label in the last column is 1000 plus the class
+    """
     f = open(file_path,'r')
     inputC = None
     for l in f:
-        lSplit = l.split(',')
-        if str(className) in lSplit[-1]:
-            inputC = np.array(lSplit[1:-1]).astype(float)
+        if len(l) > 2:
+            lSplit = l.split(',')
+            if int(lSplit[-1]) - 1000 == className:
+                inputC = np.array(lSplit[1:-1]).astype(float)
+    f.close()
     return inputC
 
 def showSomActivations(activations,posActivations,count,title):
@@ -230,185 +257,133 @@ def classPrototype(inputs,nameInputs):
   #printToFileCSV(protClass,'./prototipiVisivi.csv')
   return protClass
 
-def updatesynapses(S,classes,SOMU,SOMV,INPUTV,INPUTU,ite,maxIter):
+def scaleActivations(activations, top=10.0, threshold=6.0):
+    """
+        scale the activations in place to the range 0..top and suppress
+        the values lower than threshold (along the last axis, so that many
+        activations can be scaled at once)
+    """
+    maxA = np.amax(activations, axis=-1, keepdims=True)
+    minA = np.amin(activations, axis=-1, keepdims=True)
+    activations -= minA
+    activations *= top / (maxA - minA)
+    activations[activations < threshold] = 0.0
+    return activations
+
+def initsynapses(dtype=np.float64):
+    """
+        random initialization of the synapses between the two soms
+    """
+    m = 1/math.sqrt(dimN*dimM*dimN*dimM)
+    sd = 1/(1000*math.sqrt(dimN*dimM*dimN*dimM))
+    return np.random.normal(m,sd,(dimN*dimM,dimN*dimM)).astype(dtype)
+
+def updatesynapses(S,classes,SOMU,SOMV,INPUTV,INPUTU,ite,maxIter,dtype=np.float64):
     """
         update all the synpases between the SOMU (auditory) and the SOMV (visual)
         based on the activation produced by the inputs INPUTV (visual) and INPUTU (auditory)
+        new synapses are kept in the given dtype (float32 halves their memory)
     """
     print('updating synapses')
     # initializations of the synapses
     # S: matrix of size numberOfAuditoryNeurons X numberOfVisualNeurons
 
-    if S == None:
-        m = 1/math.sqrt(dimN*dimM*dimN*dimM)
-        sd = 1/(1000*math.sqrt(dimN*dimM*dimN*dimM))
-        S = np.random.normal(m,sd,(dimN*dimM,dimN*dimM))
-
-    ATTIVAZIONIV = dict()
-    ATTIVAZIONIU = dict()
-    posAttivazioniU = dict()
-    posAttivazioniV = dict()
+    if S is None:
+        S = initsynapses(dtype)
 
     lambdaP = 5.0
 
-    #normalization of the values
-
-    a = 0.0
-    b = 10.0
-
-    count = 0
-
-    for c in classes:
-        print('updating for class '+str(c))
+    print('generating activations')
+    ATTIVAZIONIV = np.array([SOMV.get_activations(INPUTV[c])[0] for c in classes])
+    ATTIVAZIONIU = np.array([SOMU.get_activations(INPUTU[c])[0] for c in classes])
 
-        print('generating visual activation')
-        [ATTIVAZIONIV[c],posAttivazioniV[c]] = SOMV.get_activations(INPUTV[c])
+    print('suppresion low values')
+    scaleActivations(ATTIVAZIONIV)
+    scaleActivations(ATTIVAZIONIU)
 
-
-        print('suppresion low values')
-        maxA = np.amax(np.amax(ATTIVAZIONIV[c]))
-        minA = np.amin(np.amin(ATTIVAZIONIV[c]))
-
-        for i in range(len(ATTIVAZIONIV[c])):
-            #print(type(ATTIVAZIONIV[c][i]))
-            #float(10.0 * (ATTIVAZIONIV[c][i]-minA))
-            #float(maxA-minA)
-            ATTIVAZIONIV[c][i] = (float(10.0 * (ATTIVAZIONIV[c][i]-minA))/float(maxA-minA))
-
-            #soppressione valori bassi
-            #print(type(ATTIVAZIONIV[c][i]))
-
-            if ATTIVAZIONIV[c][i] < 6.0:
-                ATTIVAZIONIV[c][i] = 0.0
-
-        #showSomActivations(ATTIVAZIONIV[c],posAttivazioniV[c],count,'visive per classe'+c)
-
-        count += 1
-        #uditiva
-        print('generating auditory activation')
-        [ATTIVAZIONIU[c],posAttivazioniU[c]] = SOMU.get_activations(INPUTU[c])
-
-        print('suppresion low values')
-        maxA = np.amax(np.amax(ATTIVAZIONIU[c]))
-        minA = np.amin(np.amin(ATTIVAZIONIU[c]))
-        for i in range(len(ATTIVAZIONIU[c])):
-            ATTIVAZIONIU[c][i] = (float(10.0 * (ATTIVAZIONIU[c][i]-minA))/float(maxA-minA))
-            #soppressione valori bassi
-            if ATTIVAZIONIU[c][i] < 6.0:
-                ATTIVAZIONIU[c][i] = 0.0
-        #showSomActivations(ATTIVAZIONIU[c],posAttivazioniU[c],count,'uditive per classe'+c)
-
-        count += 1
-
-        print('updating synapses')
-        for i in range(len(ATTIVAZIONIU[c])):
-            #for j in range(len(ATTIVAZIONIV[c])):
-            #    S[i][j] = S[i][j] + 1 - math.exp(-lambdaP * ATTIVAZIONIU[c][i]*ATTIVAZIONIV[c][j])
-            a = np.asarray(ATTIVAZIONIV[c], dtype=np.float32)
-            S[i] = S[i] + np.ones(dimN*dimM) - np.exp(- lambdaP * ATTIVAZIONIU[c][i]*a)
-
-
-        count = count + 3
+    print('updating synapses')
+    hebbian_delta(ATTIVAZIONIU, ATTIVAZIONIV, lambdaP, out=S)
 
     print('maxS ---->>> '+str(np.amax(np.amax(S))))
     print('minS ---->>> '+str(np.amin(np.amin(S))))
 
     if (ite == (maxIter-1)):
-        tot = np.sum(np.sum(S))
         print('normalization')
-        for i in range(len(S)):
-            for j in range(len(S[i])):
-                S[i][j] = S[i][j]/tot
+        normalize_synapses(S)
 
     print('maxS ---->>> '+str(np.amax(np.amax(S))))
     print('minS ---->>> '+str(np.amin(np.amin(S))))
-    plt.show()
     return S
 
 
-def updatesynapsesPreLoad(S,classes,SOMU,SOMV,INPUTV,INPUTU,ite,maxIter):
+def updatesynapsesPreLoad(S,classes,SOMU,SOMV,INPUTV,INPUTU,ite,maxIter,dtype=np.float64):
     """
         update all the synpases between the SOMU (auditory) and the SOMV (visual)
         based on the activation produced by the inputs INPUTV (visual) and INPUTU (auditory)
         The activations are already calculated
+        the updates are added to S in place, but the normalized synapses are
+        a new matrix, so the caller's S is never normalized
+        S can also be a SparseSynapses matrix, which is updated in place
+        new synapses are kept in the given dtype (float32 halves their memory)
     """
     print('updating synapses')
     # initializations of the synapses
     # S: matrix of size numberOfAuditoryNeurons X numberOfVisualNeurons
 
-    if np.all(S == 0):
-        m = 1/math.sqrt(dimN*dimM*dimN*dimM)
-        sd = 1/(1000*math.sqrt(dimN*dimM*dimN*dimM))
-        S = np.random.normal(m,sd,(dimN*dimM,dimN*dimM))
+    if not isinstance(S, SparseSynapses) and np.all(S == 0):
+        S = initsynapses(dtype)
 
     lambdaP = 5.0
 
-    # normalization
-
-    a = 0.0
-    b = 10.0
-
-    count = 0
-
-    for c in classes:
-
-        # updating synapses
-        for i in range(len(INPUTU[c])):
-            #for j in range(len(INPUTV[c])):
-            #    S[i][j] = S[i][j] + 1 - math.exp(-lambdaP * ATTIVAZIONIU[c][i]*INPUTV[c][j])
-            a = np.asarray(INPUTV[c], dtype=np.float32)
-            S[i] = S[i] + np.ones(dimN*dimM) - np.exp(- lambdaP * INPUTU[c][i]*a)
+    activationsU = np.array([INPUTU[c] for c in classes])
+    activationsV = np.array([INPUTV[c] for c in classes])
 
+    if isinstance(S, SparseSynapses):
+        # only the synapses between active neurons are stored and updated
+        S.update(activationsU, activationsV, lambdaP)
+        if ite == maxIter:
+            S.normalize()
+        return S
 
-    #print('maxS ---->>> '+str(np.amax(np.amax(S))))
-    #print('minS ---->>> '+str(np.amin(np.amin(S))))
+    # updating synapses for all the classes at once
+    hebbian_delta(activationsU, activationsV, lambdaP, out=S)
 
-    tot = np.sum(np.sum(S))
-    #print('normalization')
     if ite == maxIter:
-        S = S/tot
-
-    #print('maxS ---->>> '+str(np.amax(np.amax(S))))
-    #print('minS ---->>> '+str(np.amin(np.amin(S))))
+        S = S / np.sum(S)
 
     return S
 
-def savesynapses(S,outputFile):
+def savesynapses(S,outputFile='./sinapses.npy',compressed=False):
     """
-        save the synapses on the outputFile
+        save the synapses on the outputFile, as a .npy file (or a .npz
+        archive, compressed if compressed is True, whose extension replaces
+        .npy); restoresynapses finds them from the same outputFile
+        returns the path of the file written
     """
-    output = open(outputFile,'w')
-
-    for i in range(len(S)):
-        for j in range(len(S[i])):
-            output.write(str(S[i][j])+',')
-        output.write(';\n')
-
-    output.close()
+    return save_synapses(outputFile, S, compressed=compressed)
 
-def restoresynapses():
+def restoresynapses(synapsesFile='./sinapses.npy',mmap=False):
     """
-        restore the synapses from a specific file
+        restore the synapses from a specific file; None if it does not exist
+        if mmap is True, a .npy file is memory-mapped read-only
     """
-    outputFile = './sinapses.csv'
-    try:
-        output = open(outputFile,'r')
-    except:
+    if find_synapses(synapsesFile) is None:
         return None
+    return load_synapses(synapsesFile, mmap=mmap)
 
-    m = 1/math.sqrt(dimN*dimM*dimN*dimM)
-    sd = 1/(1000*math.sqrt(dimN*dimM*dimN*dimM))
-    S = np.random.normal(m,sd,(dimN*dimM,dimN*dimM))
-    i = 0
-    for l in output:
-        j = 0
-        lSplit = l.split(',')
-        for v in lSplit:
-            if (len(v)>0) and (not ';' in v):
-                S[i][j] = float(v)
-            j = j+1
-        i = i+1
-
+def convertLegacySynapses(csvFile='./sinapses.csv',outputFile='./sinapses.npy',compressed=False):
+    """
+        convert the synapses saved as csv by the former savesynapses to the
+        binary format read by restoresynapses
+        entries missing from the csv are randomly initialized, as the former
+        restoresynapses did
+    """
+    S = initsynapses()
+    with open(csvFile,'r') as f:
+        for i, l in enumerate(f):
+            row = [v for v in l.split(',') if len(v)>0 and not ';' in v]
+            S[i,:len(row)] = np.array(row, dtype=float)
+    savesynapses(S,outputFile,compressed=compressed)
     return S
 
 def propagateActivations(UV,bmu1,S):
@@ -455,7 +430,8 @@ def propagateActivationsAll(UV,act2,S):
     #act = sum(S[:][:] * act2)
     #print(len(t))
 
-    act = np.dot(act2,S)
+    # works for both dense and SparseSynapses matrices
+    act = act2 @ S
 
     # for i in range(dimM*dimN):
     #      t = sum(S[i][:] * act2)
@@ -524,51 +500,18 @@ def distanceIntraClass(SOM, inputs, nameInputs):
     """
     print('- extraction bmus -')
     mapped = SOM.map_vects(inputs)
+    positions = np.array([[m[1],m[0]] for m in mapped])
 
-    positions = dict()
-    for i, m in enumerate(mapped):
-        if nameInputs[i] in positions:
-            positions[nameInputs[i]].append([m[1],m[0]])
-        else:
-            positions[nameInputs[i]] = [[m[1],m[0]]]
-
+    distancesIntra, distancesExtra = class_distances(positions, nameInputs)
 
-    distancesIntra = dict()
     print('- intra-cluster distance - ')
-    posKey = positions.keys()
-    posKey.sort()
-    for c in posKey:
-        d = 0
-        count = 0
-        for i in positions[c]:
-            i1 = positions[c].index(i)
-            for j in positions[c][i1+1:]:
-                d += math.sqrt(( (j[0]-i[0])**2 ) + ((j[1]-i[1])**2 ))
-                count += 1
+    for c in distancesIntra.keys():
+        print('--- '+str(c)+' -> '+str(distancesIntra[c]))
 
-        distancesIntra[c] = d / count
-
-        print('--- '+c+' -> '+str(distancesIntra[c]))
-
-
-    allPositions = []
     print('- inter-cluster distance :')
-    for c in posKey:
-        for p in positions[c]:
-            allPositions.append(p)
-    d = 0
-    count = 0
-    for i in allPositions:
-        i1 = allPositions.index(i)
-        for j in allPositions[i1+1:]:
-            d += math.sqrt(( (j[0]-i[0])**2 ) + ((j[1]-i[1])**2 ))
-            count += 1
-
-    distancesExtra = d / count
-
 
     print('- ratio between the intra and inter cluster distances')
-    for c in posKey:
+    for c in distancesIntra.keys():
         print(str(c) + ';' + str(distancesIntra[c]/distancesExtra))
 
 
@@ -596,38 +539,67 @@ def getBMUUPositions(som_path):
 
     return out
 
-def getActivationsOnce(SOMV,SOMU,inputsV,inputsU):
+def getClassActivations(som,inputs,classes,maxSamples=NxClass):
     """
-        calculate the activations on the two soms starting from two sets of inputs
+        activations of som for the inputs of each class, scaled and
+        thresholded as in updatesynapses, as a (classes, samples, neurons) array
+        a single input vector for a class counts as one sample
+        every class keeps its first samples, as many as the smallest class
+        has and at most maxSamples (the former code drew among the first
+        NxClass samples of each class)
     """
+    for c in classes:
+        if inputs[c] is None or len(inputs[c]) == 0:
+            raise ValueError('Found no input for class '+str(c))
+    inputs = [np.atleast_2d(np.asarray(inputs[c], dtype=float)) for c in classes]
+    nSamples = [len(x) for x in inputs]
+    n = min(nSamples) if maxSamples is None else min(min(nSamples), maxSamples)
+    if max(nSamples) > n:
+        print('using '+str(n)+' samples per class out of '+str(nSamples))
+    activations = som.get_activations_batch(np.concatenate([x[:n] for x in inputs]))
+    scaleActivations(activations)
+    return activations.reshape(len(classes), n, -1)
+
+def activationsCacheKey(SOMV,SOMU,inputsV,inputsU,classes):
+    """
+        hash of the weights and parameters of the two soms and of the inputs
+    """
+    h = hashlib.sha1()
+    for som, inputs in [(SOMV, inputsV), (SOMU, inputsU)]:
+        h.update(np.ascontiguousarray(som._weightages, dtype=float).tobytes())
+        h.update(str((som.tau, som.threshold)).encode())
+        for c in classes:
+            h.update(np.ascontiguousarray(inputs[c], dtype=float).tobytes())
+    # getClassActivations keeps at most NxClass samples per class
+    h.update(str(NxClass).encode())
+    return h.hexdigest()
+
+def getActivationsOnce(SOMV,SOMU,inputsV,inputsU,cacheDir=None):
+    """
+        calculate the activations on the two soms starting from two sets of inputs
+        returns a dict with the (classes, samples, neurons) arrays of the
+        auditory ('U') and visual ('V') activations, classes in sorted order
+        if cacheDir is given, the activations are stored there, keyed by the
+        som checkpoints and the inputs, and reused by later calls
+    """
+    classes = sorted(inputsV.keys())
+    cacheFile = None
+    if cacheDir is not None:
+        key = activationsCacheKey(SOMV,SOMU,inputsV,inputsU,classes)
+        cacheFile = os.path.join(cacheDir, 'activations_'+key+'.npz')
+        if os.path.exists(cacheFile):
+            print('activations restored from '+cacheFile)
+            with np.load(cacheFile) as f:
+                return {'U': f['U'], 'V': f['V']}
+
     activations = dict()
-    activations['U'] = dict()
-    activations['V'] = dict()
-    for c in inputsU.keys():
-        j = 0
-        activations['U'][c] = dict()
-        for u in inputsU[c]:
-            activations['U'][c][j] = SOMU.get_activations(u)
-            maxA = np.amax(np.amax(activations['U'][c][j][0]))
-            minA = np.amin(np.amin(activations['U'][c][j][0]))
-            for i in range(len(activations['U'][c][j][0])):
-                activations['U'][c][j][0][i] = (float(10.0 * (activations['U'][c][j][0][i]-minA))/float(maxA-minA))
-                if activations['U'][c][j][0][i] < 6.0:
-                    activations['U'][c][j][0][i] = 0.0
-            j += 1
-    for c in inputsV.keys():
-        j = 0
-        activations['V'][c] = dict()
-        for v in inputsV[c]:
-            activations['V'][c][j] = SOMV.get_activations(v)
-            maxA = np.amax(np.amax(activations['V'][c][j][0]))
-            minA = np.amin(np.amin(activations['V'][c][j][0]))
-            for i in range(len(activations['V'][c][j][0])):
-                activations['V'][c][j][0][i] = (float(10.0 * (activations['V'][c][j][0][i]-minA))/float(maxA-minA))
-                if activations['V'][c][j][0][i] < 6.0:
-                    activations['V'][c][j][0][i] = 0.0
-            j += 1
+    activations['U'] = getClassActivations(SOMU,inputsU,classes)
+    activations['V'] = getClassActivations(SOMV,inputsV,classes)
 
+    if cacheFile is not None:
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        np.savez(cacheFile, U=activations['U'], V=activations['V'])
     return activations
 
 def getBMUonce(SOMV,inputsV):
@@ -645,10 +617,70 @@ def getBMUonce(SOMV,inputsV):
     return bmus
 
 
-def iterativeTraining(img_som_path, audio_som_path):
+# activations shared by the trial workers, see initTrialWorker
+trialData = dict()
+
+def initTrialWorker(actV, actU, protoClass):
+    """
+        store the activations used by runTrialBatch in the worker process,
+        so that they are sent once per worker instead of once per batch
+    """
+    trialData['V'] = actV
+    trialData['U'] = actU
+    trialData['protoClass'] = protoClass
+
+def runTrialBatch(seed, nTrials, niter, nSamplesU, sparse=False):
+    """
+        run nTrials random trials with niter couples for each class and
+        return the number of correct test propagations of each trial.
+        All the sample indices are drawn at once and the synapses of the whole
+        batch are built as a [nTrials, neuronsU, neuronsV] stack
+    """
+    actV = trialData['V']
+    actU = trialData['U']
+    nClasses, nSamplesV, nNeurons = actV.shape
+    rng = np.random.default_rng(seed)
+    iV = rng.integers(nSamplesV, size=(nTrials, niter, nClasses))
+    iU = rng.integers(nSamplesU, size=(nTrials, niter, nClasses))
+    c = np.broadcast_to(np.arange(nClasses), iV.shape)
+    pairsV = actV[c, iV].reshape(-1, nNeurons)
+    pairsU = actU[c, iU].reshape(-1, nNeurons)
+    trial = np.repeat(np.arange(nTrials), niter * nClasses)
+
+    lambdaP = 5.0
+    m = 1/math.sqrt(dimN*dimM*dimN*dimM)
+    sd = 1/(1000*math.sqrt(dimN*dimM*dimN*dimM))
+    testV = actV.reshape(-1, nNeurons)
+    testClasses = np.repeat(np.arange(nClasses), nSamplesV)
+
+    if sparse:
+        bmuU = np.empty((nTrials, len(testV)), dtype=int)
+        for t in range(nTrials):
+            S = SparseSynapses((nNeurons, nNeurons), baseline=m)
+            S.update(pairsU[trial == t], pairsV[trial == t], lambdaP)
+            S.normalize()
+            bmuU[t] = np.argmax(testV @ S.T, axis=1)
+    else:
+        S = rng.normal(m, sd, (nTrials, nNeurons, nNeurons))
+        hebbian_delta(pairsU, pairsV, lambdaP, out=S, groups=trial)
+        normalize_synapses(S)
+        # propagate all the visual test activations of all the trials at once
+        bmuU = np.argmax(np.matmul(testV, np.swapaxes(S, 1, 2)), axis=2)
+
+    # correct if: the bmu of the propagated activation falls into an area
+    # associated with the class of the input
+    return np.sum(trialData['protoClass'][bmuU] == testClasses, axis=1)
+
+def iterativeTraining(img_som_path, audio_som_path, sparse=False, nTrials=1000,
+                      trialsPerBatch=25, workers=None, seed=None, activationsCacheDir=None):
     """
         calculate the taxonomic factor increasing the number of couples
         used for the training of the hebbian connections
+        if sparse is True, the synapses are stored as SparseSynapses
+        the nTrials random trials for each number of couples are run in batches
+        of trialsPerBatch on a pool of workers processes; each batch has its
+        own seed spawned from seed, so results do not depend on workers
+        activations are cached in activationsCacheDir, if given
     """
     classes = list(range(0,10))
 
@@ -657,15 +689,21 @@ def iterativeTraining(img_som_path, audio_som_path):
 
     INPUTV = dict()
     INPUTU = dict()
-    tinputU = dict()
-    tinputV = dict()
 
+    labelsDict = getLabelsDict()
     for c in classes:
-        INPUTV[c] = getAllInputClass(c, os.path.join(Constants.DATA_FOLDER, '10classes', 'VisualInputTestSet.csv'))
+        INPUTV[c] = getAllInputClass(c, os.path.join(Constants.DATA_FOLDER, '10classes', 'VisualInputTestSet.csv'),
+                                     labelsDict)
         INPUTU[c] = getAllInputClassAudio(c, os.path.join(Constants.DATA_FOLDER, '10classes', 'audio_prototypes.csv'))
 
     print('getActivationsOnce')
-    activations = getActivationsOnce(SOMV,SOMU,INPUTV,INPUTU)
+    activations = getActivationsOnce(SOMV,SOMU,INPUTV,INPUTU,cacheDir=activationsCacheDir)
+    # [classes, samples, neurons] arrays of the activations
+    actV = activations['V']
+    actU = activations['U']
+    # the class whose first auditory activation is the highest on each neuron
+    protoClass = np.argmax(actU[:, 0, :], axis=0)
+    nSamplesU = actU.shape[1]
 
     print('getBMUonce')
     bmus = getBMUonce(SOMV,INPUTV)
@@ -674,102 +712,36 @@ def iterativeTraining(img_som_path, audio_som_path):
     # commenting this out because it does not seem to be used further in this function
     #posClassesU = getBMUUPositions()
 
-    niterRes = []
-    for ni in [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15]:
-        corrects = []
-        niter = ni
-
-        for k in range(1000):
-            #use 1000 random training set for each number of couples
-            print('iteration -> '+str(k))
-            S = np.zeros((10, 60))
-            for i in range(niter):
-                i0 = np.random.randint(100)
-                tinputV[classes[0]] = activations['V'][classes[0]][i0][0]
-                i1 = np.random.randint(100)
-                tinputV[classes[1]] = activations['V'][classes[1]][i1][0]
-                i2 = np.random.randint(100)
-                tinputV[classes[2]] = activations['V'][classes[2]][i2][0]
-                i3 = np.random.randint(100)
-                tinputV[classes[3]] = activations['V'][classes[3]][i3][0]
-                i4 = np.random.randint(100)
-                tinputV[classes[4]] = activations['V'][classes[4]][i4][0]
-                i5 = np.random.randint(100)
-                tinputV[classes[5]] = activations['V'][classes[5]][i5][0]
-                i6 = np.random.randint(100)
-                tinputV[classes[6]] = activations['V'][classes[6]][i6][0]
-                i7 = np.random.randint(100)
-                tinputV[classes[7]] = activations['V'][classes[7]][i7][0]
-                i8 = np.random.randint(100)
-                tinputV[classes[8]] = activations['V'][classes[8]][i8][0]
-                i9 = np.random.randint(100)
-                tinputV[classes[9]] = activations['V'][classes[9]][i9][0]
-                for c in classes:
-                    random_sample = np.random.randint(len(list(INPUTU)))
-                    tinputU[c] = activations['U'][c][random_sample][0]
-
-                S = updatesynapsesPreLoad(S,classes,SOMU,SOMV,tinputV,tinputU,i,niter-1)
-
-                #print(str(i0)+'--'+str(i1)+'--'+str(i2)+'--'+str(i3)+'--'+str(i4)+'--'+
-                #    str(i5)+'--'+str(i6)+'--'+str(i7)+'--'+str(i8)+'--'+str(i9)+'--')
-
-            S = np.matrix.transpose(S)
-            correct = 0
-            #given the synapses built, I evaluate the performance of the model propagating the activation
-            # of each visual input to the auditory SOM, finding the BMU and the nearer auditory prototype BMU.
-            print('test ...')
-            for cl in classes:
-                #print('test with class '+cl)
-                for j in range(100):
-                    #bmuV = bmus[cl][j]
-
-                    #bmuU = propagateActivations('V',bmuV,S)
-
-                    act2 = activations['V'][cl][j]
-                    #print(act2)
-
-                    bmuU = propagateActivationsAll('V',act2[0],S)
+    niters = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15]
+    batchSizes = [trialsPerBatch] * (nTrials // trialsPerBatch)
+    if nTrials % trialsPerBatch > 0:
+        batchSizes.append(nTrials % trialsPerBatch)
+    seeds = np.random.SeedSequence(seed).spawn(len(niters))
 
-                    # correct if: the nearer auditory prototype is associate to the input
-
-                    # r = bmuU/dimM
-                    # c = bmuU%dimM
-
-                    # dist = np.array([])
-                    # for i in range(10):
-                    #     dist = np.append(dist,math.hypot(posClassesU[i][0] - r, posClassesU[i][1] - c ))
-
-                    # #print(dist)
-
-                    # if cl == classes[np.argmin(dist)]:
-                    #     correct += 1
-
-                    #correct if: the bmu of the propagated activation fall into an area associated with the class of the input
-
-                    actTU = np.array([])
-                    for cu in classes:
-                        actTU = np.append(actTU,activations['U'][cu][0][0][bmuU])
-
-                    if cl == classes[np.argmax(actTU)]:
-                        correct += 1
-
-
-            corrects.append(correct)
-            #print(corrects)
-
-        print(corrects)
-        print(sum(corrects) / float(len(corrects)))
-        niterRes.append(sum(corrects) / float(len(corrects)))
-        print('--------')
-        print(niterRes)
+    niterRes = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=initTrialWorker,
+                             initargs=(actV, actU, protoClass)) as pool:
+        # use nTrials random training sets for each number of couples
+        futures = [[pool.submit(runTrialBatch, batchSeed, batchSize, niter, nSamplesU, sparse)
+                    for batchSeed, batchSize in zip(seeds[i].spawn(len(batchSizes)), batchSizes)]
+                   for i, niter in enumerate(niters)]
+        for niter, niterFutures in zip(niters, futures):
+            corrects = np.concatenate([f.result() for f in niterFutures])
+            print('couples -> '+str(niter))
+            print(sum(corrects) / float(len(corrects)))
+            niterRes.append(sum(corrects) / float(len(corrects)))
+            print('--------')
+            print(niterRes)
+    return niterRes
 
 
 
 
 
-def testWordLearning():
+def testWordLearning(synapsesFile='./sinapses.npy'):
     """
         Test the taxonomic factor of the model increasing the number of couples used for each class.
+        the synapses are restored from synapsesFile, or trained and saved there
     """
     classesIn = open('./utility/labels10classes.txt','r')
     classes = []
@@ -786,9 +758,9 @@ def testWordLearning():
 
 
 
-    S = restoresynapses()
+    S = restoresynapses(synapsesFile)
     maxIter = 10
-    if S == None:
+    if S is None:
         for i in range(0,maxIter):
             INPUTV = dict()
             INPUTU = dict()
@@ -799,7 +771,7 @@ def testWordLearning():
             S = updatesynapses(S,classes,SOMU,SOMV,INPUTV,INPUTU,i,maxIter)
             print('------- '+str(i)+'--------'+str(maxIter))
 
-        savesynapses(S,'./sinapses.csv')
+        savesynapses(S,synapsesFile)
 
     ###################################
     #        TEST
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from data.batching import BucketSampler, BatchPrefetcher, split_by_frame_budget
+
+
+def test_split_by_frame_budget():
+    lengths = [5, 100, 30, 30, 7, 400]
+    groups = split_by_frame_budget(lengths, 100)
+    assert [list(g) for g in groups] == [[0, 4, 2], [3], [1], [5]]
+
+
+def test_split_by_frame_budget_bounds_groups():
+    random_state = np.random.RandomState(0)
+    lengths = random_state.randint(1, 300, 200)
+    groups = split_by_frame_budget(lengths, 1000)
+    np.testing.assert_array_equal(np.sort(np.concatenate(groups)), np.arange(200))
+    for g in groups:
+        # over-budget utterances can only be alone
+        assert len(g) * lengths[g].max() <= 1000 or len(g) == 1
+
+
+def test_bucket_sampler_batches():
+    random_state = np.random.RandomState(1)
+    lengths = random_state.randint(1, 500, 103)
+    sampler = BucketSampler(lengths, 10, n_buckets=5, seed=0)
+    batches = sampler.epoch()
+    assert len(batches) == 10
+    for batch in batches:
+        assert len(np.unique(batch)) == 10
+    indexes = np.concatenate(batches)
+    assert len(np.unique(indexes)) == len(indexes)
+    assert np.all((indexes >= 0) & (indexes < 103))
+
+
+def test_bucketing_lowers_padding():
+    random_state = np.random.RandomState(2)
+    lengths = random_state.randint(1, 500, 1000)
+    bucketed = BucketSampler(lengths, 20, n_buckets=10, seed=0)
+    plain = BucketSampler(lengths, 20, n_buckets=1, seed=0)
+    assert bucketed.padding_ratio(bucketed.epoch()) < plain.padding_ratio(plain.epoch())
+
+
+def test_bucket_sampler_seed():
+    lengths = np.random.RandomState(3).randint(1, 100, 50)
+    first = BucketSampler(lengths, 4, seed=7)
+    second = BucketSampler(lengths, 4, seed=7)
+    for _ in range(3):
+        for a, b in zip(first.epoch(), second.epoch()):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_bucket_sampler_with_fewer_utterances_than_a_batch():
+    sampler = BucketSampler([3, 4, 5], 10)
+    batches = sampler.epoch()
+    assert batches == []
+    assert sampler.padding_ratio(batches) == 0.0
+
+
+def test_batch_prefetcher_keeps_the_order():
+    prefetcher = BatchPrefetcher(lambda batch: batch * 2, list(range(20)), queue_size=2)
+    assert list(prefetcher) == [2 * i for i in range(20)]
+    assert prefetcher.mean_queue_depth >= 0
+
+
+def test_batch_prefetcher_raises_producer_errors():
+    def make_batch(batch):
+        if batch == 5:
+            raise ValueError('bad batch')
+        return batch
+    received = []
+    with pytest.raises(ValueError, match='bad batch'):
+        for batch in BatchPrefetcher(make_batch, list(range(10))):
+            received.append(batch)
+    # the batches made before the error are still delivered, in order
+    assert received == [0, 1, 2, 3, 4]
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+pytest.importorskip('tensorflow')
+pytest.importorskip('librosa')
+from data.dataset import Dataset, OSXSpeakerDataset
+from data.ragged_store import RaggedArray
+
+
+def make_dataset(n=10):
+    random_state = np.random.RandomState(0)
+    dataset = Dataset('root')
+    dataset.X_train = RaggedArray.from_list([random_state.rand(i + 1, 3) for i in range(n)])
+    dataset.y_train = [np.arange(i + 2) for i in range(n)]
+    dataset.train_timesteps = np.arange(1, n + 1)
+    dataset.X_val = dataset.y_val = dataset.val_timesteps = [np.zeros(1)]
+    dataset.X_test = dataset.y_test = dataset.test_timesteps = [np.zeros(1)]
+    dataset.num_features = 3
+    return dataset
+
+
+def test_shards_are_disjoint_and_cover_the_training_set():
+    dataset = make_dataset()
+    shards = [dataset.shard(i, 3) for i in range(3)]
+    timesteps = np.concatenate([shard.train_timesteps for shard in shards])
+    np.testing.assert_array_equal(np.sort(timesteps), dataset.train_timesteps)
+    for shard in shards:
+        assert isinstance(shard, Dataset)
+        assert isinstance(shard.X_train, RaggedArray) and shard.X_train.index is None
+        assert isinstance(shard.y_train, list)
+        assert len(shard.X_train) == len(shard.y_train) == len(shard.train_timesteps)
+        for x, y, t in zip(shard.X_train, shard.y_train, shard.train_timesteps):
+            # every field of an utterance comes from the same utterance
+            np.testing.assert_array_equal(x, dataset.X_train[t - 1])
+            np.testing.assert_array_equal(y, dataset.y_train[t - 1])
+        assert shard.num_features == 3
+
+
+def test_shards_drop_the_evaluation_fields():
+    shard = make_dataset().shard(1, 2)
+    for name in Dataset.EVALUATION_FIELDS:
+        assert not hasattr(shard, name)
+
+
+def test_osx_speaker_dataset_shards_its_examples():
+    dataset = OSXSpeakerDataset.__new__(OSXSpeakerDataset)
+    dataset.X = [np.full(2, i) for i in range(5)]
+    dataset.y = np.arange(5)
+    shard = dataset.shard(0, 2)
+    np.testing.assert_array_equal(shard.y, [0, 2, 4])
+    np.testing.assert_array_equal(shard.X, [[0, 0], [2, 2], [4, 4]])
+
+
+def make_timit_folder(root):
+    random_state = np.random.RandomState(1)
+    for region in ['DR1', 'DR2']:
+        for speaker in ['A', 'B', 'C']:
+            folder = root / region / speaker
+            folder.mkdir(parents=True)
+            for utterance in ['S2', 'S1']:
+                (folder / (utterance + '.WAV')).write_text(str(random_state.randint(0, 1000)))
+                (folder / (utterance + '.PHN')).write_text('0 80 h#\n80 400 sh\n')
+
+
+def test_parallel_timit_loading_keeps_the_order(tmp_path, monkeypatch):
+    import data.dataset as dataset_module
+    from data.dataset import TIMITDataset
+    make_timit_folder(tmp_path / 'TRAIN')
+    loaded = []
+
+    # utterances of the same length, which np.array stacks
+    def load(path, sr):
+        loaded.append(path)
+        return float(open(path).read()) + np.arange(10.0), sr
+    monkeypatch.setattr(dataset_module.librosa.core, 'load', load)
+    cache_folder = str(tmp_path / 'cache')
+    X, y, timesteps = TIMITDataset.load_explore_timit(str(tmp_path / 'TRAIN'), False, 13, n_workers=1,
+                                                      cache_folder=cache_folder)
+    # speakers sorted by path, utterances by file name
+    assert loaded == sorted(loaded) and len(loaded) == 12
+    np.testing.assert_array_equal([x[0] for x in X], [float(open(path).read()) for path in loaded])
+    # the workers find every utterance in the cache
+    X_parallel, y_parallel, timesteps_parallel = TIMITDataset.load_explore_timit(
+        str(tmp_path / 'TRAIN'), False, 13, n_workers=2, cache_folder=cache_folder)
+    assert len(loaded) == 12
+    assert timesteps_parallel == timesteps
+    for x, x_parallel in zip(X, X_parallel):
+        np.testing.assert_array_equal(x, x_parallel)
+    np.testing.assert_array_equal(np.array(y_parallel.tolist()), np.array(y.tolist()))
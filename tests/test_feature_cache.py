@@ -0,0 +1,33 @@
+import os
+import numpy as np
+from data.feature_cache import FeatureCache
+
+
+def test_features_are_computed_once(tmp_path):
+    audio_file = tmp_path / 'a.wav'
+    audio_file.write_bytes(b'some audio')
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    calls = []
+    compute = lambda: calls.append(1) or np.arange(3)
+    np.testing.assert_array_equal(cache.get(str(audio_file), compute, n=1), np.arange(3))
+    np.testing.assert_array_equal(cache.get(str(audio_file), compute, n=1), np.arange(3))
+    cache.get(str(audio_file), compute, n=2)
+    assert len(calls) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_contents_are_hashed_only_when_the_file_changes(tmp_path, monkeypatch):
+    audio_file = tmp_path / 'a.wav'
+    audio_file.write_bytes(b'some audio')
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    hashed = []
+    content_hash = FeatureCache.content_hash
+    monkeypatch.setattr(FeatureCache, 'content_hash',
+                        staticmethod(lambda path: hashed.append(path) or content_hash(path)))
+    first = cache.file_hash(str(audio_file))
+    assert cache.file_hash(str(audio_file)) == first
+    assert len(hashed) == 1
+    audio_file.write_bytes(b'other audio')
+    os.utime(str(audio_file), ns=(0, 10 ** 9))
+    assert cache.file_hash(str(audio_file)) != first
+    assert len(hashed) == 2
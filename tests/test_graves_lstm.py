@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+pytest.importorskip('tensorflow')
+pytest.importorskip('librosa')
+pytest.importorskip('keras')
+import models.graves_lstm as graves_lstm
+
+
+class FakeShape():
+    def __init__(self, shape):
+        self.shape = shape
+
+    def as_list(self):
+        return list(self.shape)
+
+
+class FakeVariable():
+    def __init__(self, shape):
+        self.shape = shape
+
+    def get_shape(self):
+        return FakeShape(self.shape)
+
+
+class FakeSession():
+    '''
+    Records the fetches of each run. The cost and train label error rate
+    of a batch are the mean of its sequence lengths, the gradients that
+    mean times ones.
+    '''
+
+    def __init__(self, model):
+        self.model = model
+        self.runs = []
+
+    def run(self, fetches, feed=None):
+        self.runs.append(fetches)
+        mean_length = np.mean(feed[self.model['seq_length']]) if feed is not None else None
+        values = {'cost': mean_length, 'train_ler': mean_length, 'ler': mean_length, 'train_step': None,
+                  'apply_gradients': None}
+        if not isinstance(fetches, list):
+            return values[fetches]
+        return [[mean_length * np.ones(v.shape) for v in self.model['variables']] if f == 'gradients'
+                else values[f] for f in fetches]
+
+
+def fake_model():
+    names = ['inputs', 'targets', 'seq_length', 'cost', 'train_step', 'train_ler', 'ler', 'apply_gradients']
+    model = {name: name for name in names}
+    model['variables'] = [FakeVariable((2, 3)), FakeVariable((3,))]
+    model['gradients'] = 'gradients'
+    model['gradient_placeholders'] = ['gradient_0', 'gradient_1']
+    return model
+
+
+class FakeDataset():
+    def __init__(self, lengths):
+        self.train_timesteps = list(lengths)
+        self.X_train = np.empty(len(lengths), dtype=object)
+        self.y_train = np.empty(len(lengths), dtype=object)
+        for i, n in enumerate(lengths):
+            self.X_train[i] = np.ones((n, 2))
+            self.y_train[i] = np.arange(1, 3)
+
+
+def test_train_ler_is_fetched_with_the_optimizer_step(monkeypatch):
+    monkeypatch.setattr(graves_lstm, 'TRAIN_LER_EVERY', 10)
+    dataset = FakeDataset(np.arange(1, 51))
+    batches = [np.array([2 * i, 2 * i + 1]) for i in range(25)]
+    model = fake_model()
+    session = FakeSession(model)
+    train_cost, train_ler = graves_lstm.train_epoch(session, model, dataset, batches, frame_budget=None)
+    # one run per batch, the label error rate in the same run every 10 batches
+    assert len(session.runs) == 25
+    assert [i for i, fetches in enumerate(session.runs) if 'train_ler' in fetches] == [0, 10, 20]
+    assert all('train_step' in fetches for fetches in session.runs)
+    assert np.isclose(train_ler, np.mean([1.5, 21.5, 41.5]))
+    assert np.isclose(train_cost, np.mean(np.arange(1, 51)))
+
+
+def test_train_ler_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(graves_lstm, 'TRAIN_LER_EVERY', 0)
+    model = fake_model()
+    session = FakeSession(model)
+    _, train_ler = graves_lstm.train_epoch(session, model, FakeDataset([3, 4]), [np.array([0, 1])],
+                                           frame_budget=None)
+    assert np.isnan(train_ler)
+    assert all('train_ler' not in fetches for fetches in session.runs)
+
+
+def test_unknown_rnn_backend():
+    with pytest.raises(ValueError, match='Unknown RNN backend'):
+        graves_lstm.bidirectional_rnn(None, None, 'cudnn')
+
+
+def test_synthetic_benchmark_batches():
+    from models.graves_lstm_benchmark import synthetic_batches
+    batches = synthetic_batches(3, 13, 40, 20, 50, np.random.RandomState(0))
+    assert len(batches) == 3
+    for inputs, (indices, values, dense_shape), seq_length in batches:
+        assert inputs.shape == (graves_lstm.BATCH_SIZE, np.max(seq_length), 13)
+        assert np.all((seq_length >= 20) & (seq_length <= 50))
+        assert dense_shape[0] == graves_lstm.BATCH_SIZE
+        assert np.all((values >= 0) & (values < 39))
+
+
+@pytest.mark.parametrize('backend', ['lstm_cell', 'block_fused'])
+def test_rnn_backends_train(backend):
+    tf = graves_lstm.tf
+    if not hasattr(tf, 'Session'):
+        pytest.skip('needs TensorFlow 1')
+    from models.graves_lstm_benchmark import synthetic_batches
+    num_classes = 40
+    graph, model = graves_lstm.build_graph(13, num_classes, backend)
+    inputs, targets, seq_length = synthetic_batches(1, 13, num_classes, 20, 40, np.random.RandomState(1))[0]
+    feed = {model['inputs']: inputs, model['targets']: targets, model['seq_length']: seq_length}
+    with tf.Session(graph=graph) as session:
+        session.run(model['init'])
+        costs = [session.run([model['cost'], model['train_step']], feed)[0] for _ in range(3)]
+    assert np.all(np.isfinite(costs))
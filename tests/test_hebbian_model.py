@@ -0,0 +1,165 @@
+import numpy as np
+import models.som.HebbianModel as hebbian_module
+from models.som.HebbianModel import HebbianModel
+
+
+class GridSOM():
+    '''
+    Stand-in for models.som.SOM.SOM, with random weights and the same
+    NumPy activations, so that the tests do not need TensorFlow.
+    '''
+
+    def __init__(self, m, n, dim, seed=0, tau=0.5, threshold=0.6):
+        self._m, self._n = m, n
+        self._weightages = np.random.RandomState(seed).rand(m * n, dim)
+        self._locations = list(self._neuron_locations(m, n))
+        self.tau, self.threshold = tau, threshold
+
+    def _neuron_locations(self, m, n):
+        for i in range(m):
+            for j in range(n):
+                yield np.array([i, j])
+
+    def get_activations_batch(self, input_vects, normalize=True, threshold=True):
+        input_vects = np.atleast_2d(np.asarray(input_vects, dtype=float))
+        d = np.abs(input_vects[:, np.newaxis, :] - self._weightages[np.newaxis]).sum(axis=2)
+        activations = np.exp(-(d / self._weightages.shape[1]) / self.tau)
+        if normalize:
+            min_ = activations.min(axis=1, keepdims=True)
+            activations = (activations - min_) / (activations.max(axis=1, keepdims=True) - min_)
+        if threshold:
+            activations[activations < self.threshold] = 0
+        return activations
+
+    def get_activations(self, input_vect, normalize=True, threshold=True, mode='exp'):
+        return [self.get_activations_batch(input_vect, normalize, threshold)[0], self._locations]
+
+    def memorize_examples_by_class(self, X, y):
+        self.bmu_class_dict = {i: [] for i in range(self._m * self._n)}
+        bmus = np.argmax(self.get_activations_batch(X, normalize=False, threshold=False), axis=1)
+        for bmu, yi in zip(bmus, y):
+            self.bmu_class_dict[bmu].append(yi)
+
+
+def make_model(n_presentations=1, seed=0, **kwargs):
+    som_a = GridSOM(3, 4, 5, seed=seed)
+    som_v = GridSOM(3, 4, 6, seed=seed + 1)
+    return HebbianModel(som_a, som_v, a_dim=5, v_dim=6, n_presentations=n_presentations,
+                        n_classes=2, **kwargs)
+
+
+def test_target_index_is_hashed_once_per_batch(monkeypatch):
+    model = make_model()
+    random_state = np.random.RandomState(0)
+    X_target = random_state.rand(8, 5)
+    y_target = np.arange(8) % 2
+    hashed = []
+    target_set_key = hebbian_module.target_set_key
+    monkeypatch.setattr(hebbian_module, 'target_set_key',
+                        lambda X, y: hashed.append(1) or target_set_key(X, y))
+    index = model.get_target_index(X_target, y_target)
+    for x in random_state.rand(5, 6):
+        model.make_prediction(x, None, model.som_v, model.som_a, X_target, y_target, 'v')
+    assert model.get_target_index(X_target, y_target) is index
+    assert len(hashed) == 1
+    # a batch checks the contents once and sees in-place changes
+    X_target[0] = 0.5
+    model.predict(random_state.rand(3, 6), source='v', X_target=X_target, y_target=y_target)
+    assert len(hashed) == 3
+    assert model.get_target_index(X_target, y_target) is not index
+    # other objects rebuild the index
+    assert model.get_target_index(X_target.copy(), y_target) is not model.get_target_index(X_target, y_target)
+
+
+def trained_model(seed=0):
+    random_state = np.random.RandomState(seed)
+    model = make_model(n_presentations=3, seed=seed)
+    X_a, X_v = random_state.rand(6, 5), random_state.rand(6, 6)
+    model.train(X_a, X_v)
+    y = np.arange(6) % 2
+    model.som_a.memorize_examples_by_class(X_a, y)
+    model.som_v.memorize_examples_by_class(X_v, y)
+    return model, random_state
+
+
+def test_evaluate_batch_matches_per_example_predictions():
+    model, random_state = trained_model()
+    X_a, X_v = random_state.rand(12, 5), random_state.rand(12, 6)
+    y = np.arange(12) % 2
+    per_example = {
+        'regular': [model.make_prediction(x, None, model.som_v, model.som_a, X_a, y, 'v') for x in X_v],
+        'knn': [model.make_prediction_knn(x, None, 3, model.som_v, model.som_a, 'v') for x in X_v],
+        'sorted': [model.make_prediction_sort(x, model.som_v, model.som_a, 'v') for x in X_v],
+    }
+    for prediction_alg, expected in per_example.items():
+        accuracy, y_pred, confusion = model.evaluate_batch(X_a, X_v, y, y, source='v',
+                                                           prediction_alg=prediction_alg, k=3)
+        np.testing.assert_array_equal(y_pred, expected)
+        assert accuracy == np.mean(y_pred == y)
+        assert confusion.sum() == 12 and np.trace(confusion) == np.sum(y_pred == y)
+
+
+def test_train_accumulates_normalized_weights():
+    model = make_model(n_presentations=2)
+    initial = model.weights.astype(float)
+    random_state = np.random.RandomState(4)
+    X_a, X_v = random_state.rand(4, 5), random_state.rand(4, 6)
+    model.train(X_a, X_v)
+    activations_a = model.som_a.get_activations_batch(X_a)
+    activations_v = model.som_v.get_activations_batch(X_v)
+    expected = initial.copy()
+    for a, v in zip(activations_a, activations_v):
+        expected += 1 - np.exp(-model.learning_rate * np.outer(a, v))
+    assert model.weights.dtype == np.float32
+    np.testing.assert_allclose(model.weights, expected / expected.sum(), rtol=1e-4)
+    np.testing.assert_allclose(model._weights_scale, expected.sum(), rtol=1e-5)
+
+
+def test_save_and_restore(tmp_path):
+    model = make_model(n_presentations=2, checkpoint_dir=str(tmp_path))
+    random_state = np.random.RandomState(5)
+    model.train(random_state.rand(4, 5), random_state.rand(4, 6))
+    restored = make_model(n_presentations=2, checkpoint_dir=str(tmp_path))
+    assert restored.restore_trained(mmap=True)
+    assert isinstance(restored.weights, np.memmap)
+    np.testing.assert_array_equal(restored.weights, model.weights)
+    assert restored._weights_scale == model._weights_scale
+    # training goes on from the read-only restored weights (saving again
+    # would overwrite the file they map)
+    model.checkpoint_dir = None
+    X_a, X_v = random_state.rand(4, 5), random_state.rand(4, 6)
+    model.train(X_a, X_v)
+    restored.train(X_a, X_v)
+    np.testing.assert_allclose(restored.weights, model.weights)
+    assert not make_model(checkpoint_dir=str(tmp_path / 'missing')).restore_trained()
+
+
+def test_sparse_storage_matches_dense(tmp_path):
+    dense = make_model(n_presentations=2)
+    sparse = make_model(n_presentations=2, storage='sparse', checkpoint_dir=str(tmp_path))
+    # start both from the same constant weights
+    dense.weights[:] = 1 / dense.num_neurons
+    random_state = np.random.RandomState(6)
+    X_a, X_v = random_state.rand(4, 5), random_state.rand(4, 6)
+    dense.train(X_a, X_v)
+    sparse.train(X_a, X_v)
+    np.testing.assert_allclose(sparse.weights.toarray(), dense.weights, rtol=1e-5)
+    restored = make_model(n_presentations=2, storage='sparse', checkpoint_dir=str(tmp_path))
+    assert restored.restore_trained()
+    np.testing.assert_allclose(restored.weights.toarray(), sparse.weights.toarray())
+
+
+def test_presentation_curve_matches_training_on_the_first_folds():
+    random_state = np.random.RandomState(7)
+    X_a, X_v = random_state.rand(6, 5), random_state.rand(6, 6)
+    curve_model = make_model()
+    initial = curve_model.weights.copy()
+    snapshots = curve_model.presentation_curve(X_a, X_v, lambda model, n: (n, model.weights.copy()))
+    assert [n for n, _ in snapshots] == [1, 2, 3]
+    for n, weights in snapshots:
+        # a fresh model trained on the first n presentations at once
+        model = make_model(n_presentations=n)
+        model.weights = initial.copy()
+        model.train(X_a[:2 * n], X_v[:2 * n])
+        np.testing.assert_allclose(weights, model.weights, rtol=1e-4)
+    assert curve_model.n_presentations == 3
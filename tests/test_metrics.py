@@ -0,0 +1,49 @@
+import math
+import numpy as np
+from models.som.metrics import mean_pairwise_distance, class_distances
+
+
+def loop_mean_distance(positions):
+    # the loops of the former wordLearningTest.distanceIntraClass
+    d = 0
+    count = 0
+    for i in positions:
+        i1 = positions.index(i)
+        for j in positions[i1+1:]:
+            d += math.sqrt(((j[0]-i[0])**2) + ((j[1]-i[1])**2))
+            count += 1
+    return d / count
+
+
+def random_positions(random_state, n):
+    # few distinct positions, so that many are repeated
+    return [list(p) for p in random_state.randint(0, 4, (n, 2))]
+
+
+def test_mean_pairwise_distance_matches_the_loops():
+    random_state = np.random.RandomState(0)
+    for n in [2, 5, 40]:
+        positions = random_positions(random_state, n)
+        assert np.isclose(mean_pairwise_distance(positions), loop_mean_distance(positions))
+        assert np.isclose(mean_pairwise_distance(positions, chunk_size=3), loop_mean_distance(positions))
+
+
+def test_mean_pairwise_distance_over_unordered_pairs():
+    random_state = np.random.RandomState(1)
+    positions = random_state.randint(0, 5, (30, 2))
+    distances = [np.linalg.norm(positions[i] - positions[j]) for i in range(30) for j in range(i + 1, 30)]
+    assert np.isclose(mean_pairwise_distance(positions, first_occurrence=False), np.mean(distances))
+    assert np.isnan(mean_pairwise_distance(positions[:1]))
+
+
+def test_class_distances_match_the_loops():
+    random_state = np.random.RandomState(2)
+    positions = random_positions(random_state, 60)
+    labels = random_state.choice(['bird', 'cat', 'dog'], 60)
+    intra, inter = class_distances(positions, labels)
+    ordered = []
+    for c in ['bird', 'cat', 'dog']:
+        class_positions = [p for p, label in zip(positions, labels) if label == c]
+        assert np.isclose(intra[c], loop_mean_distance(class_positions))
+        ordered.extend(class_positions)
+    assert np.isclose(inter, loop_mean_distance(ordered))
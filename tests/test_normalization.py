@@ -0,0 +1,41 @@
+import numpy as np
+from data.normalization import FeatureStatistics
+from data.ragged_store import RaggedArray
+
+
+def random_utterances(random_state):
+    return [random_state.randn(n, 4) * 3 + 10 for n in random_state.randint(1, 50, 20)]
+
+
+def test_streaming_statistics_match_numpy():
+    random_state = np.random.RandomState(0)
+    xs = random_utterances(random_state)
+    frames = np.concatenate(xs)
+    for statistics in [FeatureStatistics().fit(xs, chunk_frames=7),
+                       FeatureStatistics().fit(RaggedArray.from_list(xs), chunk_frames=7),
+                       FeatureStatistics().fit(RaggedArray.from_list(xs)[::-1], chunk_frames=7)]:
+        assert statistics.count == len(frames)
+        np.testing.assert_allclose(statistics.mean, frames.mean(axis=0))
+        np.testing.assert_allclose(statistics.var, frames.var(axis=0))
+
+
+def test_apply_normalizes_in_place():
+    random_state = np.random.RandomState(1)
+    xs = random_utterances(random_state)
+    xs[0][:, 2] = 5.0
+    statistics = FeatureStatistics().fit(xs)
+    statistics.apply(xs)
+    frames = np.concatenate(xs)
+    np.testing.assert_allclose(frames.mean(axis=0), 0, atol=1e-10)
+    np.testing.assert_allclose(frames.std(axis=0), 1)
+
+
+def test_save_and_load_keep_the_path(tmp_path):
+    statistics = FeatureStatistics().fit(random_utterances(np.random.RandomState(2)))
+    for name in ['stats', 'stats.bin', 'stats.npz']:
+        path = str(tmp_path / name)
+        statistics.save(path)
+        loaded = FeatureStatistics.load(path)
+        assert loaded.count == statistics.count
+        np.testing.assert_allclose(loaded.mean, statistics.mean)
+        np.testing.assert_allclose(loaded.m2, statistics.m2)
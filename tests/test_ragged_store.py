@@ -0,0 +1,52 @@
+import pickle
+import numpy as np
+from data.ragged_store import RaggedArray, save_ragged, open_ragged, pickle_to_store
+from RepresentationExperiments.data_utils import load_data
+
+
+def random_sequences(n=6, seed=0):
+    random_state = np.random.RandomState(seed)
+    return [random_state.rand(random_state.randint(0, 5), 3) for _ in range(n)]
+
+
+def test_ragged_array_indexing():
+    xs = random_sequences()
+    ragged = RaggedArray.from_list(xs)
+    assert len(ragged) == len(xs)
+    np.testing.assert_array_equal(ragged.lengths, [len(x) for x in xs])
+    np.testing.assert_array_equal(ragged[-1], xs[-1])
+    selected = ragged[np.array([4, 1, 2])][1:]
+    assert len(selected) == 2
+    np.testing.assert_array_equal(selected.lengths, [len(xs[1]), len(xs[2])])
+    for x, y in zip(selected.tolist(), [xs[1], xs[2]]):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_save_and_open_ragged(tmp_path):
+    xs = random_sequences()
+    keys = np.array(['a/1', 'b/2', 'c/3', 'd/4', 'e/5', 'f/6'])
+    folder = str(tmp_path / 'store')
+    # an indexed RaggedArray is saved as the items it selects
+    save_ragged(folder, xs=RaggedArray.from_list(xs)[::-1], keys=keys, scalars=np.arange(6.0))
+    fields = open_ragged(folder)
+    assert isinstance(fields['xs'], RaggedArray)
+    assert isinstance(fields['xs'].values, np.memmap)
+    for x, y in zip(fields['xs'], xs[::-1]):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_array_equal(fields['keys'], keys)
+    np.testing.assert_array_equal(open_ragged(folder, mmap_mode=None)['scalars'], np.arange(6.0))
+
+
+def test_load_data_from_pickle_and_store(tmp_path):
+    xs = random_sequences(3)
+    data = {'word/10': xs[0], 'word/11': xs[1], 'word/12': xs[2]}
+    pickle_filename = str(tmp_path / 'activations.pkl')
+    with open(pickle_filename, 'wb') as f:
+        pickle.dump(data, f)
+    folder = str(tmp_path / 'activations.store')
+    pickle_to_store(pickle_filename, folder)
+    xs_pickle, ys_pickle = load_data(pickle_filename)
+    xs_store, ys_store = load_data(folder)
+    assert ys_store == ys_pickle == ['10', '11', '12']
+    for x, y in zip(xs_store, xs_pickle):
+        np.testing.assert_array_equal(x, y)
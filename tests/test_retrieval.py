@@ -0,0 +1,113 @@
+import numpy as np
+from models.som.retrieval import InnerProductIndex, LabelledNeuronIndex, target_set_key
+
+
+def brute_force_top_k(Q, X, k):
+    scores = Q @ X.T
+    return np.argsort(-scores, axis=1, kind='stable')[:, :k]
+
+
+def test_exact_query_matches_brute_force():
+    random_state = np.random.RandomState(0)
+    X = random_state.randn(300, 16)
+    Q = random_state.randn(50, 16)
+    index = InnerProductIndex(X, chunk_size=7)
+    indexes, scores = index.query(Q, k=5)
+    np.testing.assert_array_equal(indexes, brute_force_top_k(Q, X, 5))
+    np.testing.assert_allclose(scores, np.take_along_axis(Q @ X.T, indexes, axis=1))
+
+
+def test_approximate_query_probing_all_lists_is_exact():
+    random_state = np.random.RandomState(1)
+    X = random_state.randn(400, 8)
+    Q = random_state.randn(40, 8)
+    index = InnerProductIndex(X, approximate=True, n_lists=20, n_probe=20, seed=0)
+    np.testing.assert_array_equal(index.query(Q, k=5)[0], brute_force_top_k(Q, X, 5))
+
+
+def test_approximate_index_without_kmeans_iterations():
+    random_state = np.random.RandomState(2)
+    X = random_state.randn(100, 4)
+    index = InnerProductIndex(X, approximate=True, n_lists=10, n_probe=10, n_iterations=0, seed=0)
+    np.testing.assert_array_equal(index.query(X[:10], k=3)[0], brute_force_top_k(X[:10], X, 3))
+
+
+def test_calibrated_n_probe_reaches_target_recall():
+    random_state = np.random.RandomState(3)
+    centers = random_state.randn(30, 16) * 3
+    X = centers[random_state.randint(0, 30, 3000)] + random_state.randn(3000, 16)
+    index = InnerProductIndex(X, approximate=True, target_recall=0.95, recall_k=5, seed=0)
+    assert index.estimated_recall >= 0.95
+    Q = X[random_state.choice(len(X), 200, replace=False)]
+    found = index.query(Q, k=5)[0]
+    expected = brute_force_top_k(Q, X, 5)
+    recall = np.mean([len(set(f) & set(e)) / 5.0 for f, e in zip(found, expected)])
+    assert recall >= 0.9
+
+
+def test_predict():
+    X = np.eye(4)
+    index = InnerProductIndex(X, y=np.array([10, 11, 12, 13]))
+    np.testing.assert_array_equal(index.predict(np.array([[0, 0, 1, 0], [0.9, 0.1, 0, 0]])), [12, 10])
+
+
+def test_target_set_key_sees_in_place_changes():
+    X = np.arange(12.0).reshape(4, 3)
+    y = np.arange(4)
+    key = target_set_key(X, y)
+    assert target_set_key(X.copy(), y.copy()) == key
+    X[0, 0] = -1
+    assert target_set_key(X, y) != key
+
+
+class LabelledGrid():
+    # the attributes of a SOM that LabelledNeuronIndex reads
+    def __init__(self, m, n, seed):
+        random_state = np.random.RandomState(seed)
+        self._m, self._n = m, n
+        self.bmu_class_dict = {i: list(random_state.randint(0, 3, random_state.randint(0, 3)))
+                               for i in range(m * n)}
+
+    def _neuron_locations(self, m, n):
+        for i in range(m):
+            for j in range(n):
+                yield np.array([i, j])
+
+
+def loop_k_closest(som, activations, k):
+    # the former HebbianModel.get_bmu_k_closest
+    pos_activations = list(som._neuron_locations(som._m, som._n))
+    bmu_position = pos_activations[np.argmax(activations)]
+    distances_from_bmu = [np.linalg.norm(bmu_position - unit_position) for unit_position in pos_activations]
+    sorted_indexes = list(range(len(distances_from_bmu)))
+    sorted_indexes.sort(key=distances_from_bmu.__getitem__)
+    return [index for index in sorted_indexes if som.bmu_class_dict[index] != []][:k+1]
+
+
+def loop_sorted(som, activations):
+    # the former HebbianModel.make_prediction_sort
+    activations = activations.copy()
+    while True:
+        bmu = np.argmax(activations)
+        if som.bmu_class_dict[bmu] != []:
+            return som.bmu_class_dict[bmu][0]
+        activations[bmu] = -1
+
+
+def test_labelled_neuron_index_matches_the_loops():
+    som = LabelledGrid(5, 6, seed=0)
+    activations = np.random.RandomState(1).rand(20, 30)
+    for max_neighbours in [None, 4]:
+        index = LabelledNeuronIndex(som, max_neighbours=max_neighbours)
+        np.testing.assert_array_equal(index.sorted_predict(activations),
+                                      [loop_sorted(som, a) for a in activations])
+        closest = index.closest(np.argmax(activations, axis=1), 3)
+        np.testing.assert_array_equal(closest, [loop_k_closest(som, a, 3) for a in activations])
+        for weighted in [False, True]:
+            expected = []
+            for a, neurons in zip(activations, closest):
+                class_count = np.zeros(3)
+                for neuron in neurons:
+                    class_count[som.bmu_class_dict[neuron][0]] += a[neuron] if weighted else 1
+                expected.append(np.argmax(class_count))
+            np.testing.assert_array_equal(index.knn_predict(activations, 3, weighted=weighted), expected)
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+tf = pytest.importorskip('tensorflow')
+from models.som.SOM import SOM
+from utils.utils import collapse_duplicates
+
+
+def test_weighted_inputs_update_like_replicated_ones(tmp_path):
+    random_state = np.random.RandomState(0)
+    distinct = random_state.rand(4, 5)
+    replicated = distinct[[0, 0, 0, 1, 2, 2, 3]]
+    som = SOM(3, 4, 5, checkpoint_dir=str(tmp_path), n_iterations=10)
+    representatives, weights, _ = collapse_duplicates(replicated)
+    replicated_delta = som._sess.run(som.weightage_delta, feed_dict={som._vect_input: replicated,
+                                                                     som._iter_input: 2})
+    weighted_delta = som._sess.run(som.weightage_delta, feed_dict={som._vect_input: representatives,
+                                                                   som._weight_input: weights,
+                                                                   som._iter_input: 2})
+    np.testing.assert_allclose(weighted_delta, replicated_delta, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+from models.som.synapses import outer_product_entries, hebbian_delta, hebbian_delta_sweep, normalize_synapses
+from models.som.synapses import SparseSynapses, save_synapses, load_synapses, find_synapses
+
+
+def random_activations(random_state, n_pairs, n_neurons):
+    activations = random_state.rand(n_pairs, n_neurons)
+    activations[activations < 0.7] = 0.0
+    return activations
+
+
+def reference_delta(activations_a, activations_b, learning_rate):
+    delta = np.zeros((activations_a.shape[1], activations_b.shape[1]))
+    for a, b in zip(activations_a, activations_b):
+        delta += 1 - np.exp(-learning_rate * np.outer(a, b))
+    return delta
+
+
+def test_outer_product_entries_chunks():
+    random_state = np.random.RandomState(5)
+    activations_a = random_activations(random_state, 12, 7)
+    activations_b = random_activations(random_state, 12, 6)
+    products = np.zeros((12, 7, 6))
+    for pair, rows, cols, values in outer_product_entries(activations_a, activations_b, max_entries=10):
+        products[pair, rows, cols] += values
+    np.testing.assert_allclose(products, activations_a[:, :, None] * activations_b[:, None, :])
+
+
+def test_hebbian_delta_matches_dense_reference():
+    random_state = np.random.RandomState(0)
+    activations_a = random_activations(random_state, 20, 30)
+    activations_b = random_activations(random_state, 20, 25)
+    expected = reference_delta(activations_a, activations_b, 5.0)
+    np.testing.assert_allclose(hebbian_delta(activations_a, activations_b, 5.0), expected)
+    out = hebbian_delta(activations_a, activations_b, 5.0, dtype=np.float32)
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, expected, rtol=1e-5)
+
+
+def test_hebbian_delta_accumulates_into_out():
+    random_state = np.random.RandomState(1)
+    activations_a = random_activations(random_state, 10, 12)
+    activations_b = random_activations(random_state, 10, 12)
+    out = np.ones((12, 12))
+    hebbian_delta(activations_a, activations_b, 2.0, out=out)
+    np.testing.assert_allclose(out, 1 + reference_delta(activations_a, activations_b, 2.0))
+
+
+def test_hebbian_delta_groups():
+    random_state = np.random.RandomState(2)
+    activations_a = random_activations(random_state, 15, 8)
+    activations_b = random_activations(random_state, 15, 9)
+    groups = random_state.randint(0, 3, 15)
+    out = hebbian_delta(activations_a, activations_b, 1.0, groups=groups)
+    assert out.shape == (3, 8, 9)
+    for g in range(3):
+        np.testing.assert_allclose(out[g], reference_delta(activations_a[groups == g],
+                                                           activations_b[groups == g], 1.0))
+
+
+def test_hebbian_delta_sweep_matches_single_rates():
+    random_state = np.random.RandomState(3)
+    activations_a = random_activations(random_state, 10, 10)
+    activations_b = random_activations(random_state, 10, 10)
+    learning_rates = [0.1, 1.0, 10.0]
+    out = hebbian_delta_sweep(activations_a, activations_b, learning_rates)
+    for l, learning_rate in enumerate(learning_rates):
+        np.testing.assert_allclose(out[l], reference_delta(activations_a, activations_b, learning_rate))
+
+
+def test_normalize_synapses():
+    random_state = np.random.RandomState(4)
+    weights = random_state.rand(3, 5, 5)
+    expected = weights / weights.sum(axis=(1, 2), keepdims=True)
+    normalized = normalize_synapses(weights)
+    assert normalized is weights
+    np.testing.assert_allclose(normalized, expected)
+
+
+def test_sparse_synapses_match_dense():
+    random_state = np.random.RandomState(6)
+    activations_a = random_activations(random_state, 10, 9)
+    activations_b = random_activations(random_state, 10, 7)
+    sparse = SparseSynapses((9, 7), baseline=0.5, compact_every=20)
+    sparse.update(activations_a, activations_b, 3.0)
+    dense = 0.5 + reference_delta(activations_a, activations_b, 3.0)
+    np.testing.assert_allclose(sparse.toarray(), dense)
+    np.testing.assert_allclose(sparse.sum(), dense.sum())
+    x = random_state.rand(7, 2)
+    np.testing.assert_allclose(sparse @ x, dense @ x)
+    z = random_state.rand(3, 9)
+    np.testing.assert_allclose(z @ sparse, z @ dense)
+    np.testing.assert_allclose(sparse.T.toarray(), dense.T)
+    np.testing.assert_allclose(sparse[4], dense[4])
+    sparse.normalize()
+    np.testing.assert_allclose(sparse.toarray(), dense / dense.sum())
+
+
+def test_sparse_synapses_transpose_follows_updates():
+    random_state = np.random.RandomState(7)
+    sparse = SparseSynapses((5, 5))
+    sparse.update(random_activations(random_state, 3, 5), random_activations(random_state, 3, 5), 1.0)
+    transposed = sparse.T
+    assert sparse.T.matrix is transposed.matrix
+    sparse.update(random_activations(random_state, 3, 5), random_activations(random_state, 3, 5), 1.0)
+    np.testing.assert_allclose(sparse.T.toarray(), sparse.toarray().T)
+    before = transposed.toarray()
+    sparse.scale(2.0)
+    np.testing.assert_allclose(sparse.T.toarray(), sparse.toarray().T)
+    # transposes handed out earlier are not changed
+    np.testing.assert_allclose(transposed.toarray(), before)
+
+
+def test_synapses_round_trip(tmp_path):
+    random_state = np.random.RandomState(8)
+    weights = random_state.rand(6, 6).astype(np.float32)
+    path = str(tmp_path / 'sinapses.npy')
+    assert save_synapses(path, weights) == path
+    np.testing.assert_array_equal(load_synapses(path), weights)
+    loaded = load_synapses(path, mmap=True)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, weights)
+
+
+def test_compressed_synapses_round_trip_from_npy_path(tmp_path):
+    weights = np.random.RandomState(9).rand(6, 6)
+    path = str(tmp_path / 'sinapses.npy')
+    written = save_synapses(path, weights, compressed=True)
+    assert written == str(tmp_path / 'sinapses.npz')
+    assert find_synapses(path) == written
+    np.testing.assert_array_equal(load_synapses(path), weights)
+    other = str(tmp_path / 'sinapses.bin')
+    save_synapses(other, weights, compressed=True)
+    np.testing.assert_array_equal(load_synapses(other), weights)
+
+
+def test_sparse_synapses_round_trip_from_npy_path(tmp_path):
+    random_state = np.random.RandomState(10)
+    sparse = SparseSynapses((5, 4), baseline=0.25)
+    sparse.update(random_activations(random_state, 4, 5), random_activations(random_state, 4, 4), 2.0)
+    path = str(tmp_path / 'sinapses.npy')
+    save_synapses(path, sparse)
+    loaded = load_synapses(path)
+    assert isinstance(loaded, SparseSynapses)
+    np.testing.assert_allclose(loaded.toarray(), sparse.toarray())
+
+
+def test_missing_synapses(tmp_path):
+    path = str(tmp_path / 'missing.npy')
+    assert find_synapses(path) is None
+    with pytest.raises(IOError):
+        load_synapses(path)
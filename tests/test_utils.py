@@ -0,0 +1,39 @@
+import numpy as np
+from utils.utils import ragged_to_sparse_tuple, collapse_duplicates
+
+
+def test_ragged_to_sparse_tuple_matches_dense():
+    random_state = np.random.RandomState(0)
+    ys = [random_state.randint(1, 40, n) for n in [3, 0, 5, 1]]
+    indices, values, dense_shape = ragged_to_sparse_tuple(ys)
+    np.testing.assert_array_equal(dense_shape, [4, 5])
+    dense = np.full(dense_shape, -1)
+    dense[indices[:, 0], indices[:, 1]] = values
+    for y, row in zip(ys, dense):
+        np.testing.assert_array_equal(row[:len(y)], y)
+        assert np.all(row[len(y):] == -1)
+    # no entries for padding
+    assert len(values) == sum(len(y) for y in ys)
+
+
+def test_ragged_to_sparse_tuple_empty_batch():
+    indices, values, dense_shape = ragged_to_sparse_tuple([])
+    assert indices.shape == (0, 2)
+    assert len(values) == 0
+    np.testing.assert_array_equal(dense_shape, [0, 0])
+
+
+def test_collapse_duplicates():
+    xs = np.array([[1.0, 2.0], [0.0, 1.0], [1.0, 2.0], [-0.0, 1.0], [3.0, 3.0]])
+    representatives, weights, inverse = collapse_duplicates(xs)
+    np.testing.assert_array_equal(representatives, [[1, 2], [0, 1], [3, 3]])
+    np.testing.assert_array_equal(weights, [2, 2, 1])
+    np.testing.assert_array_equal(representatives[inverse], xs)
+
+
+def test_collapse_duplicates_weighted_near_duplicates():
+    xs = np.array([[1.0, 2.0], [1.001, 2.0], [5.0, 5.0]])
+    representatives, weights, inverse = collapse_duplicates(xs, sample_weights=[1, 3, 2], decimals=1)
+    np.testing.assert_array_equal(weights, [4, 2])
+    np.testing.assert_array_equal(inverse, [0, 0, 1])
+    np.testing.assert_allclose(representatives, [[(1.0 + 3 * 1.001) / 4, 2.0], [5.0, 5.0]])
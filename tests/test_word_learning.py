@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+pytest.importorskip('tensorflow')
+pytest.importorskip('colour')
+import math
+from models.som.wordLearningTest import getAllInputClass, getAllInputClassAudio, getClassActivations
+from models.som.wordLearningTest import initTrialWorker, runTrialBatch, updatesynapses, updatesynapsesPreLoad
+from models.som.synapses import SparseSynapses
+from models.som.wordLearningTest import propagateActivationsAll, dimN, dimM
+
+
+class IdentitySOM():
+    # activations are the inputs themselves
+    def get_activations_batch(self, input_vects):
+        return np.array(input_vects, dtype=float)
+
+    def get_activations(self, input_vect):
+        return [np.array(input_vect, dtype=float), None]
+
+
+def test_get_all_input_class_visual(tmp_path):
+    visual_file = tmp_path / 'VisualInputTestSet.csv'
+    visual_file.write_text('/home/user/images/10classes/bird/n1.JPEG,0.1,0.2\n'
+                           '/home/user/images/10classes/dog/n2.JPEG,0.3,0.4\n'
+                           '/home/user/images/10classes/bird/n3.JPEG,0.5,0.6\n'
+                           '\n')
+    birds = getAllInputClass(0, str(visual_file))
+    np.testing.assert_allclose(birds, [[0.1, 0.2], [0.5, 0.6]])
+    np.testing.assert_allclose(getAllInputClass(1, str(visual_file)), [[0.3, 0.4]])
+    assert getAllInputClass(9, str(visual_file)) == []
+
+
+def test_get_all_input_class_audio(tmp_path):
+    audio_file = tmp_path / 'audio_prototypes.csv'
+    audio_file.write_text('bird.wav,0.1,0.2,1000\n'
+                          'tree.wav,0.3,0.4,1009\n')
+    np.testing.assert_allclose(getAllInputClassAudio(0, str(audio_file)), [0.1, 0.2])
+    np.testing.assert_allclose(getAllInputClassAudio(9, str(audio_file)), [0.3, 0.4])
+    # 1 is not a prefix match of 1009 nor of 1000
+    assert getAllInputClassAudio(1, str(audio_file)) is None
+
+
+def test_get_class_activations_shape_and_scaling():
+    random_state = np.random.RandomState(0)
+    inputs = {0: random_state.rand(5, 8), 1: random_state.rand(3, 8), 2: random_state.rand(8)}
+    activations = getClassActivations(IdentitySOM(), inputs, [0, 1, 2])
+    # every class is truncated to the single input of class 2
+    assert activations.shape == (3, 1, 8)
+    assert np.all(activations.max(axis=-1) == 10.0)
+    assert np.all((activations == 0) | (activations >= 6.0))
+    assert getClassActivations(IdentitySOM(), inputs, [0, 1], maxSamples=2).shape == (2, 2, 8)
+
+
+@pytest.mark.parametrize('empty', [[], None])
+def test_get_class_activations_empty_class(empty):
+    inputs = {0: np.ones((2, 3)), 1: empty}
+    with pytest.raises(ValueError, match='class 1'):
+        getClassActivations(IdentitySOM(), inputs, [0, 1])
+
+
+def trial_loop(actV, actU, protoClass, iV, iU, initial):
+    # the per-trial loop of the former iterativeTraining
+    nClasses, nSamplesV, _ = actV.shape
+    classes = list(range(nClasses))
+    niter = iV.shape[1]
+    corrects = []
+    for t in range(len(iV)):
+        S = initial[t].copy()
+        for i in range(niter):
+            tinputV = {c: actV[c, iV[t, i, c]] for c in classes}
+            tinputU = {c: actU[c, iU[t, i, c]] for c in classes}
+            S = updatesynapsesPreLoad(S, classes, None, None, tinputV, tinputU, i, niter - 1)
+        S = S.T
+        correct = 0
+        for cl in classes:
+            for j in range(nSamplesV):
+                bmuU = propagateActivationsAll('V', actV[cl, j], S)
+                if protoClass[bmuU] == cl:
+                    correct += 1
+        corrects.append(correct)
+    return corrects
+
+
+def random_trial_data(random_state, nClasses=3, nSamples=4, nNeurons=12):
+    actV = random_state.rand(nClasses, nSamples, nNeurons)
+    actU = random_state.rand(nClasses, nSamples, nNeurons)
+    actV[actV < 0.6] = 0
+    actU[actU < 0.6] = 0
+    protoClass = np.argmax(actU[:, 0, :], axis=0)
+    return actV, actU, protoClass
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_run_trial_batch_matches_the_trial_loop(sparse):
+    actV, actU, protoClass = random_trial_data(np.random.RandomState(0))
+    nTrials, niter, nSamplesU = 5, 3, 2
+    initTrialWorker(actV, actU, protoClass)
+    corrects = runTrialBatch(11, nTrials, niter, nSamplesU, sparse=sparse)
+    # same draws as runTrialBatch
+    rng = np.random.default_rng(11)
+    iV = rng.integers(actV.shape[1], size=(nTrials, niter, actV.shape[0]))
+    iU = rng.integers(nSamplesU, size=(nTrials, niter, actV.shape[0]))
+    shape = (nTrials, actV.shape[2], actV.shape[2])
+    m = 1/math.sqrt(dimN*dimM*dimN*dimM)
+    sd = 1/(1000*math.sqrt(dimN*dimM*dimN*dimM))
+    # sparse synapses start from their constant baseline
+    initial = np.full(shape, m) if sparse else rng.normal(m, sd, shape)
+    np.testing.assert_array_equal(corrects, trial_loop(actV, actU, protoClass, iV, iU, initial))
+
+
+def class_loop_update(S, activationsU, activationsV, lambdaP=5.0):
+    # the per-class, per-neuron loop of the former updatesynapses
+    S = S.copy()
+    for u, v in zip(activationsU, activationsV):
+        for i in range(len(S)):
+            S[i] = S[i] + np.ones(len(v)) - np.exp(-lambdaP * u[i] * v)
+    return S
+
+
+def scaled(x):
+    x = 10.0 * (x - x.min()) / (x.max() - x.min())
+    x[x < 6.0] = 0.0
+    return x
+
+
+def test_updatesynapses_matches_the_class_loop():
+    random_state = np.random.RandomState(1)
+    classes = [0, 1, 2]
+    INPUTV = {c: random_state.rand(7) for c in classes}
+    INPUTU = {c: random_state.rand(6) for c in classes}
+    S = random_state.rand(6, 7)
+    expected = class_loop_update(S, [scaled(INPUTU[c]) for c in classes], [scaled(INPUTV[c]) for c in classes])
+    updated = updatesynapses(S.copy(), classes, IdentitySOM(), IdentitySOM(), INPUTV, INPUTU, 0, 2)
+    np.testing.assert_allclose(updated, expected)
+    normalized = updatesynapses(S.copy(), classes, IdentitySOM(), IdentitySOM(), INPUTV, INPUTU, 1, 2)
+    np.testing.assert_allclose(normalized, expected / expected.sum())
+
+
+def test_updatesynapses_preload():
+    random_state = np.random.RandomState(2)
+    classes = [0, 1]
+    INPUTV = {c: random_state.rand(5) for c in classes}
+    INPUTU = {c: random_state.rand(4) for c in classes}
+    S = random_state.rand(4, 5).astype(np.float32)
+    expected = class_loop_update(S.astype(float), [INPUTU[c] for c in classes], [INPUTV[c] for c in classes])
+    updated = updatesynapsesPreLoad(S, classes, None, None, INPUTV, INPUTU, 0, 1)
+    assert updated is S and updated.dtype == np.float32
+    np.testing.assert_allclose(updated, expected, rtol=1e-5)
+    before = S.copy()
+    normalized = updatesynapsesPreLoad(S, classes, None, None, INPUTV, INPUTU, 1, 1)
+    # the caller's matrix gets the update but is not normalized
+    expected = class_loop_update(before.astype(float), [INPUTU[c] for c in classes], [INPUTV[c] for c in classes])
+    np.testing.assert_allclose(S, expected, rtol=1e-5)
+    np.testing.assert_allclose(normalized, expected / expected.sum(), rtol=1e-5)
+
+
+def test_updatesynapses_preload_sparse():
+    random_state = np.random.RandomState(3)
+    classes = [0, 1]
+    INPUTV = {c: scaled(random_state.rand(5)) for c in classes}
+    INPUTU = {c: scaled(random_state.rand(4)) for c in classes}
+    S = SparseSynapses((4, 5), baseline=0.5)
+    updated = updatesynapsesPreLoad(S, classes, None, None, INPUTV, INPUTU, 1, 1)
+    expected = class_loop_update(np.full((4, 5), 0.5), [INPUTU[c] for c in classes], [INPUTV[c] for c in classes])
+    assert updated is S
+    np.testing.assert_allclose(S.toarray(), expected / expected.sum())
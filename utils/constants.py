@@ -10,6 +10,7 @@ class Constants():
     PLOT_FOLDER = os.path.join(DATA_FOLDER, 'plots')
     AUDIO_DATA_FOLDER = os.path.join(DATA_FOLDER, 'audio')
     TIMIT_DATA_FOLDER = os.path.join(DATA_FOLDER, 'timit')
+    FEATURE_CACHE_FOLDER = os.path.join(DATA_FOLDER, 'feature_cache')
     AVAILABLE_SPEAKERS = ['tom', 'allison', 'daniel', 'ava', 'lee', 'susan', 'tom-130', 'allison-130', 'daniel-130',
                           'ava-130', 'lee-130', 'susan-130']
     LOGGING_LEVEL = logging.INFO
@@ -19,6 +20,8 @@ class Constants():
     VALIDATION_SIZE = 32
     BATCH_SIZE = 32
     OPTIMIZER_DESCR = "adam"
+    # 'lstm_cell', 'block_fused' or 'keras', see models.graves_lstm.bidirectional_rnn
+    RNN_BACKEND = "lstm_cell"
 
     ID_STRING = "graves_" + str(NUM_LAYERS) + "l_" + str(NUM_HIDDEN) + \
         "h_" + str(BATCH_SIZE) + "b_" + OPTIMIZER_DESCR
@@ -52,22 +52,71 @@ def pad_np_arrays(X):
     logging.debug('Shape of dataset after padding: ' + str(np.shape(X_padded)))
     return X_padded
 
+def collapse_duplicates(xs, sample_weights=None, decimals=None):
+    '''
+    Collapses duplicate rows of xs into weighted representatives, so that
+    training on the result costs as much as the number of distinct inputs.
+    Note that SOM.train then runs fewer batches per iteration, so the map
+    does not train the same as on the duplicated rows.
+    If 'decimals' is given, rows are first quantized by rounding to that many
+    decimal places, which also merges near-duplicates; each group is then
+    represented by the weighted mean of its members.
+
+    Returns the representatives (in order of first appearance), their weights
+    (the summed weights of the rows they stand for) and, for each row of xs,
+    the index of its representative.
+    '''
+    xs = np.asarray(xs, dtype=float)
+    if sample_weights is None:
+        sample_weights = np.ones(len(xs))
+    else:
+        sample_weights = np.asarray(sample_weights, dtype=float)
+    keys = xs if decimals is None else np.round(xs, decimals)
+    # adding 0.0 turns -0.0 into 0.0, so that equal rows have equal bytes
+    keys = np.ascontiguousarray(keys + 0.0)
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # renumber the groups by first appearance to keep the input order
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    inverse = rank[inverse.ravel()]
+    weights = np.bincount(inverse, weights=sample_weights, minlength=len(order))
+    if decimals is None:
+        representatives = xs[first[order]]
+    else:
+        representatives = np.zeros((len(order), xs.shape[1]))
+        np.add.at(representatives, inverse, xs * sample_weights[:, np.newaxis])
+        representatives /= weights[:, np.newaxis]
+    logging.debug('Collapsed {} rows into {} representatives'.format(len(xs), len(order)))
+    return representatives, weights, inverse
+
 def array_to_sparse_tuple(X):
-    indices = []
-    values = []
-    for i in range(X.shape[0]):
-        for j in range(X.shape[1]):
-            indices.append([i, j])
-            values.append(X[i, j])
-    return indices, values
+    ''' Indices ([i, j] pairs, row-major) and values of all the elements of a 2-D array.'''
+    X = np.asarray(X)
+    indices = np.indices(X.shape).reshape(2, -1).T
+    return indices, X.ravel()
 
 def array_to_sparse_tuple_1d(X):
-    indices = []
-    values = []
-    for i in range(X.shape[0]):
-        indices.append(i)
-        values.append(X[i])
-    return indices, values
+    X = np.asarray(X)
+    return np.arange(X.shape[0]), X
+
+def ragged_to_sparse_tuple(ys):
+    '''
+    Sparse (indices, values, dense_shape) representation of a list of
+    sequences of different lengths, e.g. the CTC targets of a batch, built
+    from the sequence lengths without padding them first.
+    '''
+    ys = [np.asarray(y) for y in ys]
+    lengths = np.array([len(y) for y in ys], dtype=np.int64)
+    rows = np.repeat(np.arange(len(ys), dtype=np.int64), lengths)
+    # position of each element within its own sequence
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    columns = np.arange(len(rows), dtype=np.int64) - starts
+    indices = np.stack((rows, columns), axis=1)
+    values = np.concatenate(ys) if len(ys) > 0 else np.zeros(0, dtype=np.int32)
+    dense_shape = np.array([len(ys), lengths.max() if len(ys) > 0 else 0], dtype=np.int64)
+    return indices, values, dense_shape
 
 def get_next_batch_index(possible_list):
     i = random.randrange(0, len(possible_list))
@@ -90,7 +139,13 @@ def load_data(filename):
     Loads the data from filename and parses the keys inside
     it to retrieve the labels. Returns a pair xs,ys representing
     the data and the labels respectively
+    filename can also be a folder holding a ragged store (see
+    data.ragged_store), whose examples are memory-mapped
     """
+    if os.path.isdir(filename):
+        from data.ragged_store import open_ragged
+        fields = open_ragged(filename)
+        return fields['xs'], [str(key) for key in fields['keys']]
     data = None
     with (open(filename, "rb")) as file:
         data = pickle.load(file)